@@ -151,6 +151,27 @@ const DashboardPage = () => {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []);
 
+  // =========================
+  // Живые балансы: сервер сам присылает обновления (SSE) вместо повторных запросов
+  // =========================
+  useEffect(() => {
+    if (!API_BASE || !CLIENT_ID_ID || typeof EventSource === 'undefined') return;
+
+    const source = new EventSource(`${API_BASE}/balances/${CLIENT_ID_ID}/stream`);
+    source.addEventListener('balance', (e) => {
+      try {
+        const item = JSON.parse(e.data);
+        if (item.status !== 'ok') return;
+        useBalanceStore.getState().setBalance(item.bank_name, parseAmount(item.balance));
+      } catch (err) {
+        console.warn('⚠️ Не удалось разобрать событие баланса:', err);
+      }
+    });
+
+    return () => source.close();
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, []);
+
   // =========================
   // Подтянуть балансы и положить в store
   // =========================
@@ -160,24 +181,20 @@ const DashboardPage = () => {
     const { setAllBalances } = useBalanceStore.getState();
 
     try {
-      const requests = bankList.map((bank) =>
-        axios
-          .get(`${API_BASE}/available_balance/${bank}/${CLIENT_ID_ID}`)
-          .then((r) => ({ bank, ok: true, data: r.data }))
-          .catch((e) => ({ bank, ok: false, error: e }))
-      );
-
-      const results = await Promise.all(requests);
-      const balances = {};
+      // Один запрос: сервер сам параллельно опрашивает все банки клиента
+      const res = await axios.get(`${API_BASE}/balances/${CLIENT_ID_ID}`);
+      const byBank = {};
+      (res.data?.balances || []).forEach((item) => { byBank[item.bank_name] = item; });
 
-      results.forEach(({ bank, ok, data, error }) => {
-        if (!ok) {
-          console.warn(`⚠️ Баланс ${bank} не получен:`, error?.message || error);
+      const balances = {};
+      bankList.forEach((bank) => {
+        const item = byBank[bank];
+        if (!item || item.status !== 'ok') {
+          console.warn(`⚠️ Баланс ${bank} не получен:`, item?.status || 'нет данных');
           balances[bank] = 0;
           return;
         }
-        const numeric = parseAmount(data?.balance ?? data);
-        balances[bank] = numeric;
+        balances[bank] = parseAmount(item.balance);
       });
 
       // ✅ Устанавливаем всё одним вызовом
@@ -22,34 +22,22 @@ const MyCardsPage = () => {
   const [balances, setBalances] = useState({});
   const [loading, setLoading] = useState(true);
 
-  // 🧩 Загружаем список банков
+  // 🧩💰 Загружаем банки и балансы одним запросом (сервер опрашивает банки параллельно)
   useEffect(() => {
-    const fetchBanks = async () => {
-      try {
-        const res = await axios.get(`${API_BASE}/${CLIENT_ID_ID}/bank_names`);
-        setBanks(res.data);
-        console.log("✅ Банки загружены:", res.data);
-      } catch (err) {
-        console.error("❌ Ошибка при загрузке списка банков:", err);
-      }
-    };
-    fetchBanks();
-  }, []);
-
-  // 💰 Загружаем балансы после получения банков
-  useEffect(() => {
-    if (banks.length === 0) return;
-
     const fetchBalances = async () => {
       try {
+        const res = await axios.get(`${API_BASE}/balances/${CLIENT_ID_ID}`);
+        const items = res.data?.balances || [];
         const results = {};
-        for (const bank of banks) {
-          console.log(`🔹 Запрашиваю баланс для ${bank}...`);
-          const res = await axios.get(`${API_BASE}/available_balance/${bank}/${CLIENT_ID_ID}`);
-          console.log(`✅ Ответ от ${bank}:`, res.data);
-          results[bank] = res.data?.balance || "0 ₽";
-        }
+        items.forEach((item) => {
+          if (item.status !== "ok") {
+            console.warn(`⚠️ Баланс ${item.bank_name} не получен: ${item.status}`);
+          }
+          results[item.bank_name] = item.balance || "0 ₽";
+        });
+        setBanks(items.map((item) => item.bank_name));
         setBalances(results);
+        console.log("✅ Банки и балансы загружены:", res.data);
       } catch (err) {
         console.error("❌ Ошибка при загрузке балансов:", err);
       } finally {
@@ -58,7 +46,7 @@ const MyCardsPage = () => {
     };
 
     fetchBalances();
-  }, [banks]);
+  }, []);
 
   // Функция для форматирования номера карты из API
   const formatCardNumber = (encryptedPan) => {
@@ -1,6 +1,6 @@
 // src/pages/TransferPage.jsx
 
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
 import { usePageInfo } from '../hooks/usePageInfo';
 import InfoPanel from '../components/InfoPanel';
@@ -11,6 +11,14 @@ import { useTelegramUser } from '../hooks/useTelegramUser';
 
 const API_BASE = import.meta.env.VITE_API_BASE; // 🔗 твой FastAPI endpoint
 const CLIENT_ID_ID = import.meta.env.VITE_CLIENT_ID_ID; // 👤 текущий пользователь
+const RECIPIENTS_PAGE_SIZE = 100; // получателей на страницу /get_global_users
+
+// crypto.randomUUID есть только в secure context (https / localhost), по http из локалки — нет
+const newIdempotencyKey = () => {
+  if (typeof crypto.randomUUID === 'function') return crypto.randomUUID();
+  const bytes = crypto.getRandomValues(new Uint8Array(16));
+  return Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+};
 
 const TransferPage = () => {
   const pageInfo = usePageInfo();
@@ -27,9 +35,15 @@ const TransferPage = () => {
   const [showRecipientList, setShowRecipientList] = useState(false);
   const [usersList, setUsersList] = useState([]);
   const [loadingUsers, setLoadingUsers] = useState(false);
+  const [recipientSearch, setRecipientSearch] = useState('');
+  const [nextCursor, setNextCursor] = useState(null);
+  // Номер последнего запроса списка: ответы на устаревший поиск не затирают свежий
+  const usersRequestRef = useRef(0);
   const [formError, setFormError] = useState('');
   const [submitLoading, setSubmitLoading] = useState(false);
   const [showSuccessModal, setShowSuccessModal] = useState(false);
+  // Ключ идемпотентности: повтор того же перевода (например, после таймаута) не спишет деньги дважды
+  const idempotencyRef = useRef({ key: null, signature: null });
 
   // 🎨 Стили банков
   const bankStyles = {
@@ -57,37 +71,50 @@ const TransferPage = () => {
     };
   });
 
-  // 👥 Получение списка пользователей
-  const openRecipientPicker = async () => {
-    setShowRecipientList(true);
-    if (loadingUsers || usersList.length > 0) return;
+  // 👥 Получение списка пользователей: сервер отдаёт global_users постранично,
+  // поиск по началу id (prefix) и следующая страница (cursor) — на стороне сервера
+  const loadRecipients = async (prefix, cursor = null) => {
+    const requestId = ++usersRequestRef.current;
     try {
       setLoadingUsers(true);
-      const res = await axios.get(`${API_BASE}/get_global_users`);
-      const global_users = res.data || {};
-      const usersArr = [
-        {
-          id: 'self',
-          name: telegramUser.displayName || '@me',
-          bank_names: Object.keys(bankBalances || {}),
-        },
-        ...Object.entries(global_users)
-          .filter(([uid]) => uid !== CLIENT_ID_ID)
-          .map(([uid, v]) => ({
-            id: uid,
-            name: `@${uid}`,
-            bank_names: v.bank_names || [],
-          })),
-      ];
-      setUsersList(usersArr);
+      const res = await axios.get(`${API_BASE}/get_global_users`, {
+        params: { limit: RECIPIENTS_PAGE_SIZE, prefix: prefix || undefined, cursor: cursor || undefined },
+      });
+      if (requestId !== usersRequestRef.current) return;
+
+      const page = Object.entries(res.data?.users || {})
+        .filter(([uid]) => uid !== CLIENT_ID_ID)
+        .map(([uid, v]) => ({
+          id: uid,
+          name: `@${uid}`,
+          bank_names: v.bank_names || [],
+        }));
+      const self = {
+        id: 'self',
+        name: telegramUser.displayName || '@me',
+        bank_names: Object.keys(bankBalances || {}),
+      };
+      setUsersList((prev) => (cursor ? [...prev, ...page] : prefix ? page : [self, ...page]));
+      setNextCursor(res.data?.next_cursor || null);
     } catch (err) {
       console.error(err);
       setFormError('Ошибка при получении списка пользователей');
     } finally {
-      setLoadingUsers(false);
+      if (requestId === usersRequestRef.current) setLoadingUsers(false);
     }
   };
 
+  const openRecipientPicker = () => setShowRecipientList(true);
+
+  // Первая страница при открытии и при каждом изменении поиска (с паузой на ввод)
+  useEffect(() => {
+    if (!showRecipientList) return;
+    const prefix = recipientSearch.trim().replace(/^@/, '');
+    const timer = setTimeout(() => loadRecipients(prefix), prefix ? 300 : 0);
+    return () => clearTimeout(timer);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [showRecipientList, recipientSearch]);
+
   // 🧩 Выбор получателя
   const handleRecipientSelect = (recipient) => {
     setSelectedRecipient(recipient);
@@ -114,13 +141,29 @@ const TransferPage = () => {
 
     try {
       setSubmitLoading(true);
-      await axios.post(`${API_BASE}/payments/make_transfer/`, {
+      const payload = {
         user_id_id: CLIENT_ID_ID,
         to_user_id_id: selectedRecipient.id === 'self' ? CLIENT_ID_ID : selectedRecipient.id,
         from_bank: selectedFromBank,
         to_bank: selectedToBank,
         amount: transferAmount,
+      };
+      const signature = JSON.stringify(payload);
+      if (idempotencyRef.current.signature !== signature) {
+        idempotencyRef.current = { key: newIdempotencyKey(), signature };
+      }
+      const res = await axios.post(`${API_BASE}/payments/make_transfer/`, payload, {
+        headers: { 'Idempotency-Key': idempotencyRef.current.key },
       });
+      const result = res.data || {};
+      // Ключ не сбрасываем, пока перевод не выполнен: повтор вернёт тот же результат или выполнит его заново
+      if (res.status < 200 || res.status >= 300 || result.status !== 'success') {
+        if (result.status === 'pending' || result.status === 'in_progress') {
+          return setFormError('Перевод в обработке, статус обновится позже');
+        }
+        return setFormError(result.message || 'Ошибка при выполнении перевода');
+      }
+      idempotencyRef.current = { key: null, signature: null };
 
       transferMoney(selectedFromBank, selectedToBank, transferAmount);
       addTransfer({
@@ -136,7 +179,8 @@ const TransferPage = () => {
       setMessage('');
     } catch (err) {
       console.error(err);
-      setFormError('Ошибка при выполнении перевода');
+      const detail = err.response?.data?.detail;
+      setFormError(typeof detail === 'string' ? detail : 'Ошибка при выполнении перевода');
     } finally {
       setSubmitLoading(false);
     }
@@ -306,22 +350,37 @@ const TransferPage = () => {
                 ✕
               </button>
             </div>
+            <input
+              type="text"
+              value={recipientSearch}
+              onChange={(e) => setRecipientSearch(e.target.value)}
+              placeholder="Поиск по id получателя"
+              className="w-full px-3 py-2 mb-3 bg-gray-100 rounded-xl outline-none"
+            />
+            {usersList.map((u) => (
+              <button
+                key={u.id}
+                onClick={() => handleRecipientSelect(u)}
+                className="w-full text-left px-3 py-3 mb-1 rounded-xl hover:bg-gray-200"
+              >
+                <div className="font-medium">{u.name}</div>
+                <div className="text-xs text-gray-500">
+                  Банки: {u.bank_names.join(', ') || 'Нет подключённых'}
+                </div>
+              </button>
+            ))}
             {loadingUsers ? (
               <div className="text-center text-gray-500 py-6">Загрузка...</div>
-            ) : (
-              usersList.map((u) => (
-                <button
-                  key={u.id}
-                  onClick={() => handleRecipientSelect(u)}
-                  className="w-full text-left px-3 py-3 mb-1 rounded-xl hover:bg-gray-200"
-                >
-                  <div className="font-medium">{u.name}</div>
-                  <div className="text-xs text-gray-500">
-                    Банки: {u.bank_names.join(', ') || 'Нет подключённых'}
-                  </div>
-                </button>
-              ))
-            )}
+            ) : nextCursor ? (
+              <button
+                onClick={() => loadRecipients(recipientSearch.trim().replace(/^@/, ''), nextCursor)}
+                className="w-full py-2 text-sm text-gray-600 hover:text-gray-900"
+              >
+                Показать ещё
+              </button>
+            ) : usersList.length === 0 ? (
+              <div className="text-center text-gray-500 py-6">Никого не нашли</div>
+            ) : null}
           </div>
         </div>
       )}
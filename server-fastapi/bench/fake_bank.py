@@ -0,0 +1,156 @@
+# Локальный фейковый банк для нагрузочных тестов BankHelper (вместо песочницы open.bankingapi.ru)
+#
+#   uvicorn fake_bank:app --port 9000
+#   BANK_URL_TEMPLATE=http://127.0.0.1:9000/{bank}   <- в env основного сервиса
+#
+# Задержка/ошибки настраиваются через env (можно на банк: FAKE_BANK_LATENCY_MS_ABANK=800):
+#   FAKE_BANK_LATENCY_MS   базовая задержка ответа
+#   FAKE_BANK_JITTER_MS    случайная добавка 0..jitter
+#   FAKE_BANK_ERROR_RATE   доля ответов 503 (0..1)
+#   FAKE_BANK_PENDING_RATE доля платежей, которые не проводятся сразу (0..1)
+#   FAKE_BANK_CONSENT_TTL  срок действия согласия, секунды (для проверки фонового обновления)
+#   FAKE_BANK_TX_INTERVAL  одна операция по счёту каждые N секунд (история детерминированная)
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+import asyncio, math, os, random, re
+
+app = FastAPI(title="Fake bank")
+
+stats = Counter()          # (bank, endpoint) -> количество запросов
+payments: dict[str, dict] = {}
+
+
+def _setting(name, bank_name, default):
+    value = os.getenv(f"{name}_{bank_name.upper()}", os.getenv(name))
+    return float(value) if value not in (None, "") else default
+
+
+# Нормализуем путь в имя эндпоинта: /vbank/accounts/acc-1/balances -> accounts/{id}/balances
+def _endpoint(path):
+    path = re.sub(r"/accounts/[^/]+/", "/accounts/{id}/", path)
+    path = re.sub(r"/payments/[^/]+$", "/payments/{id}", path)
+    return path.split("/", 2)[2] if path.count("/") >= 2 else path
+
+
+@app.middleware("http")
+async def simulate_network(request: Request, call_next):
+    parts = request.url.path.strip("/").split("/", 1)
+    if parts[0].startswith("_"):
+        return await call_next(request)
+
+    bank_name = parts[0]
+    stats[(bank_name, _endpoint(request.url.path))] += 1
+
+    latency = _setting("FAKE_BANK_LATENCY_MS", bank_name, 50)
+    jitter = _setting("FAKE_BANK_JITTER_MS", bank_name, 20)
+    await asyncio.sleep((latency + random.uniform(0, jitter)) / 1000)
+
+    if random.random() < _setting("FAKE_BANK_ERROR_RATE", bank_name, 0):
+        return JSONResponse(status_code=503, content={"error": "fake bank is down"})
+    return await call_next(request)
+
+
+@app.post("/{bank_name}/auth/bank-token")
+async def bank_token(bank_name):
+    return {"access_token": f"{bank_name}-token-{uuid4().hex}", "expires_in": 86400}
+
+
+@app.post("/{bank_name}/account-consents/request")
+async def account_consent(bank_name):
+    ttl = _setting("FAKE_BANK_CONSENT_TTL", bank_name, 90 * 86400)
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+    return {"status": "approved", "consent_id": f"{bank_name}-consent-{uuid4().hex}",
+            "expiration_date_time": expires_at.isoformat()}
+
+
+@app.get("/{bank_name}/account-consents/{consent_id}")
+async def account_consent_status(bank_name, consent_id):
+    return {"data": {"consentId": consent_id, "status": "approved"}}
+
+
+@app.get("/{bank_name}/accounts")
+async def accounts(bank_name, client_id: str):
+    client = client_id.rsplit("-", 1)[-1]
+    return {"data": {"account": [
+        {"accountId": f"{bank_name}-acc-{client}", "account": [{"identification": f"40817810{client:0>12}"}]}
+    ]}}
+
+
+@app.get("/{bank_name}/accounts/{account_id}/balances")
+async def balances(bank_name, account_id):
+    amount = f"{random.randint(1000, 100000)}.00"
+    return {"data": {"balance": [{"amount": {"amount": amount, "currency": "RUB"}}]}}
+
+
+# История операций: по одной операции в каждом слоте FAKE_BANK_TX_INTERVAL,
+# id и сумма зависят только от счёта и слота — повторная выгрузка отдаёт те же операции
+@app.get("/{bank_name}/accounts/{account_id}/transactions")
+async def account_transactions(bank_name, account_id, from_booking_date_time: str | None = None,
+                               page: int = 1, limit: int = 100):
+    interval = _setting("FAKE_BANK_TX_INTERVAL", bank_name, 3600)
+    now = datetime.now(timezone.utc).timestamp()
+    since = now - 120 * 86400
+    if from_booking_date_time:
+        parsed = datetime.fromisoformat(from_booking_date_time.replace("Z", "+00:00"))
+        since = max(since, (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp())
+
+    slots = range(math.ceil(since / interval), math.floor(now / interval) + 1)
+    total_pages = max(1, math.ceil(len(slots) / limit))
+    items = []
+    for slot in slots[(page - 1) * limit:page * limit]:
+        rng = random.Random(f"{account_id}-{slot}")
+        credit = rng.random() < 0.3
+        booked = datetime.fromtimestamp(slot * interval, timezone.utc).isoformat()
+        items.append({
+            "accountId": account_id,
+            "transactionId": f"{account_id}-tx-{slot}",
+            "amount": {"amount": f"{rng.randint(100, 50000)}.00", "currency": "RUB"},
+            "creditDebitIndicator": "Credit" if credit else "Debit",
+            "status": "Booked",
+            "bookingDateTime": booked,
+            "valueDateTime": booked,
+            "transactionInformation": "Пополнение" if credit else "Оплата покупки"
+        })
+    return {"data": {"transaction": items}, "meta": {"totalPages": total_pages}}
+
+
+@app.post("/{bank_name}/payment-consents/request")
+async def payment_consent(bank_name):
+    return {"status": "approved", "consent_id": f"{bank_name}-pay-consent-{uuid4().hex}"}
+
+
+@app.post("/{bank_name}/payments")
+async def make_payment(bank_name):
+    payment_id = f"{bank_name}-pay-{uuid4().hex}"
+    pending = random.random() < _setting("FAKE_BANK_PENDING_RATE", bank_name, 0)
+    status = "AcceptedSettlementInProcess" if pending else "AcceptedSettlementCompleted"
+    payments[payment_id] = {"status": status}
+    return {"data": {"paymentId": payment_id, "status": status}}
+
+
+@app.get("/{bank_name}/payments/{payment_id}")
+async def payment_status(bank_name, payment_id):
+    payment = payments.get(payment_id)
+    if payment is None:
+        return JSONResponse(status_code=404, content={"error": "payment not found"})
+    # Со второй проверки платёж считается проведённым
+    status, payment["status"] = payment["status"], "AcceptedSettlementCompleted"
+    return {"data": {"paymentId": payment_id, "status": status}}
+
+
+# Счётчики запросов (для подсчёта upstream-вызовов на запрос в load.py)
+@app.get("/_stats")
+async def get_stats():
+    by_bank: dict[str, dict] = {}
+    for (bank_name, endpoint), count in stats.items():
+        by_bank.setdefault(bank_name, {})[endpoint] = count
+    return {"total": sum(stats.values()), "by_bank": by_bank}
+
+
+@app.post("/_reset")
+async def reset_stats():
+    stats.clear()
+    return {"status": "reset"}
@@ -0,0 +1,161 @@
+# Нагрузочный прогон FastAPI-сервиса против фейкового банка (fake_bank.py)
+#
+#   python load.py --scenario balance --concurrency 50 --duration 30
+#   python load.py --scenario transfer --requests 500 --json result.json
+#
+# Печатает req/s, p50/p95/p99, ошибки и сколько запросов в банк пришлось на один запрос к нам.
+# 429 (лимиты клиента в сервисе) считаются отдельно от ошибок и не входят в перцентили:
+# быстрые отказы лимитера иначе выдают себя за производительность сервиса
+from aiohttp import ClientSession, ClientTimeout
+from uuid import uuid4
+import argparse, asyncio, json, random, time
+
+BANKS = ["vbank", "abank"]
+CLIENTS = [str(i) for i in range(1, 10)]
+
+
+# Один запрос выбранного сценария -> (метод, путь, тело)
+def build_request(scenario):
+    client_id_id = random.choice(CLIENTS)
+    if scenario == "mixed":
+        scenario = random.choices(["balance", "balances", "transfer"], weights=[6, 3, 1])[0]
+
+    if scenario == "balance":
+        return "GET", f"/available_balance/{random.choice(BANKS)}/{client_id_id}", None
+    if scenario == "balances":
+        return "GET", f"/balances/{client_id_id}", None
+    if scenario == "bank_names":
+        return "GET", f"/{client_id_id}/bank_names", None
+    if scenario == "transfer":
+        return "POST", "/payments/make_transfer/", {
+            "user_id_id": client_id_id,
+            "to_user_id_id": random.choice(CLIENTS),
+            "from_bank": random.choice(BANKS),
+            "to_bank": random.choice(BANKS),
+            "amount": 1,
+            "idempotency_key": uuid4().hex
+        }
+    raise ValueError(f"Неизвестный сценарий: {scenario}")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def fake_bank_stats(session, fake_bank_url):
+    if not fake_bank_url:
+        return None
+    async with session.get(f"{fake_bank_url}/_stats") as resp:
+        return await resp.json()
+
+
+async def run(args):
+    latencies = []
+    statuses = {}
+    errors = 0
+    rate_limited = 0
+    sent = 0
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    async with ClientSession(timeout=ClientTimeout(total=args.timeout)) as session:
+        before = await fake_bank_stats(session, args.fake_bank_url)
+
+        async def worker():
+            nonlocal errors, rate_limited, sent
+            while True:
+                if deadline and time.monotonic() >= deadline:
+                    return
+                if args.requests and sent >= args.requests:
+                    return
+                sent += 1
+
+                method, path, body = build_request(args.scenario)
+                started = time.perf_counter()
+                try:
+                    async with session.request(method, args.base_url + path, json=body) as resp:
+                        await resp.read()
+                        statuses[resp.status] = statuses.get(resp.status, 0) + 1
+                        if resp.status == 429:
+                            rate_limited += 1
+                            continue
+                        if resp.status >= 400:
+                            errors += 1
+                except Exception as e:
+                    statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+        after = await fake_bank_stats(session, args.fake_bank_url)
+
+    latencies.sort()
+    report = {
+        "scenario": args.scenario,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),     # без 429
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None
+        },
+        "errors": errors,
+        "rate_limited": rate_limited,
+        "statuses": {str(k): v for k, v in statuses.items()}
+    }
+    if before is not None and after is not None:
+        upstream = after["total"] - before["total"]
+        report["upstream_calls"] = upstream
+        report["upstream_calls_per_request"] = round(upstream / len(latencies), 3) if latencies else None
+        report["upstream_by_bank"] = after["by_bank"]
+    return report
+
+
+def print_report(report):
+    latency = {k: (round(v, 1) if v is not None else None) for k, v in report["latency_ms"].items()}
+    print(f"📊 {report['scenario']}: {report['requests']} запросов за {report['elapsed_s']}с, "
+          f"concurrency={report['concurrency']}")
+    print(f"   req/s: {report['rps']}")
+    print(f"   latency, мс: p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    print(f"   ошибки: {report['errors']}  429: {report['rate_limited']}  статусы: {report['statuses']}")
+    if report["rate_limited"] > report["requests"]:
+        print("   ⚠️ Больше отказов лимитера, чем обслуженных запросов — меряется лимитер, а не сервис. "
+              "Поднимите CLIENT_*_RATE_LIMIT (см. README)")
+    if "upstream_calls" in report:
+        print(f"   запросов в банк: {report['upstream_calls']} "
+              f"({report['upstream_calls_per_request']} на запрос)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон multibank FastAPI")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--fake-bank-url", default="http://127.0.0.1:9000",
+                        help="адрес fake_bank.py для подсчёта upstream-вызовов ('' — не считать)")
+    parser.add_argument("--scenario", default="balance",
+                        choices=["balance", "balances", "bank_names", "transfer", "mixed"])
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=None, help="секунд (по умолчанию — до --requests)")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--json", dest="json_path", default=None, help="сохранить отчёт в файл")
+    args = parser.parse_args()
+    if args.duration:
+        args.requests = None
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
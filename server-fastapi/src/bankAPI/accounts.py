@@ -0,0 +1,198 @@
+from pymongo import ASCENDING, UpdateOne
+from datetime import datetime, timedelta, timezone
+from bankAPI.log import get_logger
+
+logger = get_logger("accounts")
+
+PENDING_CONSENT_FIELDS = ("pending_consent", "pending_consent_status", "pending_consent_expires_at")
+
+
+# Хранилище аккаунтов: один документ на пару (bank_name, client_id_id)
+# Раньше все клиенты банка лежали массивом в одном документе users ({vbank: [...]})
+class AccountStore:
+    def __init__(self, db):
+        self.collection = db.bank_accounts
+        self.legacy = db.users              # старый формат, читаем только для миграции
+
+        # Пока миграция не закончилась — при промахе смотрим ещё и в users
+        self._legacy_migrated = False
+
+
+    # Уникальный составной индекс -> поиск O(log n) и защита от дублей
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("bank_name", ASCENDING), ("client_id_id", ASCENDING)],
+            unique=True,
+            name="bank_client_unique"
+        )
+        # Выборка согласий, которые скоро истекут или ждут одобрения (ConsentRenewer)
+        await self.collection.create_index([("consent_expires_at", ASCENDING)], sparse=True, name="consent_expires_at")
+        await self.collection.create_index([("pending_consent", ASCENDING)], sparse=True, name="pending_consent")
+
+
+    # Аккаунт клиента в банке (или None)
+    async def get(self, bank_name, client_id_id) -> dict | None:
+        client_id_id = str(client_id_id)
+
+        record = await self.collection.find_one(
+            {"bank_name": bank_name, "client_id_id": client_id_id},
+            {"_id": 0}
+        )
+        if record or self._legacy_migrated:
+            return record
+
+        # Онлайн-миграция: переносим запись из старого массива при первом обращении
+        legacy = await self.legacy.find_one(
+            {f"{bank_name}.client_id_id": {"$in": [client_id_id, _as_int(client_id_id)]}},
+            {f"{bank_name}.$": 1}
+        )
+        if not legacy or not legacy.get(bank_name):
+            return None
+
+        fields = _legacy_fields(legacy[bank_name][0])
+        await self.collection.update_one(
+            {"bank_name": bank_name, "client_id_id": client_id_id},
+            {"$setOnInsert": {**fields, "created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        return {"bank_name": bank_name, "client_id_id": client_id_id, **fields}
+
+
+    # Все пары (bank_name, client_id_id) — для фоновых проходов по аккаунтам
+    async def list_keys(self) -> list[tuple[str, str]]:
+        cursor = self.collection.find({}, {"_id": 0, "bank_name": 1, "client_id_id": 1})
+        return [(doc["bank_name"], doc["client_id_id"]) async for doc in cursor]
+
+
+    async def exists(self, bank_name, client_id_id) -> bool:
+        return await self.get(bank_name, client_id_id) is not None
+
+
+    # Создать или обновить аккаунт (точечный upsert, без переписывания чужих документов)
+    async def upsert(self, bank_name, client_id_id, fields: dict):
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"bank_name": bank_name, "client_id_id": str(client_id_id)},
+            {"$set": {**fields, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+            upsert=True
+        )
+
+
+    # Пачка upsert'ов одним bulk_write; record = {"bank_name", "client_id_id", ...поля}
+    async def bulk_upsert(self, records: list[dict]):
+        now = datetime.now(timezone.utc)
+        operations = []
+        for record in records:
+            fields = {k: v for k, v in record.items() if k not in ("bank_name", "client_id_id")}
+            operations.append(UpdateOne(
+                {"bank_name": record["bank_name"], "client_id_id": str(record["client_id_id"])},
+                {"$set": {**fields, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+                upsert=True
+            ))
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+
+
+    # Обновить consent (+ статус и срок действия); False — если такого аккаунта нет.
+    # Ожидавшее одобрения согласие (pending_consent) этим заменено
+    async def set_consent(self, bank_name, client_id_id, consent, status=None, expires_at=None) -> bool:
+        # Гарантируем, что запись уже перенесена из users
+        if not await self.exists(bank_name, client_id_id):
+            return False
+
+        fields = {"consent": consent, "updated_at": datetime.now(timezone.utc)}
+        if status:
+            fields["consent_status"] = status
+        if expires_at:
+            fields["consent_expires_at"] = expires_at
+        result = await self.collection.update_one(
+            {"bank_name": bank_name, "client_id_id": str(client_id_id)},
+            {"$set": fields, "$unset": {"consent_retry_at": "", **{field: "" for field in PENDING_CONSENT_FIELDS}}}
+        )
+        return result.matched_count > 0
+
+
+    # Новое согласие ещё не одобрено клиентом: рабочее consent не трогаем, новое ждёт рядом
+    async def set_pending_consent(self, bank_name, client_id_id, consent, status, expires_at=None):
+        await self.collection.update_one(
+            {"bank_name": bank_name, "client_id_id": str(client_id_id)},
+            {"$set": {
+                "pending_consent": consent,
+                "pending_consent_status": status,
+                "pending_consent_expires_at": expires_at,
+                "updated_at": datetime.now(timezone.utc)
+            }}
+        )
+
+
+    # Аккаунты, у которых согласие истекает раньше before или новое ждёт одобрения
+    # (и обновление / проверка не отложены до consent_retry_at)
+    async def due_for_consent_renewal(self, before, limit) -> list[dict]:
+        now = datetime.now(timezone.utc)
+        cursor = self.collection.find(
+            {"$and": [
+                {"$or": [{"consent_expires_at": {"$lte": before}}, {"pending_consent": {"$exists": True}}]},
+                {"$or": [{"consent_retry_at": {"$exists": False}}, {"consent_retry_at": {"$lte": now}}]}
+            ]},
+            {"_id": 0, "bank_name": 1, "client_id_id": 1, "consent_expires_at": 1}
+        ).sort("consent_expires_at", ASCENDING).limit(limit)
+        return await cursor.to_list(length=limit)
+
+
+    # Обновить согласие не получилось — следующая попытка не раньше чем через delay_seconds
+    async def defer_consent_renewal(self, bank_name, client_id_id, delay_seconds):
+        await self.collection.update_one(
+            {"bank_name": bank_name, "client_id_id": str(client_id_id)},
+            {"$set": {"consent_retry_at": datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)}}
+        )
+
+
+    # Переносим весь старый users в bank_accounts пачками (можно гонять на живом сервере)
+    # $setOnInsert не затирает записи, которые уже успели обновиться в новом формате
+    async def migrate_legacy_users(self, batch_size=500) -> int:
+        migrated = 0
+        operations = []
+
+        async for doc in self.legacy.find({}):
+            for bank_name, records in doc.items():
+                if bank_name == "_id" or not isinstance(records, list):
+                    continue
+                for record in records:
+                    if "client_id_id" not in record:
+                        continue
+                    operations.append(UpdateOne(
+                        {"bank_name": bank_name, "client_id_id": str(record["client_id_id"])},
+                        {"$setOnInsert": {**_legacy_fields(record), "created_at": datetime.now(timezone.utc)}},
+                        upsert=True
+                    ))
+                    if len(operations) >= batch_size:
+                        migrated += await self._flush(operations)
+                        operations = []
+
+        if operations:
+            migrated += await self._flush(operations)
+
+        self._legacy_migrated = True
+        logger.info(f"✅ Миграция users -> bank_accounts завершена, перенесено: {migrated}")
+        return migrated
+
+
+    async def _flush(self, operations) -> int:
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return result.upserted_count
+
+
+def _legacy_fields(record: dict) -> dict:
+    return {
+        "consent": record.get("consent"),
+        "account_id": record.get("account_id"),
+        "bank_account_number": record.get("bank_account_number")
+    }
+
+
+# В старом users client_id_id мог сохраниться числом (range() в lifespan)
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
@@ -0,0 +1,162 @@
+from bankAPI.resilience import BankUnavailableError
+import asyncio, contextvars, json, os, time
+
+# Квота запросов в банк (общий client_id на всех пользователей): token bucket на банк
+BANK_RATE_LIMIT = float(os.getenv("BANK_RATE_LIMIT", "20"))      # запросов в секунду, 0 — без ограничения
+BANK_RATE_BURST = float(os.getenv("BANK_RATE_BURST", "40"))
+# Сколько запрос готов подождать свой токен, прежде чем получить отказ
+BANK_RATE_WAIT = float(os.getenv("BANK_RATE_WAIT", "1"))
+
+# Сброс нагрузки: сколько входящих запросов обрабатываем одновременно,
+# и при какой очереди в банк / задержке банка перестаём пускать в этот банк входящие запросы
+SHED_MAX_IN_FLIGHT = int(os.getenv("SHED_MAX_IN_FLIGHT", "500"))
+SHED_UPSTREAM_QUEUE = int(os.getenv("SHED_UPSTREAM_QUEUE", "50"))
+SHED_UPSTREAM_LATENCY = float(os.getenv("SHED_UPSTREAM_LATENCY", "3"))
+SHED_RETRY_AFTER = 2
+# Сглаживание задержки банка (EWMA); оценка старше окна не считается —
+# иначе после сброса нагрузки новых замеров нет и банк "медленный" навсегда
+LATENCY_ALPHA = 0.2
+LATENCY_WINDOW = 10.0
+
+# Запрос пришёл по пути из upstream_prefixes — его запросы в перегруженный банк сбрасываем.
+# Фоновые задачи (онбординг, согласия, синхронизация операций) не сбрасываем
+_shed_upstream = contextvars.ContextVar("shed_upstream", default=False)
+
+
+# Token bucket с резервированием: запрос берёт токен "в долг" и ждёт своей очереди,
+# поэтому ожидающие выходят по одному с шагом 1/rate, а не все разом
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+
+    # None — токен получен (возможно, после ожидания), иначе — через сколько секунд повторить
+    async def acquire(self, timeout) -> float | None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > timeout:
+            return wait
+        self.tokens -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return None
+
+
+# Допуск запросов: квоты банков + признаки перегрузки для LoadSheddingMiddleware
+class AdmissionControl:
+    def __init__(self, rate=BANK_RATE_LIMIT, burst=BANK_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[str, TokenBucket] = {}
+        self._latency: dict[str, tuple] = {}   # bank_name -> (EWMA задержки в секундах, время замера)
+        self.queue_depth = lambda bank_name=None: 0   # сколько запросов ждут bulkhead (BankHelper подставляет свой)
+        self.stats = {"rate_limited": 0, "shed": 0}
+
+
+    # Токен на запрос в банк; квота кончилась — BankUnavailableError (быстрый 503 с Retry-After)
+    async def acquire(self, bank_name, timeout=BANK_RATE_WAIT):
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.setdefault(bank_name, TokenBucket(self.rate, self.burst))
+        retry_after = await bucket.acquire(timeout)
+        if retry_after is not None:
+            self.stats["rate_limited"] += 1
+            raise BankUnavailableError(bank_name, "rate_limited", retry_after=retry_after)
+
+
+    def record_latency(self, bank_name, seconds):
+        previous, _ = self._latency.get(bank_name, (None, None))
+        latency = seconds if previous is None else previous + LATENCY_ALPHA * (seconds - previous)
+        self._latency[bank_name] = (latency, time.monotonic())
+
+
+    # Актуальные оценки задержки по банкам
+    def latencies(self) -> dict[str, float]:
+        now = time.monotonic()
+        return {bank: latency for bank, (latency, at) in self._latency.items() if now - at <= LATENCY_WINDOW}
+
+
+    # Причина не пускать запросы в банк bank_name или None (другие банки это не задевает)
+    def upstream_overloaded(self, bank_name) -> str | None:
+        if self.queue_depth(bank_name) >= SHED_UPSTREAM_QUEUE:
+            return "upstream_queue"
+        latency, at = self._latency.get(bank_name, (0.0, 0.0))
+        if latency >= SHED_UPSTREAM_LATENCY and time.monotonic() - at <= LATENCY_WINDOW:
+            return "upstream_latency"
+        return None
+
+
+    # Вызывается перед запросом в банк (BankHelper._request): входящий запрос к перегруженному банку —
+    # BankUnavailableError (503 с Retry-After), а /balances отдаст по этому банку статус unavailable
+    def shed(self, bank_name):
+        if not _shed_upstream.get():
+            return
+        reason = self.upstream_overloaded(bank_name)
+        if reason:
+            self.stats["shed"] += 1
+            raise BankUnavailableError(bank_name, reason, retry_after=SHED_RETRY_AFTER)
+
+
+    def status(self) -> dict:
+        return {
+            **self.stats,
+            "queue_depth": self.queue_depth(),
+            "latency_ewma": {bank: round(latency, 3) for bank, latency in self.latencies().items()},
+            "tokens": {bank: round(bucket.tokens, 1) for bank, bucket in self._buckets.items()}
+        }
+
+
+# ASGI-middleware сброса нагрузки: при перегрузке сразу 503 + Retry-After,
+# чтобы запросы не копились в очередях и не падали по таймауту все вместе.
+# upstream_prefixes — пути, которые ходят в банк: их помечаем, а перегрузку конкретного банка
+# проверяет AdmissionControl.shed перед запросом в него (медленный банк не блокирует остальные)
+class LoadSheddingMiddleware:
+    def __init__(self, app, admission: AdmissionControl, upstream_prefixes=(), max_in_flight=SHED_MAX_IN_FLIGHT):
+        self.app = app
+        self.admission = admission
+        self.upstream_prefixes = tuple(upstream_prefixes)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        if self.in_flight >= self.max_in_flight:
+            self.admission.stats["shed"] += 1
+            return await _reject(send, "too_many_requests")
+
+        token = _shed_upstream.set(scope["path"].startswith(self.upstream_prefixes))
+        try:
+            # Долгие SSE-подписки не занимают места обычных запросов
+            if scope["path"].endswith("/stream"):
+                return await self.app(scope, receive, send)
+
+            self.in_flight += 1
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.in_flight -= 1
+        finally:
+            _shed_upstream.reset(token)
+
+
+async def _reject(send, reason):
+    body = json.dumps({"detail": "Сервис перегружен, повторите позже", "reason": reason}, ensure_ascii=False).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"retry-after", str(SHED_RETRY_AFTER).encode()),
+            (b"content-length", str(len(body)).encode())
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
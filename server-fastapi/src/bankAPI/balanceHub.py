@@ -0,0 +1,106 @@
+import asyncio, os
+from bankAPI.log import get_logger
+
+# Как часто обновляем баланс аккаунта, пока на него кто-то подписан (секунды)
+BALANCE_PUSH_INTERVAL = float(os.getenv("BALANCE_PUSH_INTERVAL", "15"))
+# Очередь событий одного подписчика; медленный подписчик теряет старые события, а не тормозит остальных
+SUBSCRIBER_QUEUE_SIZE = 32
+
+logger = get_logger("balance_hub")
+
+
+# Живые балансы: один цикл обновления на аккаунт (bank_name, client_id_id),
+# сколько бы подписчиков (вкладок, устройств) на него ни смотрело
+class BalanceHub:
+    def __init__(self, bank_helper, interval=BALANCE_PUSH_INTERVAL):
+        self.bank_helper = bank_helper
+        self.interval = interval
+
+        self._subscribers: dict[tuple, set[asyncio.Queue]] = {}
+        self._loops: dict[tuple, asyncio.Task] = {}
+        self._wakeups: dict[tuple, asyncio.Event] = {}
+        self._last: dict[tuple, dict] = {}
+
+        # После перевода BankHelper сбрасывает кэш — сразу обновляем подписчиков
+        bank_helper.add_balance_listener(self._on_invalidated)
+
+
+    # Подписка на все банки клиента: асинхронный генератор событий {"bank_name", "status", "balance"}
+    # Если heartbeat секунд ничего не происходило — отдаёт None (для пинга соединения)
+    async def subscribe(self, client_id_id, heartbeat=None):
+        client_id_id = str(client_id_id)
+        bank_names = await self.bank_helper.get_client_bank_names(client_id_id)
+        keys = [(bank_name, client_id_id) for bank_name in bank_names]
+
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        for key in keys:
+            self._subscribers.setdefault(key, set()).add(queue)
+            if key in self._last:
+                queue.put_nowait(self._last[key])        # последнее известное значение сразу
+            if key not in self._loops:
+                self._wakeups[key] = asyncio.Event()
+                self._loops[key] = asyncio.create_task(self._refresh_loop(key))
+
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            for key in keys:
+                self._unsubscribe(key, queue)
+
+
+    def _unsubscribe(self, key, queue):
+        subscribers = self._subscribers.get(key)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            # Последний подписчик ушёл — цикл обновления аккаунта больше не нужен
+            del self._subscribers[key]
+            self._loops.pop(key).cancel()
+            self._wakeups.pop(key, None)
+            self._last.pop(key, None)
+
+
+    async def _refresh_loop(self, key):
+        bank_name, client_id_id = key
+        while True:
+            try:
+                # Идёт через кэш и single-flight BankHelper: параллельные запросы склеиваются в один
+                balance = await self.bank_helper.get_account_available_balance(bank_name, client_id_id, fresh=True)
+                event = {"bank_name": bank_name, "status": "ok", "balance": balance}
+            except Exception as e:
+                logger.warning(f"⚠️ Живой баланс {bank_name}/{client_id_id} не обновился: {e}")
+                event = {"bank_name": bank_name, "status": "error", "balance": None}
+
+            if event != self._last.get(key):
+                self._last[key] = event
+                self._publish(key, event)
+
+            wakeup = self._wakeups[key]
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+
+
+    def _publish(self, key, event):
+        for queue in self._subscribers.get(key, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+    def _on_invalidated(self, bank_name, client_id_id):
+        wakeup = self._wakeups.get((bank_name, str(client_id_id)))
+        if wakeup:
+            wakeup.set()
+
+
+    async def close(self):
+        for task in self._loops.values():
+            task.cancel()
@@ -1,186 +1,436 @@
-from aiohttp import ClientSession
 from fastapi import HTTPException
 from async_lru import alru_cache
 from datetime import datetime, timedelta, timezone
-import os, re
-
-#Передаем только db
+from bankAPI.cache import TTLCache, SingleFlight
+from bankAPI.transport import BankTransport, BankResponse
+from bankAPI.resilience import BankResilience, BankUnavailableError
+from bankAPI.metrics import observe_bank_request
+from bankAPI.admission import AdmissionControl
+from bankAPI.hedging import Hedger
+from bankAPI.coordination import LocalCoordinator
+from bankAPI.consents import CONSENT_DEAD_STATUSES, CONSENT_ERROR_STATUSES, CONSENT_RETRY_MIN_INTERVAL, as_utc, \
+    consent_approved, consent_expires_at, consent_needs_renewal, consent_renewal_deferred
+from bankAPI.log import get_logger
+from bankAPI.transfers import TERMINAL_STATES
+from bankAPI.transactions import transaction_row
+from bankAPI.payments import SETTLED_STATUSES, FAILED_STATUSES, PAYMENT_POLL_INTERVAL, recheck_delay, is_expired
+from uuid import uuid4
+import asyncio, os, re, time
+
+# Время жизни access_token банка и запас, за который начинаем обновлять его в фоне
+TOKEN_TTL = timedelta(hours=24)
+TOKEN_REFRESH_MARGIN = timedelta(minutes=30)
+# Несколько воркеров (COORDINATION=mongo): сколько держим общий лок на обновление токена
+# и как часто остальные проверяют, не появился ли новый токен в БД
+TOKEN_LOCK_TTL = float(os.getenv("TOKEN_LOCK_TTL", "15"))
+TOKEN_WAIT_POLL = 0.2
+
+# Кэш аккаунтов (consent, account_id, номер счёта) для горячих путей
+ACCOUNT_CACHE_SIZE = int(os.getenv("ACCOUNT_CACHE_SIZE", "10000"))
+ACCOUNT_CACHE_TTL = float(os.getenv("ACCOUNT_CACHE_TTL", "300"))
+
+# Сколько ждём один банк при агрегированном запросе балансов (секунды)
+BALANCE_BANK_TIMEOUT = float(os.getenv("BALANCE_BANK_TIMEOUT", "5"))
+
+# Кэш балансов (stale-while-revalidate): до FRESH отдаём как есть,
+# до STALE отдаём сразу и обновляем в фоне, дальше — ждём свежий ответ банка
+BALANCE_FRESH_TTL = float(os.getenv("BALANCE_FRESH_TTL", "5"))
+BALANCE_STALE_TTL = float(os.getenv("BALANCE_STALE_TTL", "60"))
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", "10000"))
+# Несколько воркеров: поколение баланса аккаунта в общем кэше — перевод в любом воркере делает
+# локальные копии остальных недействительными. Живёт дольше любой локальной копии
+BALANCE_GENERATION_TTL = 24 * 3600
+
+# Пакетные переводы: сколько переводов одного банка-отправителя обрабатываем одновременно
+BATCH_BANK_CONCURRENCY = int(os.getenv("BATCH_BANK_CONCURRENCY", "5"))
+
+# Синхронизация операций: размер страницы запроса к банку и предел страниц за один проход по счёту
+TRANSACTIONS_FETCH_PAGE_SIZE = int(os.getenv("TRANSACTIONS_FETCH_PAGE_SIZE", "100"))
+TRANSACTIONS_FETCH_MAX_PAGES = int(os.getenv("TRANSACTIONS_FETCH_MAX_PAGES", "50"))
+
+# Банк отклонил платёж: так отвечаем и на сам перевод, и на его повтор по Idempotency-Key
+PAYMENT_FAILED_STATUS = 502
+
+# Страница /get_global_users
+GLOBAL_USERS_PAGE_SIZE = 100
+GLOBAL_USERS_MAX_PAGE_SIZE = 1000
+# Ответы по global_users кэшируются по версии коллекции (растёт при каждой записи)
+GLOBAL_USERS_CACHE_SIZE = int(os.getenv("GLOBAL_USERS_CACHE_SIZE", "2000"))
+
+logger = get_logger("bank_helper")
+
+# Хранилища передаём набором (bankAPI.storage): Mongo или в памяти
 class BankHelper:
-    def __init__(self, db, session):
-        self.db = db
-
-        # Создаем сессию йоу davvk
-        self._session = session
+    def __init__(self, storage, transport: BankTransport, coordinator=None, admission=None):
+        self.storage = storage
+        # Координация между воркерами: общий лок на токены и общий кэш балансов (bankAPI.coordination)
+        self.coordinator = coordinator or LocalCoordinator()
+
+        # Пулы соединений к банкам (своя сессия на банк) йоу davvk
+        self._transport = transport
+        # Bulkhead, circuit breaker и повторы — на каждый банк отдельно
+        self._resilience = BankResilience()
+        # Квота запросов в банк (token bucket) и сигналы перегрузки для сброса нагрузки
+        self.admission = admission or AdmissionControl()
+        self.admission.queue_depth = self._resilience.queue_depth
+        # Дубли медленных идемпотентных GET (HEDGE_REQUESTS=1) — против хвостовых задержек
+        self.hedger = Hedger()
         self.base_url = os.getenv("BASE_URL", "open.bankingapi.ru") 
+        # Адрес банка; для локального фейкового банка: BANK_URL_TEMPLATE=http://127.0.0.1:9000/{bank}
+        self.bank_url_template = os.getenv("BANK_URL_TEMPLATE", "https://{bank}.{base_url}")
 
         # bank-token
         self.client_id = os.getenv("CLIENT_ID")
         self.client_secret = os.getenv("CLIENT_SECRET")
 
+        # In-memory кэш токенов: bank_name -> {"access_token", "expires_at"}
+        self._tokens: dict[str, dict] = {}
+        # Single-flight: не больше одного обновления токена на банк одновременно
+        self._token_locks: dict[str, asyncio.Lock] = {}
+        self._token_refresh_tasks: dict[str, asyncio.Task] = {}
+
+        # Аккаунты клиентов (с согласиями): один документ на (bank_name, client_id_id)
+        self.accounts = storage.accounts
+        self._migration_task: asyncio.Task | None = None
+        # Банки и их access_token
+        self.tokens = storage.tokens
+        # Банки каждого пользователя + версия для ETag
+        self.global_users = storage.global_users
+        # Переводы с состоянием и ключом идемпотентности
+        self.transfers = storage.transfers
+        # История операций, синхронизированная из банков
+        self.transactions = storage.transactions
+        # (bank_name, client_id_id) -> запись из bank_accounts
+        self._account_cache = TTLCache(maxsize=ACCOUNT_CACHE_SIZE, ttl=ACCOUNT_CACHE_TTL)
+        # Перезапрос согласия — один на аккаунт, даже если 401 получили сразу несколько запросов
+        self._consent_flight = SingleFlight()
+
+        # (bank_name, client_id_id) -> {"balance", "fetched_at"}
+        self._balance_cache = TTLCache(maxsize=BALANCE_CACHE_SIZE, ttl=BALANCE_STALE_TTL)
+        # Поколение ключа: растёт при инвалидации, чтобы старый запрос не записал устаревший баланс
+        self._balance_generation: dict[tuple, int] = {}
+        self._balance_flight = SingleFlight()
+        # Кого уведомить, когда баланс аккаунта сброшен (живые подписки BalanceHub)
+        self._balance_listeners: list = []
+
+        # Кэш ответов по global_users: (версия, ...) -> данные
+        self._global_users_cache = TTLCache(maxsize=GLOBAL_USERS_CACHE_SIZE, ttl=float("inf"))
+
+        # Регистрация банка (add_bank) — один раз, даже если онбординг идёт параллельно
+        self._known_banks: set[str] = set()
+        self._bank_flight = SingleFlight()
+
+
+    # Индексы + онлайн-миграция старого users (сервер при этом уже работает)
+    async def start(self):
+        await self.coordinator.ensure_indexes()
+        await self.storage.ensure_indexes()
+        self.storage.start()
+        self._migration_task = asyncio.create_task(self.accounts.migrate_legacy_users())
+
+    # Сходить в банк за данными аккаунта, ничего не записывая в БД
+    # None — если такой аккаунт уже есть
+    async def discover_account(self, bank_name, client_id_id) -> dict | None:
+        client_id_id = str(client_id_id)
+
+        await self.ensure_bank(bank_name)
 
+        # Проверяем, есть ли уже такой client_id_id в банке
+        if await self.accounts.exists(bank_name, client_id_id):
+            logger.debug(f"⚠️ Аккаунт с id '{client_id_id}' уже существует в банке '{bank_name}' — пропускаем")
+            return None
 
-    # Add new аккаунт банка (Не создает сразу а акканут для всех банков, а только для 1)
-    async def add_new_account(self, bank_name, client_id_id):
-        db = self.db
+        access_token = await self.get_access_token(bank_name=bank_name)
+        consent = await self.request_account_consent(bank_name=bank_name, access_token=access_token, client_id_id=client_id_id)
+        # Один GET /accounts на все счета клиента
+        accounts = await self.fetch_accounts(bank_name, access_token, consent["consent"], client_id_id)
 
-        # Проверяем, есть ли банк в users
-        bank_exists = await db.users.find_one({bank_name: {"$exists": True}})
-        if not bank_exists:
-            print(f"⚠️ Банк '{bank_name}' не найден в users. Создаю новый банк...")
-            await self.add_bank(bank_name)
+        return {
+            "bank_name": bank_name,
+            "client_id_id": client_id_id,
+            **consent,
+            **_primary_account_fields(accounts)
+        }
 
-        # Проверяем, есть ли уже такой client_id_id в банке
-        existing_user = await db.users.find_one(
-            {f"{bank_name}.client_id_id": client_id_id},
-            {f"{bank_name}.$": 1}
-        )
 
-        if existing_user:
-            print(f"⚠️ Аккаунт с id '{client_id_id}' уже существует в банке '{bank_name}' — пропускаем")
-            return {"status": "already_exists"}
-        
-        access_token = await self.get_access_token(bank_name=bank_name)
-        consent = await self.make_and_get_account_consent(bank_name=bank_name, access_token=access_token, client_id_id=client_id_id)
-        account_id = await self.get_account_id(bank_name, access_token, consent, client_id_id)
-        bank_account_number = await self.get_bank_account_number(bank_name, access_token, consent, client_id_id)
-
-        # Если клиента нет — добавляем нового + Добавляем в global_users
-        await db.users.update_one(
-            {bank_name: {"$exists": True}},
-            {"$push": {bank_name: {
-                "client_id_id": client_id_id,
-                "consent": consent,
-                "account_id": account_id,
-                "bank_account_number": bank_account_number
-            }}},
-            upsert=True
-        )
+    # Записать пачку аккаунтов: bank_accounts + global_users, по одному bulk_write на коллекцию
+    async def save_accounts(self, records: list[dict]):
+        if not records:
+            return
+
+        await self.accounts.bulk_upsert(records)
 
         # ОБЩИЙ СПИСОК ВСЕХ ЮЗЕРОВ
-        # Добавляем банк пользователю, если его нет
-        await db.global_users.update_one(
-            {"user_id_id": client_id_id},
-            {"$addToSet": {"bank_names": bank_name}},  # добавит, если нет
-            upsert=True  # создаст документ, если такого user_id_id нет
-        )
+        # Добавляем банк пользователю, если его нет (версия global_users растёт после записи)
+        await self.global_users.add_banks(records)
+
+
+    # --------------------------- Версия global_users (ETag) ---------------------------------------------
+    async def global_users_version(self) -> int:
+        return await self.global_users.version()
+
+    # Чтение global_users через кэш текущей версии: (версия, данные)
+    # Запись поднимает версию, и старые ключи кэша просто перестают запрашиваться (вытесняет LRU)
+    async def _read_global_users(self, key: tuple, load) -> tuple[int, object]:
+        version = await self.global_users_version()
+        data = self._global_users_cache.get((version, *key))
+        if data is None:
+            data = await load()
+            self._global_users_cache.set((version, *key), data)
+        return version, data
+
+
+    # Банк зарегистрирован в bank_names (проверяем один раз на процесс)
+    async def ensure_bank(self, bank_name):
+        if bank_name in self._known_banks:
+            return
+        await self._bank_flight.do(bank_name, lambda: self._ensure_bank(bank_name))
+
+    async def _ensure_bank(self, bank_name):
+        # Проверяем, есть ли банк в bank_names
+        if not await self.tokens.bank_exists(bank_name):
+            logger.warning(f"⚠️ Банк '{bank_name}' не найден в bank_names. Создаю новый банк...")
+            await self.add_bank(bank_name)
+        self._known_banks.add(bank_name)
 
-        print(f"✅ Аккаунт банка: {bank_name} с id: {client_id_id} создан!")
-        return {"status": "added"}
 
+    # Страница global_users по курсору (user_id_id последнего на прошлой странице)
+    # prefix — поиск по началу user_id_id (якорный regex использует индекс);
+    # вместе со страницей — версия global_users, от которой она посчитана (для ETag)
+    async def read_global_users(self, limit=GLOBAL_USERS_PAGE_SIZE, cursor=None, prefix=None) -> tuple[int, dict]:
+        limit = max(1, min(int(limit), GLOBAL_USERS_MAX_PAGE_SIZE))
+        return await self._read_global_users(
+            ("page", limit, cursor, prefix), lambda: self._load_global_users(limit, cursor, prefix)
+        )
 
-    async def get_global_users(self) -> dict:
-        db = self.db
+    async def _load_global_users(self, limit, cursor, prefix) -> dict:
 
         global_users = {}
-        async for doc in db.global_users.find({}, {"_id": 0}):
-            user_id = doc["user_id_id"]
-            global_users[user_id] = {
+        last_user_id = None
+        has_more = False
+        for doc in await self.global_users.page(limit + 1, cursor, prefix):
+            if len(global_users) == limit:
+                has_more = True
+                break
+            last_user_id = doc["user_id_id"]
+            global_users[last_user_id] = {
                 "bank_names": doc.get("bank_names", [])
             }
-        return global_users
+
+        return {"users": global_users, "next_cursor": last_user_id if has_more else None}
+
+    # Все global_users потоком, без загрузки коллекции в память (для NDJSON-выгрузки)
+    async def iter_global_users(self, prefix=None, batch_size=500):
+        async for doc in self.global_users.iter(prefix, batch_size):
+            yield {"user_id_id": doc["user_id_id"], "bank_names": doc.get("bank_names", [])}
+
+
+
+    # --------------------------- HTTP к банкам ----------------------------------------------------------
+    # Единая точка исходящих запросов: пул банка + bulkhead + circuit breaker,
+    # повторы с джиттером только для идемпотентных запросов (по умолчанию — GET)
+    # operation — имя вызова для метрик и Server-Timing (token, balances, payment, ...)
+    # GET из HEDGE_OPERATIONS при HEDGE_REQUESTS=1: если банк не ответил за свой p95 — второй такой же запрос
+    async def _request(self, bank_name, method, path, operation=None, idempotent=None, **kwargs) -> BankResponse:
+        if idempotent is None:
+            idempotent = method == "GET"
+        operation = operation or path
+
+        # Каждая попытка (включая ретраи) — отдельное наблюдение в гистограмме
+        async def attempt():
+            started = time.perf_counter()
+            status = "error"
+            try:
+                async with self._transport.session(bank_name).request(
+                    method, self._bank_url(bank_name) + path, **kwargs
+                ) as resp:
+                    status = resp.status
+                    return BankResponse(resp.status, await resp.text())
+            except asyncio.TimeoutError:
+                status = "timeout"
+                raise
+            except asyncio.CancelledError:
+                status = "cancelled"      # проигравший hedged-запрос
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                observe_bank_request(bank_name, operation, status, elapsed)
+                if status != "cancelled":
+                    self.admission.record_latency(bank_name, elapsed)
+                    self.hedger.record(bank_name, operation, elapsed)
+
+        async def send():
+            # Общая квота client_id: без токена в банк не идём (дубль тоже тратит квоту)
+            await self.admission.acquire(bank_name)
+            return await self._resilience.call(bank_name, attempt, retry=idempotent)
+
+        # Банк перегружен — входящий запрос к нему сразу получает 503, остальные банки работают
+        self.admission.shed(bank_name)
+        if method == "GET" and self.hedger.applies(operation):
+            # Банк и так перегружен — дубли только добавят ему очереди
+            return await self.hedger.run(
+                bank_name, operation, send, can_hedge=lambda: self.admission.upstream_overloaded(bank_name) is None
+            )
+        return await send()
 
 
+    def _bank_url(self, bank_name) -> str:
+        return self.bank_url_template.format(bank=bank_name, base_url=self.base_url)
+
 
     # --------------------------- Access-token services --------------------------------------------------
     # Добавляем новые банки в banks_names
     async def add_bank(self, bank_name: str) -> dict:
-        db = self.db
-
-        # Проверяем, есть ли уже запись с таким bank_name
-        existing = await db.bank_names.find_one({"bank_name": bank_name})
-        if existing:
-            print(f"⚠️ Банк '{bank_name}' уже существует")
+        # Атомарно: проверка и вставка одним upsert
+        if not await self.tokens.add_bank(bank_name):
+            logger.warning(f"⚠️ Банк '{bank_name}' уже существует")
             return {"status": "exists", "bank_name": bank_name}
 
-
-        # Добавления
-
-        # Добавляем новую запись в bank_names
-        await db.bank_names.insert_one({    
-            "bank_name": bank_name
-        })
+        # Запись в access_tokens создаёт сам get_access_token (upsert)
         access_token = await self.get_access_token(bank_name)
         if not access_token:
-            print(f"⚠️ Не удалось получить токен при добавлении банка {bank_name}")
+            logger.warning(f"⚠️ Не удалось получить токен при добавлении банка {bank_name}")
             return {"status": "error", "bank_name": bank_name}
-    
-        # Добавляем новую запись в access_tokens
-        await db.access_tokens.insert_one({    
-            "bank_name": bank_name,
-            "access_token": access_token,
-            "updated_at": datetime.now(timezone.utc)
-        })
-
-        # Добавляем новый банк в котором список пользователей
-        await db.users.insert_one({
-            bank_name: []
-        })
 
 
-
-        print(f"✅ Банк '{bank_name}' добавлен\tAccess-token добавлен")
+        logger.info(f"✅ Банк '{bank_name}' добавлен\tAccess-token добавлен")
         return {"status": "added", "bank_name": bank_name}
 
     
     # Возвращает access_token конкретного банка
-    async def get_access_token(self, bank_name) -> dict:
-        db = self.db
-
-        # Выдача из БД
-        record = await db.access_tokens.find_one({"bank_name": bank_name})
-        if record:
-            updated_at = record.get("updated_at")
-            # Проверяем срок действия (24 часа)
-            if updated_at:
-                if updated_at.tzinfo is None:
-                    updated_at = updated_at.replace(tzinfo=timezone.utc)
-
-                delta = datetime.now(timezone.utc) - updated_at
-                if delta < timedelta(hours=24):
-                    # Ещё свежий токен
-                    access_token = record.get("access_token")
+    # Сначала смотрим в память, Mongo — только запасной вариант (например, после рестарта)
+    async def get_access_token(self, bank_name) -> str | None:
+        cached = self._tokens.get(bank_name)
+        if cached:
+            left = cached["expires_at"] - datetime.now(timezone.utc)
+            if left > TOKEN_REFRESH_MARGIN:
+                return cached["access_token"]
+            if left > timedelta(0):
+                # Токен скоро протухнет — отдаём текущий и обновляем в фоне
+                self._schedule_token_refresh(bank_name)
+                return cached["access_token"]
+
+        # Токена нет или он протух — ждём единственное обновление
+        return await self._refresh_access_token(bank_name, use_db=True)
+
+    # Фоновое обновление токена (не чаще одной задачи на банк)
+    def _schedule_token_refresh(self, bank_name):
+        task = self._token_refresh_tasks.get(bank_name)
+        if task and not task.done():
+            return
+        self._token_refresh_tasks[bank_name] = asyncio.create_task(
+            self._refresh_access_token(bank_name, use_db=False)
+        )
+
+    # Single-flight обновление токена банка
+    async def _refresh_access_token(self, bank_name, use_db) -> str | None:
+        lock = self._token_locks.setdefault(bank_name, asyncio.Lock())
+        async with lock:
+            # Пока ждали лок, токен мог обновить кто-то другой
+            cached = self._tokens.get(bank_name)
+            if cached and cached["expires_at"] - datetime.now(timezone.utc) > TOKEN_REFRESH_MARGIN:
+                return cached["access_token"]
+
+            # Выдача из БД (с несколькими воркерами токен мог обновить соседний процесс)
+            if use_db or self.coordinator.shared:
+                access_token = await self._load_access_token(bank_name)
+                if access_token:
                     return access_token
-        
-        # Если в БД стухло( Если истек срок годности access_token ) 
-        async with self._session.post(
-            url=f"https://{bank_name}.{self.base_url}/auth/bank-token",
-            params={
-                "client_id": self.client_id,
-                "client_secret": self.client_secret
-            },
-            timeout=15
-            ) as resp:
-            result = await resp.json()
-            if not result or "access_token" not in result:
-                print(f"⚠️ Не удалось получить токен для {bank_name}")
-                return None
-            access_token = result.get("access_token")
-
-            # ✅ Обновляем токен и дату в базе
-            await self.update_access_token(bank_name, access_token)
-
-            return access_token
-        
-    # Обновляем access_token для конкретного банка :) (Особо не использую, чисто ради стиля в update_access_tokens)
-    async def update_access_token(self, bank_name, new_access_token):
-        db = self.db
 
+            if not self.coordinator.shared:
+                return await self._fetch_access_token(bank_name, cached)
+
+            # Несколько воркеров: в банк за токеном идёт только владелец лока, остальные ждут его в БД
+            lock_name = f"token:{bank_name}"
+            if not await self.coordinator.acquire(lock_name, TOKEN_LOCK_TTL):
+                access_token = await self._wait_for_shared_token(bank_name)
+                if access_token:
+                    return access_token
+                # Владелец лока так и не обновил токен (упал?) — идём сами
+            try:
+                return await self._load_access_token(bank_name) or await self._fetch_access_token(bank_name, cached)
+            finally:
+                await self.coordinator.release(lock_name)
+
+    # Свежий токен из access_tokens -> в память; протух или нет — None
+    async def _load_access_token(self, bank_name) -> str | None:
+        record = await self.tokens.get(bank_name)
+        if not (record and record.get("updated_at") and record.get("access_token")):
+            return None
+
+        updated_at = record["updated_at"]
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+
+        expires_at = record.get("expires_at") or updated_at + TOKEN_TTL
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at - datetime.now(timezone.utc) <= TOKEN_REFRESH_MARGIN:
+            return None
+
+        # Ещё свежий токен
+        self._tokens[bank_name] = {"access_token": record["access_token"], "expires_at": expires_at}
+        return record["access_token"]
+
+    # Ждём, пока токен обновит воркер, взявший лок (не дольше TOKEN_LOCK_TTL)
+    async def _wait_for_shared_token(self, bank_name) -> str | None:
+        deadline = time.monotonic() + TOKEN_LOCK_TTL
+        while time.monotonic() < deadline:
+            await asyncio.sleep(TOKEN_WAIT_POLL)
+            access_token = await self._load_access_token(bank_name)
+            if access_token:
+                return access_token
+        return None
+
+    # Запрос нового токена в банк + запись в память и БД
+    async def _fetch_access_token(self, bank_name, cached) -> str | None:
+        # Если в БД стухло( Если истек срок годности access_token )
+        try:
+            resp = await self._request(
+                bank_name, "POST", "/auth/bank-token", operation="token",
+                params={
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret
+                }
+            )
+            result = resp.json()
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка при обновлении токена {bank_name}: {e}")
+            result = None
+
+        if not result or "access_token" not in result:
+            logger.warning(f"⚠️ Не удалось получить токен для {bank_name}")
+            # Если старый токен ещё жив — продолжаем им пользоваться
+            if cached and cached["expires_at"] > datetime.now(timezone.utc):
+                return cached["access_token"]
+            return None
+        access_token = result.get("access_token")
+
+        # Банк может сам сказать, сколько живёт токен
+        ttl = TOKEN_TTL
+        if result.get("expires_in"):
+            ttl = min(TOKEN_TTL, timedelta(seconds=int(result["expires_in"])))
+        expires_at = datetime.now(timezone.utc) + ttl
+        self._tokens[bank_name] = {"access_token": access_token, "expires_at": expires_at}
+
+        # ✅ Обновляем токен и дату в базе
+        await self.update_access_token(bank_name, access_token, expires_at)
+
+        return access_token
+
+    # Обновляем access_token для конкретного банка :) (Персистентная копия in-memory кэша)
+    # Пишется сразу (и при WRITE_BEHIND=1): соседние воркеры ждут токен в Mongo, пока держим лок
+    async def update_access_token(self, bank_name, new_access_token, expires_at=None):
         # Обновляем access_token у банка bank_name
-        await db.access_tokens.update_one(
-            {"bank_name": bank_name},              # фильтр — по имени банка киса
-            {"$set": {                        # обновляем поля ле
-                "access_token": new_access_token,
-                "updated_at": datetime.now(timezone.utc)
-            }},  
-        )
+        await self.tokens.save(bank_name, new_access_token, expires_at or datetime.now(timezone.utc) + TOKEN_TTL)
     
     # ---------------------------------------------------------------------------------------------------
     # ----------------------------------- Consent services ( Согласие клиента ) -------------------------
 
-    # Создаем consest и выдаем его
-    async def make_and_get_account_consent(self, bank_name, access_token, client_id_id):
-        async with self._session.post(
-            url=f"https://{bank_name}.{self.base_url}/account-consents/request",
+    # Запрашиваем consent в банке: {"consent", "consent_status", "consent_expires_at"}
+    async def request_account_consent(self, bank_name, access_token, client_id_id) -> dict:
+        resp = await self._request(
+            bank_name, "POST", "/account-consents/request", operation="account_consent",
             headers={
                 "Authorization": f"Bearer {access_token}",
                 "X-Requesting-Bank": self.client_id,
@@ -188,56 +438,114 @@ class BankHelper:
             },
             json={  # тело запроса
                 "client_id": f"{self.client_id}-{client_id_id}",
-                "permissions": ["ReadAccountsDetail", "ReadBalances"],
+                "permissions": ["ReadAccountsDetail", "ReadBalances", "ReadTransactionsDetail"],
                 "reason": "Агрегация счетов для HackAPI",
                 "requesting_bank": self.client_id,
                 "requesting_bank_name": re.sub(r"([a-zA-Z]+)(\d+)", r"\1 \2 App", self.client_id)
-            },
-            timeout=15
-        ) as resp:
-            result = await resp.json()
-            if result.get("status") == "approved":
-                consent = result.get("consent_id")
-                return consent
-            return result
-        raise ValueError(f"❌ Ошибка получения consent")
-        
-
-    # Выдать consent
-    async def get_account_consent(self, bank_name, access_token, client_id_id):
-        db = self.db
-        some_reason = True   # На будущее, если какая-то ошибка -> False
+            }
+        )
+        result = resp.json() if resp.status == 200 else None
+        if not result or not result.get("consent_id"):
+            raise ValueError(f"❌ Ошибка получения consent в {bank_name}: {resp.status}")
+
+        return {
+            "consent": result["consent_id"],
+            "consent_status": result.get("status", "approved"),
+            "consent_expires_at": consent_expires_at(result)
+        }
+
+    # Статус ранее запрошенного согласия (одобрил ли его клиент): {"consent_status", "consent_expires_at"}
+    async def request_account_consent_status(self, bank_name, access_token, consent_id) -> dict:
+        resp = await self._request(
+            bank_name, "GET", f"/account-consents/{consent_id}", operation="account_consent_status",
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "X-Requesting-Bank": self.client_id
+            }
+        )
+        if resp.status != 200:
+            raise ValueError(f"❌ Ошибка получения статуса consent в {bank_name}: {resp.status}")
+
+        result = resp.json()
+        return {
+            "consent_status": (result.get("data") or result).get("status", "approved"),
+            "consent_expires_at": consent_expires_at(result)
+        }
+
+    # Новое согласие вместо истёкшего / отозванного (фоновое обновление, 401/403 от банка)
+    # Параллельные вызовы по одному аккаунту склеиваются в один запрос
+    async def renew_account_consent(self, bank_name, client_id_id) -> str:
+        key = (bank_name, str(client_id_id))
+        return await self._consent_flight.do(key, lambda: self._renew_account_consent(bank_name, client_id_id))
+
+    # Возвращает согласие, которым теперь ходить в банк. Не одобренное клиентом новое согласие
+    # рабочее не заменяет: ждёт в pending_consent и проверяется раз в CONSENT_RETRY_MIN_INTERVAL
+    async def _renew_account_consent(self, bank_name, client_id_id) -> str:
+        record = await self.accounts.get(bank_name, client_id_id) or {}
+        # Недавно уже запрашивали / проверяли (ждём подтверждения клиента или банк не ответил) — в банк не идём
+        if consent_renewal_deferred(record):
+            return self._usable_consent(bank_name, client_id_id, record)
 
-        #Выдача из БД
-        if some_reason:
-            consent = await db.users.find_one(
-                {f"{bank_name}.client_id_id": client_id_id},
-                {f"{bank_name}.$": 1}
+        access_token = await self.get_access_token(bank_name)
+        try:
+            # Новое согласие уже запрошено — сначала узнаём, не одобрил ли его клиент
+            consent = await self._check_pending_consent(bank_name, access_token, record)
+            if consent is None:
+                consent = await self.request_account_consent(bank_name, access_token, client_id_id)
+        except Exception:
+            await self.defer_consent_renewal(bank_name, client_id_id, CONSENT_RETRY_MIN_INTERVAL)
+            raise
+
+        if not consent_approved(consent["consent_status"]):
+            await self.accounts.set_pending_consent(
+                bank_name, client_id_id, consent["consent"], consent["consent_status"], consent["consent_expires_at"]
             )
-            if consent and bank_name in consent:
-                consent = consent[bank_name][0].get("consent")
-                return consent
-            raise ValueError(f"❌ Аккаунт Отутствует в БД")
+            await self.defer_consent_renewal(bank_name, client_id_id, CONSENT_RETRY_MIN_INTERVAL)
+            logger.info(f"⏳ Согласие {bank_name}/{client_id_id} ждёт одобрения клиента ({consent['consent_status']})")
+            return self._usable_consent(bank_name, client_id_id, record)
 
-        print("\n\nПерешли на make_and_get_acc.._consent")
-        #Если в есть какая то причина (some_reason), делаем запрос
-        consent = await self.make_and_get_account_consent(bank_name=bank_name, access_token=access_token, client_id_id=client_id_id)
         # Обновляем в бд
-        await self.update_account_consent_in_db(bank_name=bank_name, client_id_id=client_id_id, consent=consent)
+        await self.update_account_consent_in_db(
+            bank_name=bank_name, client_id_id=client_id_id, consent=consent["consent"],
+            status=consent["consent_status"], expires_at=consent["consent_expires_at"]
+        )
+        logger.info(f"🔄 Согласие {bank_name}/{client_id_id} обновлено, действует до {consent['consent_expires_at']:%Y-%m-%d %H:%M}")
+        return consent["consent"]
+
+    # Ранее запрошенное согласие: {"consent", "consent_status", "consent_expires_at"},
+    # None — его нет или оно уже не заработает (истекло, отклонено) и нужно новое
+    async def _check_pending_consent(self, bank_name, access_token, record) -> dict | None:
+        pending = record.get("pending_consent")
+        if not pending:
+            return None
+        expires_at = record.get("pending_consent_expires_at")
+        if expires_at is not None and as_utc(expires_at) <= datetime.now(timezone.utc):
+            return None
 
-        return consent
+        status = await self.request_account_consent_status(bank_name, access_token, pending)
+        if str(status["consent_status"]).lower() in CONSENT_DEAD_STATUSES:
+            return None
+        return {"consent": pending, **status}
+
+    # Рабочее согласие, пока новое не одобрено; если и рабочее уже не годится — ходить в банк нечем
+    def _usable_consent(self, bank_name, client_id_id, record) -> str:
+        if record.get("consent") and not consent_needs_renewal(record):
+            return record["consent"]
+        raise ValueError(f"❌ Согласие {bank_name}/{client_id_id} недоступно (ждёт одобрения клиента), "
+                         f"повтор после {record.get('consent_retry_at')}")
     
-    # Обновляем значение consent в БД
-    async def update_account_consent_in_db(self, bank_name, client_id_id, consent):
-        db = self.db
+    # Следующая попытка запросить согласие — не раньше чем через delay_seconds
+    async def defer_consent_renewal(self, bank_name, client_id_id, delay_seconds):
+        await self.accounts.defer_consent_renewal(bank_name, client_id_id, delay_seconds)
+        self._account_cache.invalidate((bank_name, str(client_id_id)))
 
-        result = await db.users.update_one(
-            {f"{bank_name}.client_id_id": client_id_id},  # ищем в массиве нужного клиента
-            {"$set": {f"{bank_name}.$.consent": consent}}  # обновляем consent у найденного
-        )
+    # Обновляем значение consent в БД
+    async def update_account_consent_in_db(self, bank_name, client_id_id, consent, status=None, expires_at=None):
+        updated = await self.accounts.set_consent(bank_name, client_id_id, consent, status=status, expires_at=expires_at)
+        self._account_cache.invalidate((bank_name, str(client_id_id)))
         # если клиента нет
-        if result.matched_count == 0:
-            print("⚠️ Нет такого аккаунта в БД")
+        if not updated:
+            logger.warning("⚠️ Нет такого аккаунта в БД")
             return {"status": "error"}
 
         return {"status": "updated"}
@@ -247,25 +555,56 @@ class BankHelper:
     # ---------------------------------------------------------------------------------------------------
     # ----------------------------------- Balances ------------------------------------------------------
 
-    # Получить account_id клиента конкретного банка
-    async def get_account_id(self, bank_name, access_token, consent, client_id_id):
-        db = self.db
-
-        # Проверяем, есть ли account_id в БД
-        record = await db.users.find_one(
-            {f"{bank_name}.client_id_id": client_id_id},
-            {f"{bank_name}.$": 1}
+    # Всё, что нужно для запроса к банку от имени клиента, за одно чтение из БД:
+    # {"access_token", "consent", "account_id", "bank_account_number"}
+    async def resolve_account_context(self, bank_name, client_id_id) -> dict:
+        access_token, record = await asyncio.gather(
+            self.get_access_token(bank_name),
+            self._get_account_record(bank_name, client_id_id)
         )
-        if record and bank_name in record:
-            account_data = record[bank_name][0]
-            account_id = account_data.get("account_id")
-            if account_id:
-                print(f"⚡ account_id найден в БД: {account_id}")
-                return account_id
-
-        # Если нет — делаем запрос к API
-        async with self._session.get(
-            url=f"https://{bank_name}.{self.base_url}/accounts",
+        if not record:
+            raise ValueError(f"❌ Аккаунт Отутствует в БД")
+
+        # Согласие уже истекло, отклонено или отозвано (фоновое обновление не успело) — обновляем до запроса в банк.
+        # Недавно запрошенное и ещё не одобренное ждёт consent_retry_at
+        consent = record.get("consent")
+        if consent_needs_renewal(record):
+            if consent_renewal_deferred(record):
+                consent = self._usable_consent(bank_name, client_id_id, record)
+            else:
+                consent = await self.renew_account_consent(bank_name, client_id_id)
+
+        context = {
+            "access_token": access_token,
+            "consent": consent,
+            "account_id": record.get("account_id"),
+            "bank_account_number": record.get("bank_account_number")
+        }
+
+        # Старые записи могут быть неполными — добираем из API банка одним запросом
+        if not context["account_id"] or not context["bank_account_number"]:
+            fields = await self.discover_and_save_accounts(bank_name, access_token, context["consent"], client_id_id)
+            context["account_id"] = fields["account_id"]
+            context["bank_account_number"] = fields["bank_account_number"]
+
+        return context
+
+    # Запись аккаунта: сначала из кэша, потом из bank_accounts
+    async def _get_account_record(self, bank_name, client_id_id) -> dict | None:
+        key = (bank_name, str(client_id_id))
+        record = self._account_cache.get(key)
+        if record is None:
+            record = await self.accounts.get(bank_name, client_id_id)
+            if record:
+                self._account_cache.set(key, record)
+        return record
+
+
+    # Все счета клиента в банке одним GET /accounts:
+    # [{"account_id", "bank_account_number"}, ...]
+    async def fetch_accounts(self, bank_name, access_token, consent, client_id_id) -> list[dict]:
+        resp = await self._request(
+            bank_name, "GET", "/accounts", operation="accounts",
             headers={
                 "Authorization": f"Bearer {access_token}",
                 "X-Requesting-Bank": self.client_id,  
@@ -273,60 +612,72 @@ class BankHelper:
             },
             params={
                 "client_id": f"{self.client_id}-{client_id_id}"
-            },
-            timeout=15
-        ) as resp:
-            if resp.status != 200:
-                raise ValueError(f"❌ Ошибка при получении accounts из {bank_name}: {resp.status}")
-            result = await resp.json()
-            account_id = result["data"]["account"][0]["accountId"]
-            return account_id
-        
-    # Получить Номер счета клиента конкретного банка
-    async def get_bank_account_number(self, bank_name, access_token, consent, client_id_id):
-        db = self.db
-
-        # Проверяем, есть ли user_id_id в БД
-        record = await db.users.find_one(
-            {f"{bank_name}.client_id_id": client_id_id},
-            {f"{bank_name}.$": 1}
+            }
         )
-        if record and bank_name in record:
-            account_data = record[bank_name][0]
-            bank_account_number = account_data.get("bank_account_number")
-            if bank_account_number:
-                print(f"⚡ account_id найден в БД: {bank_account_number}")
-                return bank_account_number
-
-        # Если нет — делаем запрос к API
-        async with self._session.get(
-            url=f"https://{bank_name}.{self.base_url}/accounts",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "X-Requesting-Bank": self.client_id,  
-                "X-Consent-Id": consent               
-            },
-            params={
-                "client_id": f"{self.client_id}-{client_id_id}"
-            },
-            timeout=15
-        ) as resp:
-            if resp.status != 200:
-                raise ValueError(f"❌ Ошибка при получении accounts из {bank_name}: {resp.status}")
-            result = await resp.json()
-            bank_account_number = result["data"]["account"][0]["account"][0].get("identification", "0000")
-            return bank_account_number
-            
+        if resp.status != 200:
+            raise ValueError(f"❌ Ошибка при получении accounts из {bank_name}: {resp.status}")
+        result = resp.json()
+
+        accounts = []
+        for account in result["data"]["account"]:
+            identifications = account.get("account") or [{}]
+            accounts.append({
+                "account_id": account["accountId"],
+                "bank_account_number": identifications[0].get("identification", "0000")
+            })
+        if not accounts:
+            raise ValueError(f"❌ У клиента {client_id_id} нет счетов в {bank_name}")
+        return accounts
+
+    # Запросить счета из банка и записать их все в БД одной операцией
+    async def discover_and_save_accounts(self, bank_name, access_token, consent, client_id_id) -> dict:
+        accounts = await self.fetch_accounts(bank_name, access_token, consent, client_id_id)
+        fields = _primary_account_fields(accounts)
+
+        await self.accounts.upsert(bank_name, client_id_id, fields)
+        self._account_cache.invalidate((bank_name, str(client_id_id)))
+        return fields
 
 
     # Получить Балансы конкретного банка и юзера
     async def get_account_balances(self, bank_name, client_id_id):
-        access_token = await self.get_access_token(bank_name)
-        consent = await self.get_account_consent(bank_name, access_token, client_id_id)
-        account_id = await self.get_account_id(bank_name, access_token, consent, client_id_id)
-
-        async with self._session.get(
-            url=f"https://{bank_name}.{self.base_url}/accounts/{account_id}/balances",
+        context = await self.resolve_account_context(bank_name, client_id_id)
+        resp = await self._client_request(
+            bank_name, client_id_id, context, lambda: self._request_balances(bank_name, client_id_id, context)
+        )
+        if resp.status != 200:
+            raise ValueError(f"❌ Ошибка при получении балансов из {bank_name}: {resp.status}")
+
+        result = resp.json()
+        logger.debug(f"✅ Получены балансы из банка '{bank_name}' для клиента '{client_id_id}'")
+        return result
+
+    # Запрос от имени клиента: на 401/403 (согласие истекло или отозвано) —
+    # новое согласие и один повтор. send читает consent из context на каждой попытке
+    async def _client_request(self, bank_name, client_id_id, context, send) -> BankResponse:
+        resp = await send()
+        if resp.status in CONSENT_ERROR_STATUSES:
+            # Согласие мог уже обновить другой воркер (лидер), а у нас в кэше старое —
+            # тогда берём сохранённое, а не запрашиваем ещё одно (новое может отменить предыдущие)
+            self._account_cache.invalidate((bank_name, str(client_id_id)))
+            record = await self._get_account_record(bank_name, client_id_id) or {}
+            consent = record.get("consent")
+            if not consent or consent == context["consent"]:
+                logger.warning(f"⚠️ {bank_name} отклонил согласие {client_id_id} ({resp.status}), запрашиваю новое")
+                consent = await self.renew_account_consent(bank_name, client_id_id)
+                if consent == context["consent"]:
+                    return resp   # новое согласие сейчас не запрашиваем (отложено) — повтор ничего не даст
+            context["consent"] = consent
+            resp = await send()
+        return resp
+
+    async def _request_balances(self, bank_name, client_id_id, context) -> BankResponse:
+        access_token = context["access_token"]
+        consent = context["consent"]
+        account_id = context["account_id"]
+
+        return await self._request(
+            bank_name, "GET", f"/accounts/{account_id}/balances", operation="balances",
             headers={
                 "Authorization": f"Bearer {access_token}",
                 "X-Requesting-Bank": self.client_id,  
@@ -334,26 +685,205 @@ class BankHelper:
             },
             params={
                 "client_id": f"{self.client_id}-{client_id_id}"
-            },
-            timeout=15
-        ) as resp:
-            if resp.status != 200:
-                print(f"❌ Ошибка при получении балансов из {bank_name}: {resp.status}")
-                return resp.status
-            
-            result = await resp.json()
-            print(f"✅ Получены балансы из банка '{bank_name}' для клиента '{client_id_id}'")
-            return result
+            }
+        )
         
     
     # Получить доступный баланс конкретного банка пользователя
-    async def get_account_available_balance(self, bank_name, client_id_id):
-        balances = await self.get_account_balances(bank_name, client_id_id)
+    # fresh=True — не отдавать протухшее значение, а дождаться (общего) запроса в банк
+    async def get_account_available_balance(self, bank_name, client_id_id, fresh=False):
+        key = (bank_name, str(client_id_id))
+        # После инвалидации не подхватываем запрос, начатый до неё
+        flight_key = (*key, self._balance_generation.get(key, 0))
+
+        cached = self._balance_cache.get(key)
+        # Несколько воркеров: баланс мог сбросить перевод в соседнем процессе
+        if cached and self.coordinator.shared and cached["shared_generation"] != await self._shared_balance_generation(*key):
+            self._balance_cache.invalidate(key)
+            cached = None
+        if cached:
+            age = time.monotonic() - cached["fetched_at"]
+            if age < BALANCE_FRESH_TTL:
+                return cached["balance"]
+            if not fresh:
+                # Протух, но ещё годится — отдаём сразу, обновляем в фоне
+                self._balance_flight.start(flight_key, lambda: self._fetch_available_balance(bank_name, client_id_id))
+                return cached["balance"]
+
+        return await self._balance_flight.do(flight_key, lambda: self._fetch_available_balance(bank_name, client_id_id))
+
+    # Запрос баланса в банк + запись в кэш
+    async def _fetch_available_balance(self, bank_name, client_id_id):
+        key = (bank_name, str(client_id_id))
+        generation = self._balance_generation.get(key, 0)
+        shared_key = f"balance:{bank_name}:{client_id_id}"
+
+        shared_generation = 0
+
+        # Несколько воркеров: свежий баланс мог только что получить соседний процесс
+        if self.coordinator.shared:
+            shared_generation = await self._shared_balance_generation(*key)
+            shared = await self.coordinator.cache_get(shared_key)
+            if shared is not None and shared.get("generation", 0) == shared_generation:
+                age = max(0.0, time.time() - shared["fetched_at"])
+                if self._balance_generation.get(key, 0) == generation:
+                    self._balance_cache.set(key, {
+                        "balance": shared["balance"], "fetched_at": time.monotonic() - age,
+                        "shared_generation": shared_generation
+                    })
+                return shared["balance"]
 
+        balances = await self.get_account_balances(bank_name, client_id_id)
         available_balance = balances["data"]["balance"][0]["amount"].get("amount", "0")
 
+        # Пока ходили в банк, кэш могли сбросить (перевод здесь или в соседнем воркере) — тогда не кладём старое значение
+        if self._balance_generation.get(key, 0) != generation:
+            return available_balance
+        if self.coordinator.shared and await self._shared_balance_generation(*key) != shared_generation:
+            return available_balance
+        self._balance_cache.set(key, {
+            "balance": available_balance, "fetched_at": time.monotonic(), "shared_generation": shared_generation
+        })
+        if self.coordinator.shared:
+            try:
+                await self.coordinator.cache_set(shared_key, {
+                    "balance": available_balance, "fetched_at": time.time(), "generation": shared_generation
+                }, BALANCE_FRESH_TTL)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось записать баланс {bank_name}/{client_id_id} в общий кэш: {e}")
+
         return available_balance
-    
+
+    # Поколение баланса аккаунта в общем кэше (растёт при каждом переводе в любом воркере)
+    async def _shared_balance_generation(self, bank_name, client_id_id) -> int:
+        return await self.coordinator.cache_get(f"balance_gen:{bank_name}:{client_id_id}") or 0
+
+    # Сбросить кэш баланса (после перевода)
+    async def invalidate_balance(self, bank_name, client_id_id):
+        key = (bank_name, str(client_id_id))
+        self._balance_cache.invalidate(key)
+        self._balance_generation[key] = self._balance_generation.get(key, 0) + 1
+        try:
+            if self.coordinator.shared:
+                # Соседние воркеры увидят новое поколение и не отдадут свои локальные копии
+                await self.coordinator.cache_incr(f"balance_gen:{bank_name}:{client_id_id}", BALANCE_GENERATION_TTL)
+            await self.coordinator.cache_delete(f"balance:{bank_name}:{client_id_id}")
+        except Exception as e:
+            # Перевод уже прошёл — общий кэш сам протухнет через BALANCE_FRESH_TTL
+            logger.warning(f"⚠️ Не удалось сбросить общий кэш баланса {bank_name}/{client_id_id}: {e}")
+        for listener in self._balance_listeners:
+            listener(bank_name, client_id_id)
+
+    def add_balance_listener(self, listener):
+        self._balance_listeners.append(listener)
+
+
+    # Банки клиента из global_users
+    async def get_client_bank_names(self, client_id_id) -> list[str]:
+        _, bank_names = await self.read_client_bank_names(client_id_id)
+        return bank_names
+
+    # То же + версия global_users (для ETag в /bank_names)
+    async def read_client_bank_names(self, client_id_id) -> tuple[int, list[str]]:
+        client_id_id = str(client_id_id)
+        return await self._read_global_users(("bank_names", client_id_id), lambda: self._load_client_bank_names(client_id_id))
+
+    async def _load_client_bank_names(self, client_id_id) -> list[str]:
+        return [bank for bank in await self.global_users.bank_names(client_id_id)
+                if bank != "sbank"]   # ЭТО ВРЕМЕННО!!! (как и в /bank_names)
+
+    # Доступные балансы клиента во всех его банках — параллельно, с таймаутом на каждый банк
+    # Медленный или упавший банк не ломает ответ: у каждого банка свой status
+    async def get_all_available_balances(self, client_id_id, timeout=BALANCE_BANK_TIMEOUT) -> dict:
+        client_id_id = str(client_id_id)
+        bank_names = await self.get_client_bank_names(client_id_id)
+
+        async def fetch(bank_name):
+            try:
+                balance = await asyncio.wait_for(
+                    self.get_account_available_balance(bank_name, client_id_id),
+                    timeout=timeout
+                )
+                return {"bank_name": bank_name, "status": "ok", "balance": balance}
+            except asyncio.TimeoutError:
+                logger.warning(f"⏱️ Баланс {bank_name} для клиента {client_id_id} не успел за {timeout}с")
+                return {"bank_name": bank_name, "status": "timeout", "balance": None}
+            except BankUnavailableError as e:
+                # Банк лежит — не ждём таймаут, сразу отдаём статус
+                return {"bank_name": bank_name, "status": "unavailable", "balance": None, "reason": e.reason}
+            except Exception as e:
+                logger.error(f"❌ Ошибка получения баланса {bank_name} для клиента {client_id_id}: {e}")
+                return {"bank_name": bank_name, "status": "error", "balance": None}
+
+        results = await asyncio.gather(*(fetch(bank) for bank in bank_names))
+        return {"client_id_id": client_id_id, "balances": results}
+
+
+    # ---------------------------------------------------------------------------------------------------
+    # ----------------------------------- Transactions --------------------------------------------------
+
+    # Догрузить новые операции всех счетов клиента в банке (вызывает TransactionSync)
+    # Возвращает количество новых операций
+    async def sync_transactions(self, bank_name, client_id_id) -> int:
+        client_id_id = str(client_id_id)
+        context = await self.resolve_account_context(bank_name, client_id_id)
+        record = await self._get_account_record(bank_name, client_id_id) or {}
+        account_ids = [account["account_id"] for account in record.get("accounts") or []] or [context["account_id"]]
+
+        added = 0
+        for account_id in account_ids:
+            since, first_page = await self.transactions.sync_window(bank_name, account_id)
+            rows, next_page = await self.fetch_transactions(bank_name, client_id_id, account_id, context, since, first_page)
+            added += await self.transactions.bulk_upsert(rows)
+
+            # Окно не забрали целиком — запоминаем страницу, следующий проход продолжит с неё
+            # (high-water mark начнёт действовать, когда окно будет пройдено до конца)
+            high_water_mark = max((row["booking_date_time"] for row in rows), default=None)
+            resume = (since, next_page) if next_page else None
+            await self.transactions.set_high_water_mark(bank_name, account_id, client_id_id, high_water_mark, resume)
+            if next_page:
+                logger.warning(f"⚠️ {bank_name}/{account_id}: операций больше {TRANSACTIONS_FETCH_MAX_PAGES} страниц, "
+                               f"продолжим со страницы {next_page} в следующий проход")
+        return added
+
+    # Операции счёта с даты since, постранично с first_page:
+    # (строки для bank_transactions, следующая страница или None, если забрали всё)
+    async def fetch_transactions(self, bank_name, client_id_id, account_id, context, since,
+                                 first_page=1) -> tuple[list[dict], int | None]:
+        rows = []
+        for page in range(first_page, first_page + TRANSACTIONS_FETCH_MAX_PAGES):
+            resp = await self._client_request(
+                bank_name, client_id_id, context,
+                lambda: self._request(
+                    bank_name, "GET", f"/accounts/{account_id}/transactions", operation="transactions",
+                    headers={
+                        "Authorization": f"Bearer {context['access_token']}",
+                        "X-Requesting-Bank": self.client_id,
+                        "X-Consent-Id": context["consent"]
+                    },
+                    params={
+                        "client_id": f"{self.client_id}-{client_id_id}",
+                        "from_booking_date_time": since.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "page": page,
+                        "limit": TRANSACTIONS_FETCH_PAGE_SIZE
+                    }
+                )
+            )
+            if resp.status != 200:
+                raise ValueError(f"❌ Ошибка при получении операций из {bank_name}: {resp.status}")
+
+            result = resp.json()
+            transactions = (result.get("data") or {}).get("transaction") or []
+            for transaction in transactions:
+                row = transaction_row(bank_name, client_id_id, account_id, transaction)
+                if row:
+                    rows.append(row)
+
+            total_pages = (result.get("meta") or {}).get("totalPages")
+            if len(transactions) < TRANSACTIONS_FETCH_PAGE_SIZE or (total_pages and page >= total_pages):
+                return rows, None
+        return rows, first_page + TRANSACTIONS_FETCH_MAX_PAGES
+
 
     # ---------------------------------------------------------------------------------------------------
     # ----------------------------------- Payments ------------------------------------------------------
@@ -364,8 +894,8 @@ class BankHelper:
                                     creditor_bank_account_number):
 
 
-        async with self._session.post(
-            url=f"https://{from_bank}.{self.base_url}/payment-consents/request",
+        resp = await self._request(
+            from_bank, "POST", "/payment-consents/request", operation="payment_consent",
             headers={
                 "Authorization": f"Bearer {from_access_token}",
                 "X-Requesting-Bank": self.client_id,
@@ -380,53 +910,248 @@ class BankHelper:
                 "debtor_account": f"{debtor_bank_account_number}",
                 "creditor_account": f"{creditor_bank_account_number}",
                 "reference": "Оплата услуг"
-            },
-            timeout=15
-        ) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise Exception(f"Ошибка при создании consent: {resp.status} {text}")
-            
-            result = await resp.json()
-            # Проверяем если подтвердили согласие на перевод
-            if result.get("status") == "approved":
-                transfer_consent = result.get("consent_id")
-                return transfer_consent
-            return None
-
-
+            }
+        )
+        if resp.status != 200:
+            raise Exception(f"Ошибка при создании consent: {resp.status} {resp.text}")
 
-    # Создание платежа  
-    async def make_transfer(self, client_id_id, to_client_id_id, from_bank, to_bank, amount) -> dict:
-        from_access_token = await self.get_access_token(bank_name=from_bank)
-        to_access_token = await self.get_access_token(bank_name=to_bank)
+        result = resp.json()
+        # Проверяем если подтвердили согласие на перевод
+        if result.get("status") == "approved":
+            transfer_consent = result.get("consent_id")
+            return transfer_consent
+        return None
 
-        from_consent = await self.get_account_consent(from_bank, from_access_token, client_id_id)
-        to_consent = await self.get_account_consent(to_bank, to_access_token, to_client_id_id)
 
-        debtor_bank_account_number = await self.get_bank_account_number(from_bank, from_access_token, from_consent, client_id_id)
-        creditor_bank_account_number = await self.get_bank_account_number(to_bank, to_access_token, to_consent, to_client_id_id)
 
+    # Создание платежа (идемпотентно: повтор с тем же ключом не платит второй раз)
+    # contexts — уже зарезолвленные (debtor, creditor), чтобы пакет не резолвил их заново
+    async def make_transfer(self, client_id_id, to_client_id_id, from_bank, to_bank, amount,
+                            idempotency_key=None, contexts=None) -> dict:
+        client_id_id, to_client_id_id = str(client_id_id), str(to_client_id_id)
         amount = float(amount)
-
-        # Получение согласия на перевод
-        transfer_consent = await self.get_transfer_consent(client_id_id, from_bank,
-                                                           amount, from_access_token,
-                                                           debtor_bank_account_number, 
-                                                           creditor_bank_account_number)
+        request = {
+            "user_id_id": client_id_id,
+            "to_user_id_id": to_client_id_id,
+            "from_bank": from_bank,
+            "to_bank": to_bank,
+            "amount": amount
+        }
+
+        # Без ключа от клиента — просто записываем перевод под новым id
+        key = idempotency_key or str(uuid4())
+        transfer, created = await self.transfers.create(key, request)
+        if not created:
+            # Упал до отправки платежа — повтор с тем же ключом выполняет перевод заново
+            restarted = None
+            if transfer["request"] == request and transfer["state"] == "failed":
+                restarted = await self.transfers.restart_failed(key)
+                if restarted is None:
+                    # Платёж уже отправлялся или перевод только что перезапустил параллельный повтор
+                    transfer = await self.transfers.get(key) or transfer
+            if restarted is None:
+                return self._replay_transfer(transfer, request)
+
+        try:
+            # Контексты отправителя и получателя резолвим параллельно
+            debtor, creditor = contexts or await asyncio.gather(
+                self.resolve_account_context(from_bank, client_id_id),
+                self.resolve_account_context(to_bank, to_client_id_id)
+            )
+            from_access_token = debtor["access_token"]
+            debtor_bank_account_number = debtor["bank_account_number"]
+            creditor_bank_account_number = creditor["bank_account_number"]
+
+            # Получение согласия на перевод
+            transfer_consent = await self.get_transfer_consent(client_id_id, from_bank,
+                                                               amount, from_access_token,
+                                                               debtor_bank_account_number, 
+                                                               creditor_bank_account_number)
+        except Exception as e:
+            # До отправки платежа деньги точно не ушли — можно честно пометить failed
+            await self.transfers.set_state(key, "failed", error=str(e))
+            raise
 
         # Если не дали согласие
         if transfer_consent == None:
-            print("Произошла какая-то ошибка при получении согласия на перевод!")
-            return {"status": "error", "message": "Произошла какая-то ошибка при получении согласия на перевод!"}
+            logger.error("Произошла какая-то ошибка при получении согласия на перевод!")
+            result = {"status": "error", "message": "Произошла какая-то ошибка при получении согласия на перевод!", "transfer_id": key}
+            await self.transfers.set_state(key, "failed", result=result)
+            return result
+        await self.transfers.set_state(key, "consent_approved", consent_id=transfer_consent)
+
+        # Новый X-FAPI-Interaction-Id на каждую попытку
+        interaction_id = str(uuid4())
+        await self.transfers.mark_submitted(key, interaction_id)
+        try:
+            resp = await self.submit_payment(from_bank, to_bank, client_id_id, amount, from_access_token,
+                                             transfer_consent, interaction_id,
+                                             debtor_bank_account_number, creditor_bank_account_number)
+        except Exception as e:
+            # Исход неизвестен (платёж мог дойти) — unknown, повтор по ключу не заплатит дважды
+            await self.transfers.set_state(key, "unknown", error=str(e))
+            raise
+
+        if resp.status not in (200, 201):
+            error = f"{resp.status} {resp.text}"
+            await self.transfers.set_state(key, "failed", error=error,
+                                           result={"status": "error", "message": "Ошибка при создании платежа", "transfer_id": key})
+            raise HTTPException(status_code=PAYMENT_FAILED_STATUS, detail=f"Ошибка при создании платежа: {error}")
+        data = resp.json()["data"]
+        paymentId = data.get("paymentId")
+        if data.get("status") not in SETTLED_STATUSES:
+            # Банк ещё проводит платёж — не держим запрос, статус добьёт PaymentPoller
+            result = {"status": "pending", "message": "Перевод в обработке", "transfer_id": key, "payment_id": paymentId}
+            await self.transfers.set_state(key, "submitted", payment_id=paymentId, bank_status=data.get("status"),
+                                           result=result, checks=0,
+                                           next_check_at=datetime.now(timezone.utc) + timedelta(seconds=PAYMENT_POLL_INTERVAL))
+            return result
 
-        async with self._session.post(
-            url=f"https://{from_bank}.{self.base_url}/payments",
+        # Балансы обеих сторон изменились
+        await self.invalidate_balance(from_bank, client_id_id)
+        await self.invalidate_balance(to_bank, to_client_id_id)
+        result = {"status": "success", "message": "Перевод выполнен!", "transfer_id": key, "payment_id": paymentId}
+        await self.transfers.set_state(key, "settled", payment_id=paymentId, bank_status=data.get("status"), result=result)
+
+        return result
+
+
+    # Пакет переводов: отдаёт результаты по мере готовности (index — номер в пакете)
+    # Общие токены и контексты аккаунтов резолвятся один раз на весь пакет,
+    # согласия и платежи идут параллельно, но не больше BATCH_BANK_CONCURRENCY на банк
+    async def make_transfers_batch(self, transfers: list[dict], batch_key=None):
+        pairs = set()
+        for transfer in transfers:
+            pairs.add((transfer["from_bank"], str(transfer["user_id_id"])))
+            pairs.add((transfer["to_bank"], str(transfer["to_user_id_id"])))
+
+        async def resolve(pair):
+            try:
+                return pair, await self.resolve_account_context(*pair)
+            except Exception as e:
+                return pair, e
+
+        contexts = dict(await asyncio.gather(*(resolve(pair) for pair in pairs)))
+        semaphores = {}
+
+        async def run(index, transfer):
+            debtor = contexts[(transfer["from_bank"], str(transfer["user_id_id"]))]
+            creditor = contexts[(transfer["to_bank"], str(transfer["to_user_id_id"]))]
+            # Ключ элемента: свой, либо производный от ключа пакета (повтор пакета не платит дважды)
+            key = transfer.get("idempotency_key") or (f"{batch_key}:{index}" if batch_key else None)
+
+            semaphore = semaphores.setdefault(transfer["from_bank"], asyncio.Semaphore(BATCH_BANK_CONCURRENCY))
+            async with semaphore:
+                try:
+                    for context in (debtor, creditor):
+                        if isinstance(context, Exception):
+                            raise context
+                    result = await self.make_transfer(
+                        transfer["user_id_id"], transfer["to_user_id_id"],
+                        transfer["from_bank"], transfer["to_bank"], transfer["amount"],
+                        idempotency_key=key, contexts=(debtor, creditor)
+                    )
+                except HTTPException as e:
+                    result = {"status": "error", "message": e.detail}
+                except Exception as e:
+                    result = {"status": "error", "message": str(e)}
+            return {"index": index, **result}
+
+        # Задачи не отменяем, даже если клиент отключился: состояние каждого перевода
+        # сохраняется в transfers и доступно через GET /payments/{id}
+        tasks = [asyncio.create_task(run(index, transfer)) for index, transfer in enumerate(transfers)]
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+
+
+    # Повторный запрос с тем же ключом: отдаём сохранённый результат, в банк не ходим
+    def _replay_transfer(self, transfer, request) -> dict:
+        if transfer["request"] != request:
+            raise HTTPException(status_code=409, detail="Idempotency-Key уже использован для другого перевода")
+
+        # Банк отклонил платёж — повтор получает ту же ошибку, а не 200
+        if transfer["state"] == "failed":
+            raise HTTPException(status_code=PAYMENT_FAILED_STATUS,
+                                detail=f"Ошибка при создании платежа: {transfer.get('error', 'перевод не выполнен')}")
+        if transfer["state"] == "unknown":
+            interaction_ids = [attempt["interaction_id"] for attempt in transfer.get("attempts", [])]
+            return {"status": "unknown", "message": "Исход платежа неизвестен, требуется сверка с банком",
+                    "transfer_id": transfer["idempotency_key"], "interaction_ids": interaction_ids,
+                    "replayed": True}
+        if transfer.get("result") and (transfer["state"] in TERMINAL_STATES or transfer.get("payment_id")):
+            return {**transfer["result"], "replayed": True}
+
+        return {"status": "in_progress", "state": transfer["state"],
+                "transfer_id": transfer["idempotency_key"], "replayed": True}
+
+
+    # Статус платежа в банке: GET /payments/{paymentId}
+    async def get_payment_status(self, bank_name, payment_id, client_id_id, access_token=None) -> str | None:
+        access_token = access_token or await self.get_access_token(bank_name)
+        resp = await self._request(
+            bank_name, "GET", f"/payments/{payment_id}", operation="payment_status",
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "X-Requesting-Bank": self.client_id
+            },
+            params={
+                "client_id": f"{self.client_id}-{client_id_id}"
+            }
+        )
+        if resp.status != 200:
+            raise ValueError(f"❌ Ошибка при получении статуса платежа {payment_id} из {bank_name}: {resp.status}")
+        return resp.json()["data"].get("status")
+
+    # Проверить ждущий платёж и перевести перевод в settled / failed (вызывает PaymentPoller)
+    async def refresh_payment_status(self, transfer) -> str:
+        key = transfer["idempotency_key"]
+        request = transfer["request"]
+        bank_status = await self.get_payment_status(request["from_bank"], transfer["payment_id"], request["user_id_id"])
+
+        if bank_status in SETTLED_STATUSES:
+            await self.invalidate_balance(request["from_bank"], request["user_id_id"])
+            await self.invalidate_balance(request["to_bank"], request["to_user_id_id"])
+            result = {"status": "success", "message": "Перевод выполнен!", "transfer_id": key, "payment_id": transfer["payment_id"]}
+            await self.transfers.set_state(key, "settled", bank_status=bank_status, result=result)
+            logger.info(f"✅ Платёж {transfer['payment_id']} проведён")
+            return "settled"
+
+        if bank_status in FAILED_STATUSES or is_expired(transfer):
+            result = {"status": "error", "message": "Перевод не подтвержден!", "transfer_id": key, "payment_id": transfer["payment_id"]}
+            await self.transfers.set_state(key, "failed", bank_status=bank_status, result=result)
+            logger.error(f"❌ Платёж {transfer['payment_id']} не проведён: {bank_status}")
+            return "failed"
+
+        await self.transfers.schedule_check(key, recheck_delay(transfer.get("checks", 0)), bank_status)
+        return "submitted"
+
+    # Сохранённое состояние перевода для GET /payments/{id}
+    async def get_transfer_status(self, transfer_or_payment_id) -> dict | None:
+        transfer = await self.transfers.find(transfer_or_payment_id)
+        if not transfer:
+            return None
+        return {
+            "transfer_id": transfer["idempotency_key"],
+            "payment_id": transfer.get("payment_id"),
+            "state": transfer["state"],
+            "bank_status": transfer.get("bank_status"),
+            "result": transfer.get("result"),
+            "request": transfer["request"],
+            "updated_at": transfer["updated_at"]
+        }
+
+
+    # POST /payments в банк отправителя
+    async def submit_payment(self, from_bank, to_bank, client_id_id, amount, from_access_token,
+                             transfer_consent, interaction_id,
+                             debtor_bank_account_number, creditor_bank_account_number) -> BankResponse:
+        return await self._request(
+            from_bank, "POST", "/payments", operation="payment",
             headers={
                 "Authorization": f"Bearer {from_access_token}",
                 "Content-Type": "application/json",
                 "X-Requesting-Bank": f"{self.client_id}",
-                "X-FAPI-Interaction-Id": f"{self.client_id}-pay-004",
+                "X-FAPI-Interaction-Id": interaction_id,
                 "X-Payment-Consent-Id": f"{transfer_consent}"
             },
             params={
@@ -449,18 +1174,8 @@ class BankHelper:
                         }
                     }
                 }
-            },
-            timeout=15
-        ) as resp:
-            if resp.status not in (200, 201):
-                raise Exception(f"Ошибка при создании платежа: {resp.status} {await resp.text()}")
-            result = await resp.json()
-            if result["data"].get("status") != "AcceptedSettlementCompleted":
-                return {"status": "Перевод не подтвержден!"}
-            paymentId = result["data"].get("paymentId")             #paymentId !!!!!!!!!!!!!!!!!!!!!!!!!!!!
-            result = {"status": "success", "message": "Перевод выполнен!"}
-
-            return result
+            }
+        )
 
 
 
@@ -474,18 +1189,42 @@ class BankHelper:
 
     #ONLY FOR TESTING ( Убиваем БД коллекции которые здесь создали )
     async def drop_db(self):
-        db = self.db
-        collection_list = await db.list_collection_names()
-        dont_delete = ["transactions", "accounts"]
-        for collection_name in collection_list:
-            if collection_name in dont_delete:
-                continue
-            await db[collection_name].drop()
-            print(f"🗑️ Коллекция '{collection_name}' удалена")
+        await self.storage.drop(keep=("transactions", "accounts"))
+        # Локальные копии удалённого: иначе токены, аккаунты и балансы живут до истечения TTL,
+        # а add_bank не вызывается для банков, которых уже нет в bank_names
+        for task in self._token_refresh_tasks.values():
+            task.cancel()
+        self._token_refresh_tasks.clear()
+        self._tokens.clear()
+        self._known_banks.clear()
+        self._account_cache.clear()
+        self._balance_cache.clear()
+        self._global_users_cache.clear()
         return {"status": "deleted"}
 
 
+    def transport_stats(self) -> dict:
+        resilience = self._resilience.stats()
+        return {
+            bank_name: {**stats, "resilience": resilience.get(bank_name)}
+            for bank_name, stats in self._transport.stats().items()
+        }
+
+
     # Закрытие сессии
     async def close(self):
-        await self._session.close()
-    
\ No newline at end of file
+        for task in self._token_refresh_tasks.values():
+            task.cancel()
+        if self._migration_task:
+            self._migration_task.cancel()
+        await self._transport.close()
+        await self.storage.close()            # дописываем отложенные записи
+
+
+# Основной счёт (первый) + полный список счетов клиента для записи в bank_accounts
+def _primary_account_fields(accounts: list[dict]) -> dict:
+    return {
+        "account_id": accounts[0]["account_id"],
+        "bank_account_number": accounts[0]["bank_account_number"],
+        "accounts": accounts
+    }
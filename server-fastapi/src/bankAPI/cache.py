@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import asyncio, time
+
+
+# Ограниченный по размеру кэш с TTL и вытеснением давно неиспользуемых (LRU)
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()   # key -> (expires_at, value)
+
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+
+    def clear(self):
+        self._data.clear()
+
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Склейка одинаковых конкурентных запросов: пока по ключу идёт запрос,
+# остальные ждут его результат вместо того, чтобы делать свой
+class SingleFlight:
+    def __init__(self):
+        self._inflight: dict = {}   # key -> asyncio.Task
+
+
+    # Запустить (или подхватить уже идущий) запрос по ключу, не дожидаясь результата
+    def start(self, key, factory) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+
+    # Дождаться результата; отмена одного ожидающего не отменяет общий запрос
+    async def do(self, key, factory):
+        return await asyncio.shield(self.start(key, factory))
+
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Чтобы ошибка фонового запроса не всплывала как "never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+
+    def __contains__(self, key):
+        return key in self._inflight
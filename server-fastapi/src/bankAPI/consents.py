@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta, timezone
+from bankAPI.log import get_logger
+import asyncio, os
+
+# Сколько живёт согласие, если банк не прислал срок сам
+CONSENT_TTL = timedelta(days=float(os.getenv("CONSENT_TTL_DAYS", "90")))
+# За сколько до истечения обновляем согласие в фоне
+CONSENT_RENEW_MARGIN = timedelta(hours=float(os.getenv("CONSENT_RENEW_MARGIN_HOURS", "24")))
+# Фоновое обновление: как часто просыпаемся, сколько берём за раз и сколько обновляем одновременно
+CONSENT_RENEW_INTERVAL = float(os.getenv("CONSENT_RENEW_INTERVAL", "300"))
+CONSENT_RENEW_BATCH = int(os.getenv("CONSENT_RENEW_BATCH", "200"))
+CONSENT_RENEW_CONCURRENCY = int(os.getenv("CONSENT_RENEW_CONCURRENCY", "4"))
+# После неудачного обновления следующую попытку откладываем (а не долбим банк каждый цикл)
+CONSENT_RETRY_DELAY = float(os.getenv("CONSENT_RETRY_DELAY", "900"))
+# Согласие ещё не одобрено клиентом (или запрос не удался на пути запроса) — новое не раньше чем через столько
+CONSENT_RETRY_MIN_INTERVAL = float(os.getenv("CONSENT_RETRY_MIN_INTERVAL", "60"))
+# С таким статусом согласие уже не заработает — нужно новое
+CONSENT_DEAD_STATUSES = {"rejected", "revoked", "expired"}
+# Согласие можно отдавать в запросы к банку (нет статуса — старая запись, считаем одобренным)
+CONSENT_APPROVED_STATUSES = {"approved", "authorised", "authorized"}
+
+# Ответ банка, по которому считаем, что проблема в согласии: перезапрашиваем и повторяем один раз
+CONSENT_ERROR_STATUSES = {401, 403}
+
+logger = get_logger("consents")
+
+
+# Срок действия из ответа банка на запрос согласия (поле называется по-разному), иначе — CONSENT_TTL
+def consent_expires_at(result: dict) -> datetime:
+    for field in ("expiration_date_time", "expirationDateTime", "expires_at"):
+        value = result.get(field) or (result.get("data") or {}).get(field)
+        if value:
+            try:
+                return as_utc(datetime.fromisoformat(str(value).replace("Z", "+00:00")))
+            except ValueError:
+                break
+    return datetime.now(timezone.utc) + CONSENT_TTL
+
+
+# Согласие пора обновить: его нет, банк его отклонил/отозвал, истекло или истекает в пределах margin.
+# Ожидающее подтверждения (pending и т.п.) не перезапрашиваем — клиент ещё может его одобрить
+# (у старых записей без срока не знаем — считаем рабочим, пока банк не ответит 401/403)
+def consent_needs_renewal(record: dict, margin=timedelta(0)) -> bool:
+    if not record.get("consent"):
+        return True
+    if str(record.get("consent_status") or "").lower() in CONSENT_DEAD_STATUSES:
+        return True
+    expires_at = record.get("consent_expires_at")
+    return expires_at is not None and as_utc(expires_at) - datetime.now(timezone.utc) <= margin
+
+
+def consent_approved(status) -> bool:
+    return str(status or "approved").lower() in CONSENT_APPROVED_STATUSES
+
+
+# Новое согласие недавно уже запрашивали (или запрос не удался) — ждём consent_retry_at
+def consent_renewal_deferred(record: dict) -> bool:
+    retry_at = record.get("consent_retry_at")
+    return retry_at is not None and as_utc(retry_at) > datetime.now(timezone.utc)
+
+
+# Mongo отдаёт даты без tzinfo (в UTC)
+def as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+# Фоновое обновление согласий, которые скоро истекут: волна истечений превращается
+# в ровный поток запросов в банк (не больше CONSENT_RENEW_CONCURRENCY одновременно)
+class ConsentRenewer:
+    def __init__(self, bank_helper, interval=CONSENT_RENEW_INTERVAL, batch_size=CONSENT_RENEW_BATCH,
+                 concurrency=CONSENT_RENEW_CONCURRENCY):
+        self.bank_helper = bank_helper
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+        self._task: asyncio.Task | None = None
+        self.stats = {"renewed": 0, "failed": 0}
+
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.renew_due()
+            except Exception as e:
+                logger.error(f"❌ Обновление согласий: {e}")
+            await asyncio.sleep(self.interval)
+
+
+    # Один проход: обновить всё, что истекает в пределах CONSENT_RENEW_MARGIN
+    async def renew_due(self) -> int:
+        before = datetime.now(timezone.utc) + CONSENT_RENEW_MARGIN
+        due = await self.bank_helper.accounts.due_for_consent_renewal(before, self.batch_size)
+        if not due:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def renew(record):
+            bank_name, client_id_id = record["bank_name"], record["client_id_id"]
+            async with semaphore:
+                try:
+                    await self.bank_helper.renew_account_consent(bank_name, client_id_id)
+                    self.stats["renewed"] += 1
+                    return True
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.warning(f"⚠️ Не удалось обновить согласие {bank_name}/{client_id_id}: {e}")
+                    await self.bank_helper.defer_consent_renewal(bank_name, client_id_id, CONSENT_RETRY_DELAY)
+                    return False
+
+        results = await asyncio.gather(*(renew(record) for record in due))
+        renewed = sum(results)
+        logger.info(f"🔄 Согласия: обновлено {renewed} из {len(due)}")
+        return renewed
+
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
@@ -0,0 +1,164 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from bankAPI.log import get_logger
+import asyncio, os, socket
+
+# Режим координации между воркерами uvicorn:
+#   local — один процесс, всё координируется в памяти BankHelper (по умолчанию)
+#   mongo — несколько воркеров/подов: локи, общий кэш и лидер через TTL-документы в Mongo
+COORDINATION = os.getenv("COORDINATION", "local")
+# Аренда лидера (онбординг, поллер платежей): продлевается каждые LEADER_LEASE_TTL / 3 секунд
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "30"))
+
+logger = get_logger("coordination")
+
+
+# Один процесс: локи всегда наши, общего кэша нет
+class LocalCoordinator:
+    shared = False
+
+    async def ensure_indexes(self):
+        pass
+
+    async def acquire(self, name, ttl) -> bool:
+        return True
+
+    async def release(self, name):
+        pass
+
+    async def cache_get(self, key):
+        return None
+
+    async def cache_set(self, key, value, ttl):
+        pass
+
+    async def cache_delete(self, key):
+        pass
+
+    async def cache_incr(self, key, ttl) -> int:
+        return 0
+
+
+# Координация через Mongo: документ лока / кэша живёт до expires_at,
+# протухшие подчищает TTL-индекс (а до того их отсекает фильтр по expires_at)
+class MongoCoordinator:
+    shared = True
+
+    def __init__(self, db):
+        self.locks = db.coordination_locks
+        self.cache = db.shared_cache
+        # Владелец локов — конкретный процесс
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+    async def ensure_indexes(self):
+        await self.locks.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+        await self.cache.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+
+
+    # Взять (или продлить свой) лок на ttl секунд; занят другим процессом -> False
+    async def acquire(self, name, ttl) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            # Свободный или протухший лок — upsert/перезапись; чужой живой — upsert упрётся в _id
+            await self.locks.update_one(
+                {"_id": name, "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+
+    async def release(self, name):
+        await self.locks.delete_one({"_id": name, "owner": self.owner})
+
+
+    async def cache_get(self, key):
+        doc = await self.cache.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        return doc["value"] if doc else None
+
+
+    async def cache_set(self, key, value, ttl):
+        await self.cache.update_one(
+            {"_id": key},
+            {"$set": {"value": value, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+
+    async def cache_delete(self, key):
+        await self.cache.delete_one({"_id": key})
+
+
+    # Счётчик в общем кэше (+1 атомарно), новое значение
+    async def cache_incr(self, key, ttl) -> int:
+        doc = await self.cache.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"value": 1}, "$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc["value"]
+
+
+def make_coordinator(db):
+    if COORDINATION == "mongo":
+        logger.info("🔗 Координация воркеров через Mongo")
+        return MongoCoordinator(db)
+    return LocalCoordinator()
+
+
+# Выбор лидера: фоновые задачи (онбординг, поллер платежей) крутятся только в одном воркере.
+# Лидер продлевает аренду; если он умер — через LEADER_LEASE_TTL её подхватит другой
+class LeaderElection:
+    def __init__(self, coordinator, on_elected, on_lost, name="leader", ttl=LEADER_LEASE_TTL):
+        self.coordinator = coordinator
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.name = name
+        self.ttl = ttl
+        self.is_leader = False
+        self._task: asyncio.Task | None = None
+
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+
+    async def _loop(self):
+        while True:
+            try:
+                leader = await self.coordinator.acquire(self.name, self.ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось продлить аренду лидера: {e}")
+                leader = False
+
+            if leader and not self.is_leader:
+                self.is_leader = True
+                logger.info("👑 Этот воркер — лидер, запускаю фоновые задачи")
+                await self._run(self.on_elected)
+            elif not leader and self.is_leader:
+                self.is_leader = False
+                logger.warning("⚠️ Аренда лидера потеряна, останавливаю фоновые задачи")
+                await self._run(self.on_lost)
+
+            await asyncio.sleep(self.ttl / 3)
+
+
+    async def _run(self, callback):
+        try:
+            await callback()
+        except Exception as e:
+            logger.error(f"❌ Ошибка фоновых задач лидера: {e}")
+
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self.is_leader:
+            self.is_leader = False
+            await self._run(self.on_lost)
+            await self.coordinator.release(self.name)
@@ -0,0 +1,104 @@
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+import os, re, time
+
+# С несколькими воркерами версию global_users перечитываем из Mongo не чаще раза в VERSION_TTL секунд
+GLOBAL_USERS_VERSION_TTL = float(os.getenv("GLOBAL_USERS_VERSION_TTL", "1"))
+
+
+# global_users (банки каждого пользователя) + версия коллекции в counters для ETag
+# version_ttl — как часто перечитывать версию из Mongo (None — её меняет только этот процесс)
+class GlobalUserStore:
+    def __init__(self, db, writer=None, version_ttl=None):
+        self.collection = db.global_users
+        self.counters = db.counters
+        self.writer = writer
+        self.version_ttl = version_ttl
+
+        self._version: int | None = None
+        self._version_read_at = 0.0
+        if writer:
+            # Версия растёт, только когда данные реально записаны
+            writer.on_flush(self.collection.name, self._bump_version)
+
+
+    # Уникальный индекс user_id_id создаёт database.ensure_indexes
+    async def ensure_indexes(self):
+        pass
+
+
+    # Добавить банки пользователям: record = {"client_id_id", "bank_name", ...}
+    async def add_banks(self, records: list[dict]):
+        operations = {
+            (record["client_id_id"], record["bank_name"]): UpdateOne(
+                {"user_id_id": record["client_id_id"]},
+                {"$addToSet": {"bank_names": record["bank_name"]}},
+                upsert=True                     # upsert создаст документ
+            )
+            for record in records
+        }
+        if not operations:
+            return
+        if self.writer:
+            for key, operation in operations.items():
+                self.writer.add(self.collection, key, operation)
+            return
+
+        await self.collection.bulk_write(list(operations.values()), ordered=False)
+        await self._bump_version()
+
+
+    async def bank_names(self, client_id_id) -> list[str]:
+        user_doc = await self.collection.find_one(
+            {"user_id_id": str(client_id_id)},
+            {"_id": 0, "bank_names": 1}
+        )
+        return (user_doc or {}).get("bank_names", [])
+
+
+    # До limit пользователей после cursor (user_id_id), по возрастанию id
+    async def page(self, limit, cursor=None, prefix=None) -> list[dict]:
+        return await self._find(cursor, prefix).limit(limit).to_list(length=limit)
+
+
+    # Все пользователи потоком, без загрузки коллекции в память
+    async def iter(self, prefix=None, batch_size=500):
+        async for doc in self._find(None, prefix).batch_size(batch_size):
+            yield doc
+
+
+    # prefix — поиск по началу user_id_id (якорный regex использует индекс)
+    def _find(self, cursor, prefix):
+        condition = {}
+        if cursor is not None:
+            condition["$gt"] = cursor
+        if prefix:
+            condition["$regex"] = f"^{re.escape(prefix)}"
+        query = {"user_id_id": condition} if condition else {}
+
+        return self.collection.find(query, {"_id": 0, "user_id_id": 1, "bank_names": 1}).sort("user_id_id", ASCENDING)
+
+
+    # Текущая версия; без обращения к Mongo, пока её не могли поменять другие процессы
+    async def version(self) -> int:
+        stale = self.version_ttl is not None and time.monotonic() - self._version_read_at > self.version_ttl
+        if self._version is None or stale:
+            doc = await self.counters.find_one({"_id": "global_users"})
+            self._version = (doc or {}).get("version", 0)
+            self._version_read_at = time.monotonic()
+        return self._version
+
+
+    async def _bump_version(self):
+        doc = await self.counters.find_one_and_update(
+            {"_id": "global_users"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._version = doc["version"]
+        self._version_read_at = time.monotonic()
+
+
+    # После очистки базы версию перечитываем заново
+    def reset(self):
+        self._version = None
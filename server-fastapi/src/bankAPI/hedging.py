@@ -0,0 +1,131 @@
+from bankAPI.resilience import RETRYABLE_STATUSES
+from collections import deque
+import asyncio, math, os
+
+# Hedged-запросы: если идемпотентный GET не ответил за p95 своего банка, шлём второй такой же
+# и берём первый успешный ответ, проигравший отменяем. Выключено по умолчанию
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "0") == "1"
+# Какие операции можно дублировать (имена operation из BankHelper._request)
+HEDGE_OPERATIONS = {op.strip() for op in os.getenv("HEDGE_OPERATIONS", "balances").split(",") if op.strip()}
+# Порог — квантиль задержки по последним HEDGE_WINDOW ответам банка, в пределах [MIN, MAX] секунд;
+# пока замеров меньше HEDGE_MIN_SAMPLES — HEDGE_DEFAULT_DELAY
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "1"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "5"))
+# Бюджет: каждый запрос даёт HEDGE_BUDGET_RATIO дубля (0.05 — не больше +5% нагрузки на банк),
+# накопить можно не больше HEDGE_BUDGET_BURST
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.05"))
+HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "10"))
+
+
+# Последние задержки банка для оценки квантиля (отсортировать пару сотен чисел дешевле запроса в банк)
+class LatencyWindow:
+    def __init__(self, size=HEDGE_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._quantile: float | None = None
+
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+        self._quantile = None
+
+
+    def __len__(self):
+        return len(self._samples)
+
+
+    def quantile(self, q) -> float:
+        if self._quantile is None:
+            ordered = sorted(self._samples)
+            self._quantile = ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+        return self._quantile
+
+
+class Hedger:
+    def __init__(self, enabled=HEDGE_REQUESTS, operations=HEDGE_OPERATIONS, quantile=HEDGE_QUANTILE):
+        self.enabled = enabled
+        self.operations = operations
+        self.quantile = quantile
+        self._latency: dict[tuple, LatencyWindow] = {}   # (bank_name, operation) -> задержки
+        self._budget: dict[str, float] = {}              # bank_name -> сколько дублей можно отправить
+        self.stats = {"requests": 0, "hedged": 0, "hedge_won": 0, "budget_exhausted": 0}
+
+
+    def applies(self, operation) -> bool:
+        return self.enabled and operation in self.operations
+
+
+    # Задержка ответа банка (только завершённые попытки: отменённые занизили бы квантиль)
+    def record(self, bank_name, operation, seconds):
+        if operation in self.operations:
+            self._latency.setdefault((bank_name, operation), LatencyWindow()).add(seconds)
+
+
+    # Сколько ждём первую попытку, прежде чем отправить дубль
+    def delay(self, bank_name, operation) -> float:
+        window = self._latency.get((bank_name, operation))
+        if window is None or len(window) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, window.quantile(self.quantile)))
+
+
+    def _spend_budget(self, bank_name) -> bool:
+        if self._budget.get(bank_name, 0.0) < 1:
+            self.stats["budget_exhausted"] += 1
+            return False
+        self._budget[bank_name] -= 1
+        return True
+
+
+    # send() — полный запрос (квота, bulkhead, повторы); can_hedge() — можно ли сейчас слать дубль
+    async def run(self, bank_name, operation, send, can_hedge=lambda: True):
+        self.stats["requests"] += 1
+        self._budget[bank_name] = min(HEDGE_BUDGET_BURST, self._budget.get(bank_name, 0.0) + HEDGE_BUDGET_RATIO)
+
+        first = asyncio.ensure_future(send())
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay(bank_name, operation))
+            if done or not can_hedge() or not self._spend_budget(bank_name):
+                return await first
+
+            self.stats["hedged"] += 1
+            tasks.add(asyncio.ensure_future(send()))
+
+            # Первый успешный ответ; исключение или 5xx/429 одной попытки — ждём вторую.
+            # Не удались обе — отдаём неудачный ответ банка (его статус разберёт вызывающий), иначе исключение
+            error = failed = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                    elif task.result().status in RETRYABLE_STATUSES:
+                        failed = failed or task.result()
+                    else:
+                        if task is not first:
+                            self.stats["hedge_won"] += 1
+                        return task.result()
+            if failed is not None:
+                return failed
+            raise error
+        finally:
+            # Проигравший (или обе попытки, если отменили нас самих) — отменяем
+            for task in tasks:
+                task.cancel()
+
+
+    # Для /transport/stats
+    def status(self) -> dict:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "budget": {bank: round(tokens, 2) for bank, tokens in self._budget.items()},
+            "delay": {
+                f"{bank}:{operation}": round(self.delay(bank, operation), 3)
+                for bank, operation in self._latency
+            }
+        }
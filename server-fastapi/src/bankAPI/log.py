@@ -0,0 +1,33 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit, logging, os, queue, sys
+
+# Уровень логов: DEBUG / INFO / WARNING / ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+_listener: QueueListener | None = None
+
+
+# Логи пишутся в stdout отдельным потоком: event loop только кладёт запись в очередь,
+# а сообщения ниже LOG_LEVEL отбрасываются ещё до форматирования
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logger = logging.getLogger("multibank")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.propagate = False
+
+
+def get_logger(name) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(f"multibank.{name}")
@@ -0,0 +1,169 @@
+from collections import Counter, deque
+from datetime import datetime, timezone
+from bankAPI.metrics import Histogram, Gauge
+from bankAPI.log import get_logger
+import asyncio, os, sys, threading, time, traceback
+
+# Задержка event loop: раз в LOOP_LAG_INTERVAL секунд засыпаем и меряем, насколько позже проснулись
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+# Watchdog-поток: loop не отвечает дольше LOOP_BLOCK_THRESHOLD_MS — снимаем стек потока loop'а
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_BLOCK_HISTORY = 20
+# Профилирование по запросу: предел длительности и частота снятия стека
+PROFILE_MAX_SECONDS = 60
+PROFILE_DEFAULT_INTERVAL_MS = 5
+
+logger = get_logger("loop_monitor")
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Насколько позже запланированного просыпается event loop", labels=(),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+LOOP_BLOCKED = Histogram(
+    "event_loop_blocked_seconds", "Сколько event loop не отвечал (блокировки дольше порога)", labels=()
+)
+
+
+# Здоровье event loop: задержка, блокировки со стеком виновника, число задач.
+# Блокировку видно только из другого потока — сам loop в это время стоит
+class LoopMonitor:
+    def __init__(self, lag_interval=LOOP_LAG_INTERVAL, block_threshold_ms=LOOP_BLOCK_THRESHOLD_MS):
+        self.lag_interval = lag_interval
+        self.block_threshold = block_threshold_ms / 1000
+
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._lag_task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._profile_lock = asyncio.Lock()
+
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.blocks: deque = deque(maxlen=LOOP_BLOCK_HISTORY)   # последние блокировки со стеком
+        self.blocks_total = 0
+
+        Gauge("event_loop_tasks", "Незавершённые asyncio-задачи по корутинам", self.task_counts)
+        Gauge("event_loop_lag_last_seconds", "Последний замер задержки event loop", lambda: round(self.lag, 6))
+        Gauge("event_loop_blocks", "Блокировки event loop с момента запуска", lambda: self.blocks_total)
+
+
+    # Вызывается из работающего loop'а (lifespan)
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._lag_task = asyncio.create_task(self._measure_lag())
+        if self.block_threshold > 0:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+
+    async def _measure_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.lag = max(0.0, time.perf_counter() - started - self.lag_interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG.observe(self.lag)
+
+
+    # Поток-сторож: кладёт в loop пустой колбэк и ждёт, пока тот выполнится
+    def _watch(self):
+        while not self._stopped.is_set():
+            pong = threading.Event()
+            sent = time.perf_counter()
+            try:
+                self.loop.call_soon_threadsafe(pong.set)
+            except RuntimeError:
+                return   # loop закрыт
+
+            if not pong.wait(self.block_threshold):
+                # Loop стоит прямо сейчас — стек его потока показывает, на чём
+                stack = self._loop_stack()
+                while not pong.wait(0.5) and not self._stopped.is_set():
+                    pass
+                self._record_block(time.perf_counter() - sent, stack)
+
+            self._stopped.wait(self.block_threshold)
+
+
+    def _loop_stack(self) -> list[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        return traceback.format_stack(frame) if frame else []
+
+
+    def _record_block(self, seconds, stack):
+        self.blocks_total += 1
+        LOOP_BLOCKED.observe(seconds)
+        self.blocks.append({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "blocked_ms": round(seconds * 1000, 1),
+            "stack": stack
+        })
+        where = stack[-1].strip().splitlines()[0] if stack else "?"
+        logger.warning(f"🐌 Event loop заблокирован на {seconds * 1000:.0f} мс: {where}")
+
+
+    # {("coro", имя корутины): число задач} — видно, какие задачи копятся
+    def task_counts(self) -> dict:
+        if self.loop is None:
+            return {}
+        counts = Counter(_task_name(task) for task in asyncio.all_tasks(self.loop) if not task.done())
+        return {("coro", name): count for name, count in counts.items()}
+
+
+    def status(self) -> dict:
+        return {
+            "lag_ms": round(self.lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "tasks": sum(self.task_counts().values()),
+            "blocks_total": self.blocks_total,
+            "recent_blocks": list(self.blocks)
+        }
+
+
+    # Сэмплирующий профиль потока loop'а: стек снимается из отдельного потока раз в interval,
+    # loop в это время продолжает работать. Результат — collapsed stacks
+    # ("кадр;кадр;кадр число") для flamegraph.pl / speedscope
+    async def profile(self, seconds, interval_ms=PROFILE_DEFAULT_INTERVAL_MS) -> str:
+        seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+        interval = max(0.001, interval_ms / 1000)
+        async with self._profile_lock:   # два профиля разом только мешают друг другу
+            stacks = await asyncio.to_thread(self._sample, seconds, interval)
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+
+    def is_profiling(self) -> bool:
+        return self._profile_lock.locked()
+
+
+    def _sample(self, seconds, interval) -> Counter:
+        stacks = Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                stacks[_collapse(frame)] += 1
+            time.sleep(interval)
+        return stacks
+
+
+    def close(self):
+        self._stopped.set()
+        if self._lag_task:
+            self._lag_task.cancel()
+
+
+# Стек от корня к вершине: "функция (файл:строка определения)" через ";"
+def _collapse(frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+def _task_name(task) -> str:
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or type(coro).__name__
@@ -0,0 +1,372 @@
+from datetime import datetime, timedelta, timezone
+from bankAPI.accounts import PENDING_CONSENT_FIELDS
+from bankAPI.consents import as_utc
+from bankAPI.transactions import TRANSACTION_SYNC_LOOKBACK_DAYS, TRANSACTION_SYNC_OVERLAP, \
+    TRANSACTIONS_PAGE_SIZE, TRANSACTIONS_MAX_PAGE_SIZE
+import copy, itertools
+
+
+# Хранилища в памяти процесса с теми же методами, что и Mongo-версии (STORAGE_BACKEND=memory).
+# Для бенчмарков и локальных прогонов без Mongo: всё живёт до перезапуска и только в одном воркере.
+# Наружу отдаём копии — как и Mongo, вызывающий не может поменять сохранённые данные
+
+
+class MemoryAccountStore:
+    def __init__(self):
+        self._records: dict[tuple, dict] = {}   # (bank_name, client_id_id) -> аккаунт
+
+
+    async def ensure_indexes(self):
+        pass
+
+
+    async def get(self, bank_name, client_id_id) -> dict | None:
+        record = self._records.get((bank_name, str(client_id_id)))
+        return copy.deepcopy(record) if record else None
+
+
+    async def list_keys(self) -> list[tuple[str, str]]:
+        return list(self._records)
+
+
+    async def exists(self, bank_name, client_id_id) -> bool:
+        return (bank_name, str(client_id_id)) in self._records
+
+
+    async def upsert(self, bank_name, client_id_id, fields: dict):
+        now = datetime.now(timezone.utc)
+        key = (bank_name, str(client_id_id))
+        record = self._records.setdefault(key, {"bank_name": bank_name, "client_id_id": key[1], "created_at": now})
+        record.update(copy.deepcopy(fields), updated_at=now)
+
+
+    async def bulk_upsert(self, records: list[dict]):
+        for record in records:
+            fields = {k: v for k, v in record.items() if k not in ("bank_name", "client_id_id")}
+            await self.upsert(record["bank_name"], record["client_id_id"], fields)
+
+
+    async def set_consent(self, bank_name, client_id_id, consent, status=None, expires_at=None) -> bool:
+        record = self._records.get((bank_name, str(client_id_id)))
+        if record is None:
+            return False
+
+        record.update(consent=consent, updated_at=datetime.now(timezone.utc))
+        if status:
+            record["consent_status"] = status
+        if expires_at:
+            record["consent_expires_at"] = expires_at
+        record.pop("consent_retry_at", None)
+        for field in PENDING_CONSENT_FIELDS:
+            record.pop(field, None)
+        return True
+
+
+    async def set_pending_consent(self, bank_name, client_id_id, consent, status, expires_at=None):
+        record = self._records.get((bank_name, str(client_id_id)))
+        if record is not None:
+            record.update(pending_consent=consent, pending_consent_status=status, pending_consent_expires_at=expires_at,
+                          updated_at=datetime.now(timezone.utc))
+
+
+    async def due_for_consent_renewal(self, before, limit) -> list[dict]:
+        now = datetime.now(timezone.utc)
+        due = [
+            record for record in self._records.values()
+            if (record.get("pending_consent")
+                or record.get("consent_expires_at") and as_utc(record["consent_expires_at"]) <= as_utc(before))
+            and (not record.get("consent_retry_at") or record["consent_retry_at"] <= now)
+        ]
+        far = datetime.max.replace(tzinfo=timezone.utc)
+        due.sort(key=lambda record: as_utc(record["consent_expires_at"]) if record.get("consent_expires_at") else far)
+        return [
+            {"bank_name": r["bank_name"], "client_id_id": r["client_id_id"], "consent_expires_at": r.get("consent_expires_at")}
+            for r in due[:limit]
+        ]
+
+
+    async def defer_consent_renewal(self, bank_name, client_id_id, delay_seconds):
+        record = self._records.get((bank_name, str(client_id_id)))
+        if record is not None:
+            record["consent_retry_at"] = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)
+
+
+    # Старого users в памяти нет
+    async def migrate_legacy_users(self, batch_size=500) -> int:
+        return 0
+
+
+class MemoryTokenStore:
+    def __init__(self):
+        self._tokens: dict[str, dict] = {}
+        self._banks: set[str] = set()
+
+
+    async def ensure_indexes(self):
+        pass
+
+
+    async def get(self, bank_name) -> dict | None:
+        record = self._tokens.get(bank_name)
+        return dict(record) if record else None
+
+
+    async def save(self, bank_name, access_token, expires_at):
+        self._tokens[bank_name] = {
+            "bank_name": bank_name,
+            "access_token": access_token,
+            "updated_at": datetime.now(timezone.utc),
+            "expires_at": expires_at
+        }
+
+
+    async def bank_exists(self, bank_name) -> bool:
+        return bank_name in self._banks
+
+
+    async def add_bank(self, bank_name) -> bool:
+        if bank_name in self._banks:
+            return False
+        self._banks.add(bank_name)
+        return True
+
+
+class MemoryGlobalUserStore:
+    def __init__(self):
+        self._users: dict[str, list[str]] = {}   # user_id_id -> bank_names
+        self._version = 0
+
+
+    async def ensure_indexes(self):
+        pass
+
+
+    async def add_banks(self, records: list[dict]):
+        if not records:
+            return
+        for record in records:
+            bank_names = self._users.setdefault(record["client_id_id"], [])
+            if record["bank_name"] not in bank_names:
+                bank_names.append(record["bank_name"])
+        self._version += 1
+
+
+    async def bank_names(self, client_id_id) -> list[str]:
+        return list(self._users.get(str(client_id_id), []))
+
+
+    async def page(self, limit, cursor=None, prefix=None) -> list[dict]:
+        return list(itertools.islice(self._find(cursor, prefix), limit))
+
+
+    async def iter(self, prefix=None, batch_size=500):
+        for doc in self._find(None, prefix):
+            yield doc
+
+
+    def _find(self, cursor, prefix):
+        for user_id_id in sorted(self._users):
+            if cursor is not None and user_id_id <= cursor:
+                continue
+            if prefix and not user_id_id.startswith(prefix):
+                continue
+            yield {"user_id_id": user_id_id, "bank_names": list(self._users[user_id_id])}
+
+
+    async def version(self) -> int:
+        return self._version
+
+
+class MemoryTransferStore:
+    def __init__(self):
+        self._transfers: dict[str, dict] = {}   # idempotency_key -> перевод
+
+
+    async def ensure_indexes(self):
+        pass
+
+
+    async def create(self, idempotency_key, request: dict) -> tuple[dict, bool]:
+        existing = self._transfers.get(idempotency_key)
+        if existing:
+            return copy.deepcopy(existing), False
+
+        now = datetime.now(timezone.utc)
+        doc = {
+            "idempotency_key": idempotency_key,
+            "request": copy.deepcopy(request),
+            "state": "consent_requested",
+            "history": [{"state": "consent_requested", "at": now}],
+            "attempts": [],
+            "created_at": now,
+            "updated_at": now
+        }
+        self._transfers[idempotency_key] = doc
+        return copy.deepcopy(doc), True
+
+
+    async def restart_failed(self, idempotency_key) -> dict | None:
+        doc = self._transfers.get(idempotency_key)
+        if doc is None or doc["state"] != "failed" or doc["attempts"]:
+            return None
+        now = datetime.now(timezone.utc)
+        doc.pop("error", None)
+        doc.pop("result", None)
+        doc.update(state="consent_requested", updated_at=now)
+        doc["history"].append({"state": "consent_requested", "at": now})
+        return copy.deepcopy(doc)
+
+
+    async def get(self, idempotency_key) -> dict | None:
+        doc = self._transfers.get(idempotency_key)
+        return copy.deepcopy(doc) if doc else None
+
+
+    async def find(self, transfer_or_payment_id) -> dict | None:
+        doc = self._transfers.get(transfer_or_payment_id) or next(
+            (doc for doc in self._transfers.values() if doc.get("payment_id") == transfer_or_payment_id), None
+        )
+        return copy.deepcopy(doc) if doc else None
+
+
+    async def due_for_check(self, limit) -> list[dict]:
+        now = datetime.now(timezone.utc)
+        due = [
+            doc for doc in self._transfers.values()
+            if doc["state"] == "submitted" and doc.get("payment_id") is not None
+            and doc.get("next_check_at") and doc["next_check_at"] <= now
+        ]
+        due.sort(key=lambda doc: doc["next_check_at"])
+        return [
+            {k: copy.deepcopy(v) for k, v in doc.items() if k not in ("history", "attempts")}
+            for doc in due[:limit]
+        ]
+
+
+    async def mark_lost_submissions(self, older_than) -> int:
+        now = datetime.now(timezone.utc)
+        lost = [
+            doc for doc in self._transfers.values()
+            if doc["state"] == "submitted" and doc.get("payment_id") is None
+            and doc["updated_at"] <= now - timedelta(seconds=older_than)
+        ]
+        for doc in lost:
+            doc.update(state="unknown", updated_at=now, error="Ответ банка на отправку платежа не получен")
+            doc["history"].append({"state": "unknown", "at": now})
+        return len(lost)
+
+
+    async def schedule_check(self, idempotency_key, delay_seconds, bank_status=None):
+        doc = self._transfers.get(idempotency_key)
+        if doc is None:
+            return
+        doc["next_check_at"] = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)
+        if bank_status:
+            doc["bank_status"] = bank_status
+        doc["checks"] = doc.get("checks", 0) + 1
+
+
+    async def set_state(self, idempotency_key, state, **fields) -> dict | None:
+        doc = self._transfers.get(idempotency_key)
+        if doc is None:
+            return None
+        now = datetime.now(timezone.utc)
+        doc.update(copy.deepcopy(fields), state=state, updated_at=now)
+        doc["history"].append({"state": state, "at": now})
+        return copy.deepcopy(doc)
+
+
+    async def mark_submitted(self, idempotency_key, interaction_id):
+        doc = self._transfers.get(idempotency_key)
+        if doc is None:
+            return
+        now = datetime.now(timezone.utc)
+        doc.update(state="submitted", updated_at=now)
+        doc["history"].append({"state": "submitted", "at": now})
+        doc["attempts"].append({"interaction_id": interaction_id, "at": now})
+
+
+class MemoryTransactionStore:
+    def __init__(self):
+        # (bank_name, account_id, transaction_id) -> операция; seq — порядок вставки вместо _id
+        self._transactions: dict[tuple, dict] = {}
+        self._high_water_marks: dict[tuple, datetime] = {}
+        self._resume: dict[tuple, tuple[datetime, int]] = {}   # (bank_name, account_id) -> (since, page)
+        self._seq = itertools.count(1)
+
+
+    async def ensure_indexes(self):
+        pass
+
+
+    async def sync_window(self, bank_name, account_id) -> tuple[datetime, int]:
+        key = (bank_name, account_id)
+        if key in self._resume:
+            return self._resume[key]
+        high_water_mark = self._high_water_marks.get(key)
+        if high_water_mark is None:
+            return datetime.now(timezone.utc) - timedelta(days=TRANSACTION_SYNC_LOOKBACK_DAYS), 1
+        return high_water_mark - TRANSACTION_SYNC_OVERLAP, 1
+
+
+    async def set_high_water_mark(self, bank_name, account_id, client_id_id, high_water_mark, resume=None):
+        key = (bank_name, account_id)
+        if resume:
+            self._resume[key] = resume
+        else:
+            self._resume.pop(key, None)
+        if high_water_mark is None:
+            return
+        previous = self._high_water_marks.get(key)
+        self._high_water_marks[key] = high_water_mark if previous is None else max(previous, high_water_mark)
+
+
+    async def bulk_upsert(self, rows: list[dict]) -> int:
+        inserted = 0
+        for row in rows:
+            key = (row["bank_name"], row["account_id"], row["transaction_id"])
+            doc = self._transactions.get(key)
+            if doc is None:
+                doc = self._transactions[key] = {"_seq": next(self._seq)}
+                inserted += 1
+            doc.update(row)
+        return inserted
+
+
+    # Та же сортировка и курсор, что у TransactionStore, только "<booking_date_time>|<seq>"
+    async def history(self, client_id_id, bank_name=None, limit=TRANSACTIONS_PAGE_SIZE, cursor=None) -> dict:
+        limit = max(1, min(int(limit), TRANSACTIONS_MAX_PAGE_SIZE))
+
+        docs = [
+            doc for doc in self._transactions.values()
+            if doc["client_id_id"] == str(client_id_id) and (not bank_name or doc["bank_name"] == bank_name)
+        ]
+        docs.sort(key=_history_key, reverse=True)
+
+        after = _parse_cursor(cursor)
+        if after:
+            docs = [doc for doc in docs if _history_key(doc) < after]
+
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        next_cursor = None
+        if has_more:
+            last = docs[-1]
+            next_cursor = f"{last['booking_date_time'].isoformat()}|{last['_seq']}"
+
+        transactions = [{k: v for k, v in doc.items() if k != "_seq"} for doc in docs]
+        return {"transactions": transactions, "next_cursor": next_cursor}
+
+
+def _history_key(doc) -> tuple:
+    return as_utc(doc["booking_date_time"]), doc["_seq"]
+
+
+def _parse_cursor(cursor):
+    if not cursor or "|" not in cursor:
+        return None
+    booked, seq = cursor.rsplit("|", 1)
+    try:
+        return as_utc(datetime.fromisoformat(booked)), int(seq)
+    except ValueError:
+        return None
@@ -0,0 +1,158 @@
+from contextvars import ContextVar
+import threading, time
+
+# Границы бакетов гистограмм (секунды)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+
+
+# Prometheus-гистограмма с метками; observe может вызываться из потоков драйвера Mongo
+class Histogram:
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}   # значения меток -> [счётчики бакетов..., sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            labels = _format_labels(self.labels, key)
+            for i, bound in enumerate(self.buckets):
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {series[i]}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+# Gauge, значение которого считается в момент отдачи /metrics
+class Gauge:
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect      # () -> число или {(метка, значение): число}
+        REGISTRY.append(self)
+
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.collect()
+        if isinstance(value, dict):
+            for (label, label_value), number in value.items():
+                lines.append(f'{self.name}{{{label}="{label_value}"}} {number}')
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+REGISTRY: list = []
+
+BANK_REQUEST_DURATION = Histogram(
+    "bank_request_duration_seconds", "Длительность запросов к API банков",
+    ["bank", "operation", "status"]
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds", "Длительность команд Mongo",
+    ["command", "collection", "status"]
+)
+MONGO_OPERATION_DURATION = Histogram(
+    "mongo_operation_duration_seconds", "Длительность операций Mongo для сервиса (await, чтение курсора)",
+    ["collection", "operation"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Длительность обработки входящих запросов",
+    ["method", "route", "status"]
+)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(names, values) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# --------------------------- Server-Timing -----------------------------------------------------------
+# Тайминги текущего входящего запроса: имя -> [секунды, количество]
+_request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+
+# count=0 — продолжение уже посчитанной операции (следующая пачка курсора)
+def record_timing(name, seconds, count=1):
+    timings = _request_timings.get()
+    if timings is not None:
+        timing = timings.setdefault(name, [0.0, 0])
+        timing[0] += seconds
+        timing[1] += count
+
+
+# Запрос к банку: в гистограмму и в Server-Timing текущего запроса
+def observe_bank_request(bank_name, operation, status, seconds):
+    BANK_REQUEST_DURATION.observe(seconds, bank=bank_name, operation=operation, status=status)
+    record_timing(f"bank-{bank_name}-{operation}", seconds)
+
+
+# ASGI-middleware: гистограмма по эндпоинтам + заголовок Server-Timing
+# (bank-<банк>-<операция>, mongo, total) — видно, на что ушло время запроса
+class ServerTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                total = time.perf_counter() - started
+                header = _server_timing_header(timings, total)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started,
+                                          method=scope["method"], route=route, status=status["code"])
+
+
+def _server_timing_header(timings, total) -> str:
+    parts = [f'{name};dur={seconds * 1000:.1f};desc="{count}x"' for name, (seconds, count) in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
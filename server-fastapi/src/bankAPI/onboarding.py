@@ -0,0 +1,148 @@
+from datetime import datetime, timezone
+import asyncio, os
+from bankAPI.log import get_logger
+
+# Сколько аккаунтов одного банка онбордим одновременно
+ONBOARDING_CONCURRENCY = int(os.getenv("ONBOARDING_CONCURRENCY", "3"))
+# Записи в БД копим и сбрасываем пачкой: по размеру или по времени
+ONBOARDING_BATCH_SIZE = int(os.getenv("ONBOARDING_BATCH_SIZE", "50"))
+ONBOARDING_FLUSH_INTERVAL = float(os.getenv("ONBOARDING_FLUSH_INTERVAL", "0.5"))
+
+logger = get_logger("onboarding")
+
+
+# Фоновый онбординг аккаунтов: очередь на банк, ограниченная параллельность на банк,
+# запись в Mongo пачками через BankHelper.save_accounts (bulk_write).
+# on_saved(bank_name, client_id_id) — вызывается для каждого записанного аккаунта
+class OnboardingQueue:
+    def __init__(self, bank_helper, concurrency=ONBOARDING_CONCURRENCY,
+                 batch_size=ONBOARDING_BATCH_SIZE, flush_interval=ONBOARDING_FLUSH_INTERVAL, on_saved=None):
+        self.bank_helper = bank_helper
+        self.on_saved = on_saved
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queues: dict[str, asyncio.Queue] = {}   # bank_name -> очередь client_id_id
+        self._workers: list[asyncio.Task] = []
+        self._pending: list[dict] = []                # найденные аккаунты, ждут записи
+        self._flush_lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+
+        self.stats = {
+            "total": 0, "added": 0, "skipped": 0, "failed": 0,
+            "started_at": None, "finished_at": None
+        }
+
+
+    # Поставить аккаунт в очередь (можно и после start)
+    def submit(self, bank_name, client_id_id):
+        queue = self._queues.get(bank_name)
+        if queue is None:
+            queue = self._queues[bank_name] = asyncio.Queue()
+            if self._flusher:
+                self._spawn_workers(bank_name)
+
+        queue.put_nowait(str(client_id_id))
+        self.stats["total"] += 1
+        self.stats["finished_at"] = None
+
+
+    # Запуск воркеров — сразу возвращает управление, сервер уже может принимать запросы
+    def start(self):
+        self.stats["started_at"] = datetime.now(timezone.utc)
+        self._flusher = asyncio.create_task(self._flush_loop())
+        for bank_name in self._queues:
+            self._spawn_workers(bank_name)
+
+
+    def _spawn_workers(self, bank_name):
+        for _ in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker(bank_name)))
+
+
+    async def _worker(self, bank_name):
+        queue = self._queues[bank_name]
+        while True:
+            client_id_id = await queue.get()
+            try:
+                record = await self.bank_helper.discover_account(bank_name, client_id_id)
+                if record is None:
+                    self.stats["skipped"] += 1
+                else:
+                    self._pending.append(record)
+                    if len(self._pending) >= self.batch_size:
+                        await self._flush()
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"❌ Онбординг {bank_name}/{client_id_id} не удался: {e}")
+            finally:
+                queue.task_done()
+                await self._check_finished()
+
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush()
+            # Последняя пачка могла записываться, пока воркер проверял окончание
+            await self._check_finished()
+
+
+    async def _flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await self.bank_helper.save_accounts(batch)
+                self.stats["added"] += len(batch)
+                logger.info(f"✅ Онбординг: записано аккаунтов — {len(batch)}")
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.error(f"❌ Онбординг: ошибка записи пачки ({len(batch)}): {e}")
+                return
+            if self.on_saved:
+                for record in batch:
+                    self.on_saved(record["bank_name"], record["client_id_id"])
+
+
+    # Когда очереди пусты — дописываем хвост и фиксируем время окончания.
+    # Найденные, но ещё не записанные аккаунты (_pending) считаются в in_progress до записи,
+    # поэтому сначала пишем хвост, потом проверяем
+    async def _check_finished(self):
+        if self.in_progress > len(self._pending):
+            return   # ещё есть аккаунты в очередях или в работе
+        await self._flush()
+        if not self.in_progress and self.stats["finished_at"] is None:
+            self.stats["finished_at"] = datetime.now(timezone.utc)
+            logger.info(f"🏁 Онбординг завершён: {self.status()}")
+
+
+    @property
+    def in_progress(self) -> int:
+        processed = self.stats["added"] + self.stats["skipped"] + self.stats["failed"]
+        return self.stats["total"] - processed
+
+
+    @property
+    def done(self) -> bool:
+        return self.in_progress == 0
+
+
+    # Прогресс для /ready
+    def status(self) -> dict:
+        return {
+            **self.stats,
+            "in_progress": self.in_progress,
+            "queued": {bank: queue.qsize() for bank, queue in self._queues.items()},
+            "done": self.done
+        }
+
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        if self._flusher:
+            self._flusher.cancel()
+        await self._flush()
@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+import asyncio, os, time
+from bankAPI.log import get_logger
+
+# Как часто поллер просыпается и сколько платежей берёт за раз
+PAYMENT_POLL_INTERVAL = float(os.getenv("PAYMENT_POLL_INTERVAL", "5"))
+PAYMENT_POLL_BATCH = int(os.getenv("PAYMENT_POLL_BATCH", "100"))
+# Ограничения на банк: одновременные проверки и проверок в секунду
+PAYMENT_POLL_CONCURRENCY = int(os.getenv("PAYMENT_POLL_CONCURRENCY", "4"))
+PAYMENT_POLL_RATE = float(os.getenv("PAYMENT_POLL_RATE", "5"))
+# Backoff между проверками одного платежа и сколько всего ждём проведения
+PAYMENT_RECHECK_MAX_DELAY = float(os.getenv("PAYMENT_RECHECK_MAX_DELAY", "300"))
+PAYMENT_MAX_AGE = float(os.getenv("PAYMENT_MAX_AGE", str(24 * 3600)))
+# Через сколько секунд отправка без payment_id считается потерянной (больше таймаута запроса с ретраями)
+PAYMENT_SUBMIT_TIMEOUT = float(os.getenv("PAYMENT_SUBMIT_TIMEOUT", "300"))
+
+SETTLED_STATUSES = {"AcceptedSettlementCompleted"}
+FAILED_STATUSES = {"Rejected", "Cancelled", "Failed"}
+
+logger = get_logger("payments")
+
+
+# Фоновая проверка статусов неподтверждённых платежей (state == "submitted" + payment_id)
+class PaymentPoller:
+    def __init__(self, bank_helper, interval=PAYMENT_POLL_INTERVAL, batch_size=PAYMENT_POLL_BATCH):
+        self.bank_helper = bank_helper
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self._task: asyncio.Task | None = None
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._rate_locks: dict[str, asyncio.Lock] = {}
+        self._last_request: dict[str, float] = {}
+
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+
+    async def _loop(self):
+        while True:
+            try:
+                checked = await self.poll_once()
+            except Exception as e:
+                logger.error(f"❌ Поллер платежей: {e}")
+                checked = 0
+            # Если пачка была полной — сразу берём следующую
+            if checked < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+
+    # Одна пачка: группируем по банку и проверяем с ограничениями на каждый банк
+    async def poll_once(self) -> int:
+        lost = await self.bank_helper.transfers.mark_lost_submissions(PAYMENT_SUBMIT_TIMEOUT)
+        if lost:
+            logger.warning(f"⚠️ {lost} платежей без ответа банка переведены в unknown")
+
+        transfers = await self.bank_helper.transfers.due_for_check(self.batch_size)
+        if not transfers:
+            return 0
+
+        by_bank: dict[str, list] = {}
+        for transfer in transfers:
+            by_bank.setdefault(transfer["request"]["from_bank"], []).append(transfer)
+
+        await asyncio.gather(*(
+            self._check(bank_name, transfer)
+            for bank_name, bank_transfers in by_bank.items()
+            for transfer in bank_transfers
+        ))
+        return len(transfers)
+
+
+    async def _check(self, bank_name, transfer):
+        semaphore = self._semaphores.setdefault(bank_name, asyncio.Semaphore(PAYMENT_POLL_CONCURRENCY))
+        async with semaphore:
+            await self._throttle(bank_name)
+            try:
+                await self.bank_helper.refresh_payment_status(transfer)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось проверить платёж {transfer.get('payment_id')} в {bank_name}: {e}")
+                await self.bank_helper.transfers.schedule_check(
+                    transfer["idempotency_key"], recheck_delay(transfer.get("checks", 0))
+                )
+
+
+    # Не чаще PAYMENT_POLL_RATE запросов в секунду в один банк
+    async def _throttle(self, bank_name):
+        lock = self._rate_locks.setdefault(bank_name, asyncio.Lock())
+        async with lock:
+            wait = self._last_request.get(bank_name, 0) + 1 / PAYMENT_POLL_RATE - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_request[bank_name] = time.monotonic()
+
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+
+
+# Экспоненциальная пауза между проверками одного платежа
+def recheck_delay(checks) -> float:
+    return min(PAYMENT_RECHECK_MAX_DELAY, PAYMENT_POLL_INTERVAL * 2 ** checks)
+
+
+# Платёж висит дольше PAYMENT_MAX_AGE — перестаём ждать
+def is_expired(transfer) -> bool:
+    created_at = transfer["created_at"]
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created_at).total_seconds() > PAYMENT_MAX_AGE
@@ -0,0 +1,178 @@
+from aiohttp import ClientError
+import asyncio, os, random, time
+from bankAPI.log import get_logger
+
+# Bulkhead: сколько одновременных запросов в один банк и сколько ждать свободного места
+BANK_MAX_CONCURRENCY = int(os.getenv("BANK_MAX_CONCURRENCY", "20"))
+BANK_QUEUE_TIMEOUT = float(os.getenv("BANK_QUEUE_TIMEOUT", "2"))
+# Circuit breaker: после скольких ошибок подряд банк считаем лежащим и на сколько секунд
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+# Повторы (только для идемпотентных GET): количество попыток и backoff с джиттером
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+
+# Эти статусы — проблема банка, а не запроса: считаем ошибкой и можно повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+logger = get_logger("resilience")
+
+
+# Банк сейчас недоступен (breaker открыт или bulkhead переполнен) — отвечаем сразу, без ожидания
+class BankUnavailableError(Exception):
+    def __init__(self, bank_name, reason, retry_after=None):
+        self.bank_name = bank_name
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"❌ Банк '{bank_name}' недоступен: {reason}")
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"          # closed -> open -> half_open -> closed
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+
+    # Можно ли сейчас идти в банк; в half_open пропускаем только один пробный запрос
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"🔌 Circuit breaker открыт после {self.failures} ошибок")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+    # Запрос так и не дошёл до банка — пробу можно отдать следующему
+    def release_probe(self):
+        self._probe_in_flight = False
+
+
+    # Сколько секунд до следующей пробы
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+# Bulkhead + circuit breaker + повторы с джиттером, отдельно на каждый банк
+class BankResilience:
+    def __init__(self):
+        self._bulkheads: dict[str, asyncio.Semaphore] = {}
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._waiting: dict[str, int] = {}
+        self._in_flight: dict[str, int] = {}
+
+
+    def breaker(self, bank_name) -> CircuitBreaker:
+        return self._breakers.setdefault(bank_name, CircuitBreaker())
+
+
+    # attempt() — один запрос в банк, возвращает ответ с полем status
+    async def call(self, bank_name, attempt, retry=False):
+        attempts = RETRY_ATTEMPTS if retry else 1
+
+        for number in range(1, attempts + 1):
+            try:
+                response = await self._call_once(bank_name, attempt)
+            except BankUnavailableError:
+                raise
+            except (ClientError, asyncio.TimeoutError) as e:
+                if number == attempts:
+                    raise
+                logger.warning(f"🔁 {bank_name}: попытка {number} не удалась ({type(e).__name__}), повторяем")
+            else:
+                if response.status not in RETRYABLE_STATUSES or number == attempts:
+                    return response
+                logger.warning(f"🔁 {bank_name}: попытка {number} вернула {response.status}, повторяем")
+
+            await asyncio.sleep(_backoff(number))
+
+
+    async def _call_once(self, bank_name, attempt):
+        breaker = self.breaker(bank_name)
+        if not breaker.allow():
+            raise BankUnavailableError(bank_name, "circuit_open", retry_after=breaker.retry_after())
+
+        bulkhead = self._bulkheads.setdefault(bank_name, asyncio.Semaphore(BANK_MAX_CONCURRENCY))
+        self._waiting[bank_name] = self._waiting.get(bank_name, 0) + 1
+        try:
+            await asyncio.wait_for(bulkhead.acquire(), timeout=BANK_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Запрос так и не дошёл до банка — пробу отпускаем
+            breaker.release_probe()
+            raise BankUnavailableError(bank_name, "bulkhead_full", retry_after=BANK_QUEUE_TIMEOUT)
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        finally:
+            self._waiting[bank_name] -= 1
+
+        self._in_flight[bank_name] = self._in_flight.get(bank_name, 0) + 1
+        try:
+            response = await attempt()
+        except Exception:
+            # Сеть, таймаут или битый ответ (например, не декодируется) — попытка не удалась;
+            # без исхода проба half-open так и осталась бы "в полёте", а банк — закрытым навсегда
+            breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        finally:
+            self._in_flight[bank_name] -= 1
+            bulkhead.release()
+
+        if response.status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+
+    # Сколько запросов сейчас ждут места в bulkhead банка (без bank_name — по всем банкам)
+    def queue_depth(self, bank_name=None) -> int:
+        if bank_name is not None:
+            return self._waiting.get(bank_name, 0)
+        return sum(self._waiting.values())
+
+
+    # Состояние по банкам (для /transport/stats)
+    def stats(self) -> dict:
+        stats = {}
+        for bank_name, breaker in self._breakers.items():
+            stats[bank_name] = {
+                "breaker": breaker.state,
+                "consecutive_failures": breaker.failures,
+                "in_flight": self._in_flight.get(bank_name, 0),
+                "waiting": self._waiting.get(bank_name, 0)
+            }
+        return stats
+
+
+# Экспоненциальный backoff с "full jitter", чтобы повторы разных запросов не шли пачкой
+def _backoff(number) -> float:
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (number - 1)))
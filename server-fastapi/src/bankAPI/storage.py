@@ -0,0 +1,100 @@
+from bankAPI.accounts import AccountStore
+from bankAPI.tokens import TokenStore
+from bankAPI.globalUsers import GlobalUserStore, GLOBAL_USERS_VERSION_TTL
+from bankAPI.transfers import TransferStore
+from bankAPI.transactions import TransactionStore
+from bankAPI.memoryStore import MemoryAccountStore, MemoryTokenStore, MemoryGlobalUserStore, \
+    MemoryTransferStore, MemoryTransactionStore
+from bankAPI.writeBehind import WriteBehind, WRITE_BEHIND
+from bankAPI.log import get_logger
+import os
+
+# Где хранить данные: mongo — рабочий режим, memory — бенчмарки и прогоны без Mongo (один воркер)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+
+logger = get_logger("storage")
+
+
+# Набор хранилищ BankHelper: аккаунты (с согласиями), токены и банки, global_users, переводы, операции
+class MongoStorage:
+    # shared — данные меняют и другие воркеры (версию global_users перечитываем из Mongo)
+    def __init__(self, db, shared=False, write_behind=WRITE_BEHIND):
+        self.db = db
+        # Отложенная запись global_users при онбординге (WRITE_BEHIND=1); токены пишутся сразу
+        self.writer = WriteBehind() if write_behind else None
+
+        self.accounts = AccountStore(db)
+        self.tokens = TokenStore(db)
+        self.global_users = GlobalUserStore(
+            db, writer=self.writer, version_ttl=GLOBAL_USERS_VERSION_TTL if shared else None
+        )
+        self.transfers = TransferStore(db)
+        self.transactions = TransactionStore(db)
+
+
+    async def ensure_indexes(self):
+        for store in (self.accounts, self.tokens, self.global_users, self.transfers, self.transactions):
+            await store.ensure_indexes()
+
+
+    def start(self):
+        if self.writer:
+            self.writer.start()
+
+
+    # Дописываем всё, что лежит в очереди отложенной записи
+    async def close(self):
+        if self.writer:
+            await self.writer.close()
+
+
+    #ONLY FOR TESTING ( Убиваем коллекции, кроме keep )
+    async def drop(self, keep=()):
+        if self.writer:
+            await self.writer.flush()
+        for collection_name in await self.db.list_collection_names():
+            if collection_name in keep:
+                continue
+            await self.db[collection_name].drop()
+            logger.info(f"🗑️ Коллекция '{collection_name}' удалена")
+        self.global_users.reset()
+
+
+class MemoryStorage:
+    def __init__(self):
+        self.writer = None
+        self.accounts = MemoryAccountStore()
+        self.tokens = MemoryTokenStore()
+        self.global_users = MemoryGlobalUserStore()
+        self.transfers = MemoryTransferStore()
+        self.transactions = MemoryTransactionStore()
+
+
+    async def ensure_indexes(self):
+        pass
+
+
+    def start(self):
+        pass
+
+
+    async def close(self):
+        pass
+
+
+    # Очищаем на месте: на эти же объекты ссылается BankHelper
+    async def drop(self, keep=()):
+        stores = {
+            "bank_accounts": self.accounts, "access_tokens": self.tokens, "global_users": self.global_users,
+            "transfers": self.transfers, "bank_transactions": self.transactions
+        }
+        for collection_name, store in stores.items():
+            if collection_name not in keep:
+                store.__init__()
+
+
+def make_storage(db, shared=False):
+    if STORAGE_BACKEND == "memory":
+        logger.info("🧪 Хранилище в памяти процесса (STORAGE_BACKEND=memory)")
+        return MemoryStorage()
+    return MongoStorage(db, shared=shared)
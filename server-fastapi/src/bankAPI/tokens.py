@@ -0,0 +1,50 @@
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timezone
+
+
+# Банки (bank_names) и их access_token (access_tokens).
+# Токен пишется сразу, без отложенной записи: при нескольких воркерах остальные ждут его в Mongo,
+# пока обновивший держит лок, — токен должен оказаться там до того, как лок отпущен
+class TokenStore:
+    def __init__(self, db):
+        self.tokens = db.access_tokens
+        self.banks = db.bank_names
+
+
+    # Уникальные индексы bank_name создаёт database.ensure_indexes
+    async def ensure_indexes(self):
+        pass
+
+
+    # {"access_token", "updated_at", "expires_at"} или None
+    async def get(self, bank_name) -> dict | None:
+        return await self.tokens.find_one({"bank_name": bank_name}, {"_id": 0})
+
+
+    async def save(self, bank_name, access_token, expires_at):
+        query = {"bank_name": bank_name}               # фильтр — по имени банка
+        update = {"$set": {
+            "access_token": access_token,
+            "updated_at": datetime.now(timezone.utc),
+            "expires_at": expires_at
+        }}
+        # upsert — запись появится при первом получении токена
+        await self.tokens.update_one(query, update, upsert=True)
+
+
+    async def bank_exists(self, bank_name) -> bool:
+        return await self.banks.find_one({"bank_name": bank_name}) is not None
+
+
+    # Атомарно: проверка и вставка одним upsert (уникальный индекс bank_name_unique)
+    # True — банк добавлен сейчас, False — уже был
+    async def add_bank(self, bank_name) -> bool:
+        try:
+            result = await self.banks.update_one(
+                {"bank_name": bank_name},
+                {"$setOnInsert": {"bank_name": bank_name}},
+                upsert=True
+            )
+            return result.upserted_id is not None
+        except DuplicateKeyError:
+            return False   # параллельный upsert успел первым
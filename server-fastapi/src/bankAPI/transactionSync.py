@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+from bankAPI.log import get_logger
+import asyncio, os
+
+# Как часто проходим по всем счетам
+TRANSACTION_SYNC_INTERVAL = float(os.getenv("TRANSACTION_SYNC_INTERVAL", "600"))
+# Сколько счетов одного банка синхронизируем одновременно
+TRANSACTION_SYNC_CONCURRENCY = int(os.getenv("TRANSACTION_SYNC_CONCURRENCY", "2"))
+
+logger = get_logger("transaction_sync")
+
+
+# Фоновая инкрементальная синхронизация истории операций из банков в bank_transactions.
+# Каждый счёт забирается с его high-water mark, поэтому проход по уже синхронизированным
+# счетам стоит по одному-два запроса в банк. Только что онбордированные счета (submit)
+# синхронизируются сразу, не дожидаясь следующего прохода
+class TransactionSync:
+    def __init__(self, bank_helper, interval=TRANSACTION_SYNC_INTERVAL, concurrency=TRANSACTION_SYNC_CONCURRENCY):
+        self.bank_helper = bank_helper
+        self.interval = interval
+        self.concurrency = concurrency
+
+        self._task: asyncio.Task | None = None
+        self._workers: list[asyncio.Task] = []
+        self._queue: asyncio.Queue = asyncio.Queue()   # (bank_name, client_id_id) новых счетов
+        self._queued: set[tuple] = set()
+        self.stats = {"synced_accounts": 0, "new_transactions": 0, "failed": 0, "last_run_at": None}
+
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+        self._workers = [asyncio.create_task(self._drain()) for _ in range(self.concurrency)]
+
+
+    # Счёт только что записан (OnboardingQueue) — синхронизировать, не дожидаясь прохода
+    def submit(self, bank_name, client_id_id):
+        key = (bank_name, str(client_id_id))
+        if key not in self._queued:
+            self._queued.add(key)
+            self._queue.put_nowait(key)
+
+
+    async def _drain(self):
+        while True:
+            bank_name, client_id_id = await self._queue.get()
+            self._queued.discard((bank_name, client_id_id))
+            await self._sync_account(bank_name, client_id_id)
+
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.sync_all()
+            except Exception as e:
+                logger.error(f"❌ Синхронизация операций: {e}")
+            await asyncio.sleep(self.interval)
+
+
+    # Один проход по всем аккаунтам; банки параллельно, внутри банка — не больше concurrency
+    async def sync_all(self) -> int:
+        semaphores: dict[str, asyncio.Semaphore] = {}
+
+        async def sync(bank_name, client_id_id):
+            semaphore = semaphores.setdefault(bank_name, asyncio.Semaphore(self.concurrency))
+            async with semaphore:
+                return await self._sync_account(bank_name, client_id_id)
+
+        accounts = await self.bank_helper.accounts.list_keys()
+        results = await asyncio.gather(*(sync(bank_name, client_id_id) for bank_name, client_id_id in accounts))
+
+        self.stats["last_run_at"] = datetime.now(timezone.utc)
+        added = sum(results)
+        logger.info(f"🔄 Синхронизация операций: счетов {len(accounts)}, новых операций {added}")
+        return added
+
+
+    async def _sync_account(self, bank_name, client_id_id) -> int:
+        try:
+            added = await self.bank_helper.sync_transactions(bank_name, client_id_id)
+            self.stats["synced_accounts"] += 1
+            self.stats["new_transactions"] += added
+            return added
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning(f"⚠️ Операции {bank_name}/{client_id_id} не синхронизированы: {e}")
+            return 0
+
+
+    async def close(self):
+        for task in (self._task, *self._workers):
+            if task:
+                task.cancel()
@@ -0,0 +1,172 @@
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timedelta, timezone
+from bankAPI.consents import as_utc
+import os
+
+# Первая синхронизация счёта — за сколько дней назад берём историю
+TRANSACTION_SYNC_LOOKBACK_DAYS = float(os.getenv("TRANSACTION_SYNC_LOOKBACK_DAYS", "90"))
+# Повторная — с high-water mark минус перекрытие: банк может провести операцию задним числом
+# или поменять статус (pending -> booked); дубли отсекает upsert по transaction_id
+TRANSACTION_SYNC_OVERLAP = timedelta(hours=float(os.getenv("TRANSACTION_SYNC_OVERLAP_HOURS", "24")))
+
+# Страница истории
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 500
+
+
+# Операции по счетам в коллекции bank_transactions + high-water mark синхронизации в transaction_sync.
+# transactions не трогаем: это коллекция Node-сервера (Transaction.js, свой уникальный transactionId)
+class TransactionStore:
+    def __init__(self, db):
+        self.collection = db.bank_transactions
+        self.sync_state = db.transaction_sync
+
+
+    async def ensure_indexes(self):
+        # Дедупликация: одна операция банка — один документ
+        await self.collection.create_index(
+            [("bank_name", ASCENDING), ("account_id", ASCENDING), ("transaction_id", ASCENDING)],
+            unique=True, name="bank_account_transaction_unique"
+        )
+        # История клиента (все банки / один банк), новые сверху, _id — для стабильного курсора
+        await self.collection.create_index(
+            [("client_id_id", ASCENDING), ("booking_date_time", DESCENDING), ("_id", DESCENDING)],
+            name="client_history"
+        )
+        await self.collection.create_index(
+            [("client_id_id", ASCENDING), ("bank_name", ASCENDING), ("booking_date_time", DESCENDING), ("_id", DESCENDING)],
+            name="client_bank_history"
+        )
+        await self.sync_state.create_index(
+            [("bank_name", ASCENDING), ("account_id", ASCENDING)], unique=True, name="bank_account_unique"
+        )
+
+
+    # Окно синхронизации счёта: (с какой даты, с какой страницы).
+    # Прошлый проход упёрся в лимит страниц — продолжаем то же окно со следующей страницы
+    async def sync_window(self, bank_name, account_id) -> tuple[datetime, int]:
+        state = await self.sync_state.find_one({"bank_name": bank_name, "account_id": account_id}) or {}
+        if state.get("resume_since") is not None:
+            return as_utc(state["resume_since"]), state["resume_page"]
+        high_water_mark = state.get("high_water_mark")
+        if high_water_mark is None:
+            return datetime.now(timezone.utc) - timedelta(days=TRANSACTION_SYNC_LOOKBACK_DAYS), 1
+        return as_utc(high_water_mark) - TRANSACTION_SYNC_OVERLAP, 1
+
+
+    # Запомнить, до какого bookingDateTime счёт синхронизирован (только вперёд).
+    # resume=(since, page) — окно забрали не целиком: следующий проход начнёт с этой страницы,
+    # а high-water mark вступит в силу, когда окно будет пройдено до конца
+    async def set_high_water_mark(self, bank_name, account_id, client_id_id, high_water_mark, resume=None):
+        now = datetime.now(timezone.utc)
+        update = {"$set": {"client_id_id": str(client_id_id), "synced_at": now}}
+        if resume:
+            update["$set"].update(resume_since=resume[0], resume_page=resume[1])
+        else:
+            update["$unset"] = {"resume_since": "", "resume_page": ""}
+        if high_water_mark is not None:
+            update["$max"] = {"high_water_mark": high_water_mark}
+        await self.sync_state.update_one(
+            {"bank_name": bank_name, "account_id": account_id}, update, upsert=True
+        )
+
+
+    # Записать операции одним bulk_write; повторно пришедшие — обновляются, а не дублируются
+    async def bulk_upsert(self, rows: list[dict]) -> int:
+        if not rows:
+            return 0
+
+        now = datetime.now(timezone.utc)
+        result = await self.collection.bulk_write([
+            UpdateOne(
+                {"bank_name": row["bank_name"], "account_id": row["account_id"], "transaction_id": row["transaction_id"]},
+                {"$set": {**row, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+                upsert=True
+            )
+            for row in rows
+        ], ordered=False)
+        return result.upserted_count
+
+
+    # Страница истории клиента по курсору "<booking_date_time>|<_id>" последней операции
+    async def history(self, client_id_id, bank_name=None, limit=TRANSACTIONS_PAGE_SIZE, cursor=None) -> dict:
+        limit = max(1, min(int(limit), TRANSACTIONS_MAX_PAGE_SIZE))
+
+        condition = {"client_id_id": str(client_id_id)}
+        if bank_name:
+            condition["bank_name"] = bank_name
+        after = _parse_cursor(cursor)
+        if after:
+            booked, last_id = after
+            condition["$or"] = [
+                {"booking_date_time": {"$lt": booked}},
+                {"booking_date_time": booked, "_id": {"$lt": last_id}}
+            ]
+
+        docs = await self.collection.find(condition).sort(
+            [("booking_date_time", DESCENDING), ("_id", DESCENDING)]
+        ).limit(limit + 1).to_list(length=limit + 1)
+
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        next_cursor = None
+        if has_more:
+            last = docs[-1]
+            next_cursor = f"{last['booking_date_time'].isoformat()}|{last['_id']}"
+
+        transactions = []
+        for doc in docs:
+            doc.pop("_id")
+            doc.pop("created_at", None)
+            doc.pop("updated_at", None)
+            transactions.append(doc)
+        return {"transactions": transactions, "next_cursor": next_cursor}
+
+
+# Операция из ответа банка -> документ bank_transactions (без transactionId / даты — пропускаем)
+def transaction_row(bank_name, client_id_id, account_id, transaction: dict) -> dict | None:
+    transaction_id = transaction.get("transactionId")
+    booked = parse_datetime(transaction.get("bookingDateTime"))
+    if not transaction_id or booked is None:
+        return None
+
+    amount = transaction.get("amount") or {}
+    return {
+        "bank_name": bank_name,
+        "client_id_id": str(client_id_id),
+        "account_id": account_id,
+        "transaction_id": str(transaction_id),
+        "booking_date_time": booked,
+        "value_date_time": parse_datetime(transaction.get("valueDateTime")),
+        "amount": amount.get("amount"),
+        "currency": amount.get("currency"),
+        "credit_debit": transaction.get("creditDebitIndicator"),
+        "status": transaction.get("status"),
+        "description": transaction.get("transactionInformation")
+    }
+
+
+def parse_datetime(value) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed
+
+
+def _parse_cursor(cursor):
+    if not cursor or "|" not in cursor:
+        return None
+    booked, last_id = cursor.rsplit("|", 1)
+    try:
+        booked = datetime.fromisoformat(booked)
+        # Mongo хранит даты в UTC без tzinfo — сравниваем так же
+        if booked.tzinfo is not None:
+            booked = booked.astimezone(timezone.utc).replace(tzinfo=None)
+        return booked, ObjectId(last_id)
+    except (ValueError, InvalidId):
+        return None
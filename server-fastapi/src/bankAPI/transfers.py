@@ -0,0 +1,139 @@
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+
+# Состояния перевода:
+# consent_requested -> consent_approved -> submitted -> settled / failed
+# submitted без payment_id, ответа банка не дождались -> unknown (платёж мог пройти, сверка вручную
+# по attempts.interaction_id; повтор по ключу второй раз не платит)
+TERMINAL_STATES = ("settled", "failed", "unknown")
+
+
+# Переводы в коллекции transfers, ключ — idempotency_key от клиента
+class TransferStore:
+    def __init__(self, db):
+        self.collection = db.transfers
+
+
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("idempotency_key", ASCENDING)], unique=True, name="idempotency_key_unique"
+        )
+        await self.collection.create_index([("payment_id", ASCENDING)], sparse=True, name="payment_id")
+        # Выборка поллером: ждущие проверки платежи
+        await self.collection.create_index(
+            [("state", ASCENDING), ("next_check_at", ASCENDING)], name="state_next_check"
+        )
+
+
+    # Создать перевод; если ключ уже был — вернуть существующий: (документ, создан_ли)
+    async def create(self, idempotency_key, request: dict) -> tuple[dict, bool]:
+        now = datetime.now(timezone.utc)
+        doc = {
+            "idempotency_key": idempotency_key,
+            "request": request,
+            "state": "consent_requested",
+            "history": [{"state": "consent_requested", "at": now}],
+            "attempts": [],
+            "created_at": now,
+            "updated_at": now
+        }
+        try:
+            await self.collection.insert_one(doc)
+        except DuplicateKeyError:
+            existing = await self.get(idempotency_key)
+            return existing, False
+
+        doc.pop("_id", None)
+        return doc, True
+
+
+    # Перевод упал до отправки платежа (попыток нет, деньги не ушли) — повтор с тем же ключом
+    # запускает его заново. Атомарно: из двух одновременных повторов перезапустит только один
+    async def restart_failed(self, idempotency_key) -> dict | None:
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"idempotency_key": idempotency_key, "state": "failed", "attempts": {"$size": 0}},
+            {
+                "$set": {"state": "consent_requested", "updated_at": now},
+                "$unset": {"error": "", "result": ""},
+                "$push": {"history": {"state": "consent_requested", "at": now}}
+            },
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+
+    async def get(self, idempotency_key) -> dict | None:
+        return await self.collection.find_one({"idempotency_key": idempotency_key}, {"_id": 0})
+
+
+    # Поиск по paymentId банка или по нашему transfer_id (= idempotency_key)
+    async def find(self, transfer_or_payment_id) -> dict | None:
+        return await self.collection.find_one(
+            {"$or": [{"payment_id": transfer_or_payment_id}, {"idempotency_key": transfer_or_payment_id}]},
+            {"_id": 0}
+        )
+
+
+    # Платежи, которые банк принял, но ещё не провёл, и пора проверить их статус
+    async def due_for_check(self, limit) -> list[dict]:
+        cursor = self.collection.find(
+            {"state": "submitted", "payment_id": {"$ne": None}, "next_check_at": {"$lte": datetime.now(timezone.utc)}},
+            {"_id": 0, "history": 0, "attempts": 0}
+        ).sort("next_check_at", ASCENDING).limit(limit)
+        return await cursor.to_list(length=limit)
+
+
+    # Отправленные платежи без payment_id, которые никто не довёл (процесс упал посреди отправки):
+    # через older_than секунд переводим в unknown, иначе повторы навсегда получают in_progress
+    async def mark_lost_submissions(self, older_than) -> int:
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_many(
+            {"state": "submitted", "payment_id": None, "updated_at": {"$lte": now - timedelta(seconds=older_than)}},
+            {
+                "$set": {"state": "unknown", "updated_at": now, "error": "Ответ банка на отправку платежа не получен"},
+                "$push": {"history": {"state": "unknown", "at": now}}
+            }
+        )
+        return result.modified_count
+
+
+    # Отложить следующую проверку статуса
+    async def schedule_check(self, idempotency_key, delay_seconds, bank_status=None):
+        fields = {"next_check_at": datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)}
+        if bank_status:
+            fields["bank_status"] = bank_status
+        await self.collection.update_one(
+            {"idempotency_key": idempotency_key},
+            {"$set": fields, "$inc": {"checks": 1}}
+        )
+
+
+    # Перевести в новое состояние и дописать поля (consent_id, payment_id, result, ...)
+    async def set_state(self, idempotency_key, state, **fields) -> dict | None:
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"idempotency_key": idempotency_key},
+            {
+                "$set": {"state": state, "updated_at": now, **fields},
+                "$push": {"history": {"state": state, "at": now}}
+            },
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+
+    # Платёж отправлен в банк; каждая попытка — со своим X-FAPI-Interaction-Id
+    async def mark_submitted(self, idempotency_key, interaction_id):
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"idempotency_key": idempotency_key},
+            {
+                "$set": {"state": "submitted", "updated_at": now},
+                "$push": {
+                    "history": {"state": "submitted", "at": now},
+                    "attempts": {"interaction_id": interaction_id, "at": now}
+                }
+            }
+        )
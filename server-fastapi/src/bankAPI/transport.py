@@ -0,0 +1,127 @@
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+import json, os
+
+
+# Настройка берётся из env: сначала для конкретного банка (BANK_POOL_SIZE_VBANK),
+# потом общая (BANK_POOL_SIZE), потом значение по умолчанию
+def _bank_setting(name, bank_name, default, cast=float):
+    value = os.getenv(f"{name}_{bank_name.upper()}", os.getenv(name))
+    return cast(value) if value not in (None, "") else default
+
+
+# Параметры пула соединений и таймаутов для одного банка
+class TransportConfig:
+    def __init__(self, bank_name):
+        self.pool_size = _bank_setting("BANK_POOL_SIZE", bank_name, 20, int)
+        self.connect_timeout = _bank_setting("BANK_CONNECT_TIMEOUT", bank_name, 3.0)
+        self.read_timeout = _bank_setting("BANK_READ_TIMEOUT", bank_name, 10.0)
+        self.total_timeout = _bank_setting("BANK_TOTAL_TIMEOUT", bank_name, 15.0)
+        self.dns_ttl = _bank_setting("BANK_DNS_TTL", bank_name, 300, int)
+        self.keepalive_timeout = _bank_setting("BANK_KEEPALIVE_TIMEOUT", bank_name, 30.0)
+
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+# Отдельная сессия (и пул соединений) на каждый банк:
+# медленный банк забивает только свой пул, а не соединения остальных
+class BankTransport:
+    def __init__(self):
+        self._sessions: dict[str, ClientSession] = {}
+        self._configs: dict[str, TransportConfig] = {}
+        self._counters: dict[str, dict] = {}
+
+
+    # Сессия банка (создаётся при первом обращении, внутри работающего event loop)
+    def session(self, bank_name) -> ClientSession:
+        session = self._sessions.get(bank_name)
+        if session is None or session.closed:
+            session = self._sessions[bank_name] = self._create_session(bank_name)
+        return session
+
+
+    def _create_session(self, bank_name) -> ClientSession:
+        config = self._configs[bank_name] = TransportConfig(bank_name)
+        counters = self._counters[bank_name] = {"created": 0, "reused": 0, "waiting": 0, "queued_total": 0}
+
+        connector = TCPConnector(
+            limit=config.pool_size,
+            limit_per_host=config.pool_size,
+            use_dns_cache=True,
+            ttl_dns_cache=config.dns_ttl,
+            keepalive_timeout=config.keepalive_timeout
+        )
+        timeout = ClientTimeout(
+            total=config.total_timeout,
+            connect=config.connect_timeout,
+            sock_read=config.read_timeout
+        )
+        return ClientSession(connector=connector, timeout=timeout, trace_configs=[_pool_tracer(counters)])
+
+
+    # Статистика пулов для /transport/stats
+    def stats(self) -> dict:
+        stats = {}
+        for bank_name, session in self._sessions.items():
+            connector = session.connector
+            counters = self._counters[bank_name]
+            acquired = counters["created"] + counters["reused"]
+            stats[bank_name] = {
+                "config": self._configs[bank_name].as_dict(),
+                # внутренности aiohttp — если поменяются, просто покажем None
+                "in_use": _safe_len(connector, "_acquired"),
+                "idle": sum(len(conns) for conns in getattr(connector, "_conns", {}).values()),
+                "waiters": counters["waiting"],
+                "queued_total": counters["queued_total"],
+                "connections_created": counters["created"],
+                "connections_reused": counters["reused"],
+                "reuse_rate": round(counters["reused"] / acquired, 3) if acquired else None
+            }
+        return stats
+
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+# Счётчики пула через trace-хуки aiohttp
+def _pool_tracer(counters) -> TraceConfig:
+    trace = TraceConfig()
+
+    async def on_create(session, ctx, params):
+        counters["created"] += 1
+
+    async def on_reuse(session, ctx, params):
+        counters["reused"] += 1
+
+    async def on_queued_start(session, ctx, params):
+        counters["waiting"] += 1
+        counters["queued_total"] += 1
+
+    async def on_queued_end(session, ctx, params):
+        counters["waiting"] -= 1
+
+    trace.on_connection_create_end.append(on_create)
+    trace.on_connection_reuseconn.append(on_reuse)
+    trace.on_connection_queued_start.append(on_queued_start)
+    trace.on_connection_queued_end.append(on_queued_end)
+    return trace
+
+
+def _safe_len(obj, attr):
+    value = getattr(obj, attr, None)
+    return len(value) if value is not None else None
+
+
+# Ответ банка, уже прочитанный целиком (соединение сразу возвращается в пул)
+class BankResponse:
+    def __init__(self, status, text):
+        self.status = status
+        self.text = text
+
+
+    def json(self):
+        return json.loads(self.text) if self.text else None
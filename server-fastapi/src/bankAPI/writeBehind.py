@@ -0,0 +1,87 @@
+from bankAPI.log import get_logger
+import asyncio, os
+
+# Отложенная запись некритичных данных (токены, онбординг): копим и сбрасываем пачкой
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.5"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+
+logger = get_logger("write_behind")
+
+
+# Буфер записей в Mongo: операции с одним ключом схлопываются (остаётся последняя),
+# раз в interval (или при max_batch операций) — один bulk_write на коллекцию.
+# Только для данных, потерю последних interval секунд которых переживём при падении процесса
+class WriteBehind:
+    def __init__(self, interval=WRITE_BEHIND_INTERVAL, max_batch=WRITE_BEHIND_MAX_BATCH):
+        self.interval = interval
+        self.max_batch = max_batch
+
+        self._pending: dict[tuple, tuple] = {}   # (коллекция, ключ) -> (коллекция, операция)
+        self._after_flush: dict[str, list] = {}  # имя коллекции -> колбэки после записи
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.stats = {"queued": 0, "coalesced": 0, "written": 0, "flushes": 0}
+
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+
+    # Поставить операцию (UpdateOne) в очередь; та же пара (коллекция, key) заменяет прежнюю
+    def add(self, collection, key, operation):
+        pending_key = (collection.name, key)
+        if pending_key in self._pending:
+            self.stats["coalesced"] += 1
+        self._pending[pending_key] = (collection, operation)
+        self.stats["queued"] += 1
+        if len(self._pending) >= self.max_batch:
+            asyncio.ensure_future(self.flush())
+
+
+    # Колбэк после каждой записи в коллекцию (например, поднять версию global_users)
+    def on_flush(self, collection_name, callback):
+        self._after_flush.setdefault(collection_name, []).append(callback)
+
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Отложенная запись: {e}")
+
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+
+            by_collection: dict[str, tuple] = {}
+            for pending_key, (collection, operation) in pending.items():
+                by_collection.setdefault(pending_key[0], (collection, {}))[1][pending_key] = operation
+
+            error = None
+            for name, (collection, operations) in by_collection.items():
+                try:
+                    await collection.bulk_write(list(operations.values()), ordered=False)
+                except Exception as e:
+                    # Не записалось — возвращаем в очередь (если за это время не пришла более новая запись)
+                    for pending_key, operation in operations.items():
+                        self._pending.setdefault(pending_key, (collection, operation))
+                    error = error or e
+                    continue
+                self.stats["written"] += len(operations)
+                for callback in self._after_flush.get(name, ()):
+                    await callback()
+            self.stats["flushes"] += 1
+            if error:
+                raise error
+
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        await self.flush()
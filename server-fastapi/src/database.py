@@ -1,7 +1,199 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ASCENDING, monitoring
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv
+from bankAPI.log import get_logger
+from bankAPI.metrics import MONGO_COMMAND_DURATION, MONGO_OPERATION_DURATION, record_timing
+import os, time
 
-MONGO_URL = "mongodb://localhost:27017/multibank"  # или твой URI, например Atlas
-MONGO_DB_NAME = "multibank"
+load_dotenv()
 
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[MONGO_DB_NAME]
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/multibank")  # или твой URI, например Atlas
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "multibank")
+
+# Пул соединений и таймауты Mongo
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+# Запросы дольше этого порога пишем в лог
+MONGO_SLOW_QUERY_MS = float(os.getenv("MONGO_SLOW_QUERY_MS", "100"))
+
+logger = get_logger("mongo")
+
+
+# Гистограмма по командам Mongo + лог медленных (вызывается драйвером, в его потоке)
+class SlowQueryListener(monitoring.CommandListener):
+    def __init__(self, threshold_ms=MONGO_SLOW_QUERY_MS):
+        self.threshold_ms = threshold_ms
+        self._commands = {}   # request_id -> (collection, command)
+
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = None
+        self._commands[event.request_id] = (collection, event.command_name)
+
+
+    def succeeded(self, event):
+        self._report(event, "ok")
+
+
+    def failed(self, event):
+        self._report(event, "failed")
+
+
+    def _report(self, event, status):
+        collection, command = self._commands.pop(event.request_id, (None, event.command_name))
+        duration_ms = event.duration_micros / 1000
+        MONGO_COMMAND_DURATION.observe(duration_ms / 1000, command=command, collection=collection or "", status=status)
+        if self.threshold_ms > 0 and duration_ms >= self.threshold_ms:
+            logger.warning(f"🐢 Медленный запрос Mongo: {command} {collection} — {duration_ms:.1f} мс ({status})")
+
+
+# Коллекция, у которой время await-операций и чтения курсоров попадает в Server-Timing текущего
+# запроса ("mongo") и в mongo_operation_duration_seconds{collection, operation}.
+# Листенер выше работает в потоках драйвера и не видит контекст запроса, поэтому меряем здесь
+TIMED_METHODS = {
+    "find_one", "find_one_and_update", "insert_one", "update_one", "update_many",
+    "delete_one", "delete_many", "bulk_write", "count_documents", "create_index"
+}
+# Возвращают курсор: время уходит не на вызов, а на чтение (to_list / async for)
+CURSOR_METHODS = {"find", "aggregate"}
+
+
+def _observe(collection, operation, seconds):
+    record_timing("mongo", seconds)
+    MONGO_OPERATION_DURATION.observe(seconds, collection=collection, operation=operation)
+
+
+class TimedCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in CURSOR_METHODS:
+            return lambda *args, **kwargs: TimedCursor(attr(*args, **kwargs), self._collection.name, name)
+        if name not in TIMED_METHODS:
+            return attr
+
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                _observe(self._collection.name, name, time.perf_counter() - started)
+        return timed
+
+
+# Курсор Motor, у которого меряется чтение: to_list — одна операция,
+# async for — одна операция на весь обход (каждый шаг сразу добавляет время в Server-Timing,
+# в гистограмму уходит сумма по окончании обхода)
+class TimedCursor:
+    def __init__(self, cursor, collection, operation):
+        self._cursor = cursor
+        self._collection = collection
+        self._operation = operation
+        self._iterated = None
+
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        # sort / limit / skip ... возвращают тот же курсор — остаёмся обёрткой
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained
+
+
+    async def to_list(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.to_list(*args, **kwargs)
+        finally:
+            _observe(self._collection, self._operation, time.perf_counter() - started)
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        started = time.perf_counter()
+        finished = False
+        try:
+            return await self._cursor.__anext__()
+        except BaseException:
+            finished = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            record_timing("mongo", elapsed, count=0 if self._iterated is not None else 1)
+            self._iterated = (self._iterated or 0.0) + elapsed
+            if finished:
+                MONGO_OPERATION_DURATION.observe(
+                    self._iterated, collection=self._collection, operation=self._operation
+                )
+
+
+class TimedDatabase:
+    def __init__(self, database):
+        self._database = database
+
+
+    def __getattr__(self, name):
+        attr = getattr(self._database, name)
+        return TimedCollection(attr) if isinstance(attr, AsyncIOMotorCollection) else attr
+
+
+    def __getitem__(self, name):
+        return TimedCollection(self._database[name])
+
+
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    readPreference=MONGO_READ_PREFERENCE,
+    event_listeners=[SlowQueryListener()]
+)
+db = TimedDatabase(client[MONGO_DB_NAME])
+
+
+# Индексы, по которым идут все горячие запросы (вызывается при старте)
+async def ensure_indexes(db):
+    await _ensure_index(db.global_users, "user_id_id", unique=True)
+    await _ensure_index(db.access_tokens, "bank_name", unique=True)
+    await _ensure_index(db.bank_names, "bank_name", unique=True)
+
+
+async def _ensure_index(collection, field, unique=False):
+    name = f"{field}_unique" if unique else field
+    try:
+        await collection.create_index([(field, ASCENDING)], unique=unique, name=name)
+    except OperationFailure as e:
+        # 85/86 — индекс на это поле уже есть, но с другими опциями (например, не уникальный)
+        if e.code in (85, 86):
+            await collection.drop_index([(field, ASCENDING)])
+            await collection.create_index([(field, ASCENDING)], unique=unique, name=name)
+        # 11000 — в коллекции уже есть дубли, уникальный индекс не построить
+        elif e.code == 11000:
+            logger.warning(f"⚠️ Дубли в {collection.name}.{field} — уникальный индекс не создан, создаю обычный")
+            await collection.create_index([(field, ASCENDING)], name=field)
+            return
+        else:
+            raise
+    logger.info(f"✅ Индекс {collection.name}.{name} на месте")
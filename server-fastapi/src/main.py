@@ -1,34 +1,162 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from aiohttp import ClientSession
 from dotenv import load_dotenv
+load_dotenv()   # до импорта bankAPI/database: они читают настройки из env при импорте
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.middleware.cors import CORSMiddleware
 from bankAPI.bankAPI import BankHelper
-from contextlib import asynccontextmanager
-from schemas import TransferRequest
-from database import db
-load_dotenv()
+from bankAPI.onboarding import OnboardingQueue
+from bankAPI.payments import PaymentPoller
+from bankAPI.consents import ConsentRenewer
+from bankAPI.transactionSync import TransactionSync
+from bankAPI.balanceHub import BalanceHub
+from bankAPI.transport import BankTransport
+from bankAPI.resilience import BankUnavailableError
+from bankAPI.coordination import make_coordinator, LeaderElection, LocalCoordinator
+from bankAPI.storage import make_storage, STORAGE_BACKEND
+from bankAPI.admission import AdmissionControl, LoadSheddingMiddleware
+from slowapi import Limiter
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+from contextlib import asynccontextmanager, aclosing
+import hmac, json, os, time
+from schemas import TransferRequest, BatchTransferRequest
+from database import db, ensure_indexes
+from bankAPI.metrics import ServerTimingMiddleware, render_metrics
+from bankAPI.loopMonitor import LoopMonitor
+from bankAPI.log import get_logger
+
+logger = get_logger("main")
+
+# Лимиты одного клиента (синтаксис limits: "20/second;200/minute")
+CLIENT_BALANCE_RATE_LIMIT = os.getenv("CLIENT_BALANCE_RATE_LIMIT", "10/second;200/minute")
+CLIENT_TRANSFER_RATE_LIMIT = os.getenv("CLIENT_TRANSFER_RATE_LIMIT", "2/second;30/minute")
+# Где считать лимиты: memory:// — в каждом воркере свои, redis://... / mongodb://... — общие
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+# Доступ к /admin/* (заголовок X-Admin-Token); не задан — эндпоинты выключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 bank_helper: BankHelper | None = None  # глобальная переменная
+onboarding: OnboardingQueue | None = None
+payment_poller: PaymentPoller | None = None
+consent_renewer: ConsentRenewer | None = None
+transaction_sync: TransactionSync | None = None
+balance_hub: BalanceHub | None = None
+# Квота запросов в банки и признаки перегрузки (общие для BankHelper и LoadSheddingMiddleware)
+admission = AdmissionControl()
+leader: LeaderElection | None = None
+# Задержка и блокировки event loop, число задач, профиль по запросу
+loop_monitor = LoopMonitor()
+
+
+# Фоновые задачи — только в воркере-лидере (при COORDINATION=local лидер всегда этот процесс)
+async def start_background_jobs():
+    global onboarding, payment_poller, consent_renewer, transaction_sync
+
+    # История операций из банков — инкрементально в bank_transactions;
+    # онбордированные счета синхронизируются сразу после записи
+    transaction_sync = TransactionSync(bank_helper)
+    transaction_sync.start()
+
+    # Онбординг в фоне — сервер начинает принимать запросы сразу, прогресс в /ready
+    onboarding = OnboardingQueue(bank_helper, on_saved=transaction_sync.submit)
+    for user in range(1,10):
+        for bank in ["vbank", "abank"]:
+            onboarding.submit(bank, user)
+    onboarding.start()
+
+    # Фоновая проверка статусов платежей, которые банк ещё не провёл
+    payment_poller = PaymentPoller(bank_helper)
+    payment_poller.start()
+
+    # Согласия клиентов обновляем заранее, до истечения
+    consent_renewer = ConsentRenewer(bank_helper)
+    consent_renewer.start()
+
+
+async def stop_background_jobs():
+    global payment_poller, consent_renewer, transaction_sync
+    if transaction_sync:
+        await transaction_sync.close()
+        transaction_sync = None
+    if consent_renewer:
+        await consent_renewer.close()
+        consent_renewer = None
+    if payment_poller:
+        await payment_poller.close()
+        payment_poller = None
+    if onboarding:
+        await onboarding.close()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global bank_helper
-    print("🚀 BankHelper запущен")
+    global bank_helper, balance_hub, leader
+    logger.info("🚀 BankHelper запущен")
+    loop_monitor.start()
 
     # Сборник функций для работы с API и БД
-    session = ClientSession()
-    bank_helper = BankHelper(db=db, session=session)
-    for user in range(1,10):
-        for bank in ["vbank", "abank"]:
-            await bank_helper.add_new_account(bank, user)
+    transport = BankTransport()           # пулы соединений по банкам, настройки из env
+    if STORAGE_BACKEND == "memory":
+        coordinator = LocalCoordinator()      # данные в памяти процесса — воркер всегда один
+    else:
+        coordinator = make_coordinator(db)    # COORDINATION=mongo — общие локи и кэш для нескольких воркеров
+        await ensure_indexes(db)              # индексы на горячие поля
+    # STORAGE_BACKEND=memory — без Mongo (бенчмарки, локальные прогоны)
+    storage = make_storage(db, shared=coordinator.shared)
+    bank_helper = BankHelper(storage=storage, transport=transport, coordinator=coordinator, admission=admission)
+    await bank_helper.start()
+
+    leader = LeaderElection(coordinator, on_elected=start_background_jobs, on_lost=stop_background_jobs)
+    leader.start()
+
+    # Живые балансы (SSE): один цикл обновления на аккаунт
+    balance_hub = BalanceHub(bank_helper)
 
     yield                                 # приложение работает
 
+    await balance_hub.close()
+    await leader.close()
     await bank_helper.close()             # закрываем сессию
-    print("🛑 BankHelper остановлен")
+    loop_monitor.close()
+    logger.info("🛑 BankHelper остановлен")
 
 app = FastAPI(lifespan=lifespan)
 
+
+# Клиент для лимитов: id из пути, у переводов — отправитель из тела (sender_from_body), иначе — адрес
+def client_key(request: Request) -> str:
+    client_id_id = request.path_params.get("client_id_id") or getattr(request.state, "sender_id_id", None)
+    return f"client:{client_id_id}" if client_id_id else get_remote_address(request)
+
+
+# Переводы: id отправителя только в теле. Зависимость выполняется до проверки лимита,
+# тело FastAPI к этому моменту уже прочитал (request.json() берёт его из кэша)
+async def sender_from_body(request: Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return
+    if not isinstance(body, dict):
+        return
+    transfers = body["transfers"] if isinstance(body.get("transfers"), list) else [body]
+    senders = {str(t.get("user_id_id")) for t in transfers if isinstance(t, dict) and t.get("user_id_id")}
+    # Пакет от нескольких отправителей — ничей конкретно, лимит по адресу
+    if len(senders) == 1:
+        request.state.sender_id_id = senders.pop()
+
+
+limiter = Limiter(key_func=client_key, storage_uri=RATE_LIMIT_STORAGE_URI)
+app.state.limiter = limiter
+
+
+# Сброс нагрузки — внутри CORS, чтобы браузер увидел 503 с Retry-After, а не ошибку CORS
+app.add_middleware(
+    LoadSheddingMiddleware,
+    admission=admission,
+    upstream_prefixes=("/available_balance", "/balances", "/payments/make_transfer", "/payments/batch")
+)
+
 # CORS
 origins = [
     "http://localhost",
@@ -53,15 +181,43 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Последним — значит снаружи: total в Server-Timing покрывает весь запрос
+app.add_middleware(ServerTimingMiddleware)
 
 
+# Клиент превысил свой лимит — 429 с Retry-After до начала следующего окна
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
+    retry_after = exc.limit.limit.get_expiry()
+    try:
+        limit, args = request.state.view_rate_limit
+        reset_at, _ = limiter.limiter.get_window_stats(limit, *args)
+        retry_after = reset_at - time.time()
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return JSONResponse(
+        status_code=429,
+        content={"status": "error", "message": f"Слишком много запросов: {exc.detail}"},
+        headers={"Retry-After": str(max(1, round(retry_after)))}
+    )
+
+
+# Банк недоступен (circuit breaker / bulkhead / квота) — быстрый 503 вместо ожидания таймаута
+@app.exception_handler(BankUnavailableError)
+async def bank_unavailable_handler(request: Request, exc: BankUnavailableError):
+    headers = {"Retry-After": str(max(1, round(exc.retry_after)))} if exc.retry_after is not None else {}
+    return JSONResponse(
+        status_code=503,
+        content={"status": "error", "message": str(exc), "bank_name": exc.bank_name, "reason": exc.reason},
+        headers=headers
+    )
+
 
 @app.get("/")
 async def main():
     # await bank_helper.add_bank("vbank")
     # await bank_helper.add_bank("abank")
     # await bank_helper.add_bank("sbank")
-    # return await bank_helper.add_new_account("abank", "2")
     # return "good"
     # await bank_helper.drop_db()
     # return await bank_helper.get_account_available_balance("abank", "2")
@@ -69,54 +225,182 @@ async def main():
     # return await bank_helper.make_transfer("1", "1", "vbank", "abank", 100)
     return {"status": "ok"}
 
-@app.get("/{client_id_id}/bank_names")
-async def get_bank_names(client_id_id) -> list:
-    # читаем из коллекции global_users
-    bank_names = []
-
-    # Ищем пользователя по client_id_id
-    user_doc = await db.global_users.find_one(
-        {"user_id_id": client_id_id},
-        {"_id": 0, "bank_names": 1}
-    )
+# Готовность сервиса + прогресс фонового онбординга
+@app.get("/ready")
+async def ready() -> dict:
+    # Онбординг идёт только у лидера; остальные воркеры готовы сразу
+    if leader and not leader.is_leader:
+        return {"status": "ready", "role": "follower"}
+    status = onboarding.status() if onboarding else {"done": False}
+    return {"status": "ready" if status["done"] else "onboarding", "role": "leader", "onboarding": status}
 
-    if user_doc and "bank_names" in user_doc:
-        bank_names = user_doc["bank_names"]
+# Условные GET для global_users: ETag = версия коллекции (растёт при каждой записи).
+# Браузер хранит ответ и каждый раз переспрашивает; совпал If-None-Match — 304 без тела и без Mongo
+GLOBAL_USERS_CACHE_CONTROL = "private, no-cache"
 
-    # Безопасно удаляем "sbank", если есть ЭТО ВРЕМЕННО!!!
-    if "sbank" in bank_names:
-        bank_names.remove("sbank")
 
-    return bank_names
+def global_users_etag(version) -> str:
+    return f'"global-users-{version}"'
+
+
+def etag_matches(if_none_match, etag) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+# read() -> (версия, данные); совпала версия — 304 сразу, данные даже не собираем
+async def versioned_response(request: Request, read):
+    version = await bank_helper.global_users_version()
+    if etag_matches(request.headers.get("if-none-match"), global_users_etag(version)):
+        return Response(status_code=304, headers=_global_users_headers(version))
+
+    version, data = await read()
+    return JSONResponse(content=data, headers=_global_users_headers(version))
+
+
+def _global_users_headers(version) -> dict:
+    return {"ETag": global_users_etag(version), "Cache-Control": GLOBAL_USERS_CACHE_CONTROL}
+
+
+@app.get("/{client_id_id}/bank_names")
+async def get_bank_names(request: Request, client_id_id):
+    # Из global_users (через кэш версии), без "sbank" — ЭТО ВРЕМЕННО!!!
+    return await versioned_response(request, lambda: bank_helper.read_client_bank_names(client_id_id))
 
 @app.get("/available_balance/{bank_name}/{client_id_id}")
-async def get_available_balance(bank_name, client_id_id) -> dict:
+@limiter.limit(CLIENT_BALANCE_RATE_LIMIT)
+async def get_available_balance(request: Request, bank_name, client_id_id) -> dict:
     available_balance = await bank_helper.get_account_available_balance(bank_name, client_id_id)
     return {"balance": available_balance}
-    
 
-# global_users
+
+# Балансы во всех банках клиента одним запросом (частичный результат, статус на каждый банк)
+@app.get("/balances/{client_id_id}")
+@limiter.limit(CLIENT_BALANCE_RATE_LIMIT)
+async def get_all_balances(request: Request, client_id_id) -> dict:
+    return await bank_helper.get_all_available_balances(client_id_id)
+
+
+# Состояние пулов соединений к банкам
+@app.get("/transport/stats")
+async def transport_stats() -> dict:
+    return {**bank_helper.transport_stats(), "admission": admission.status(), "hedging": bank_helper.hedger.status()}
+
+
+# Метрики в формате Prometheus: запросы к банкам, команды Mongo, входящие запросы
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# Админка: без ADMIN_TOKEN её как будто нет (404), с неверным токеном — 403
+def check_admin_token(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Нет доступа")
+
+
+# Здоровье event loop: задержка, число задач, последние блокировки со стеком
+@app.get("/admin/loop")
+async def admin_loop(x_admin_token: str | None = Header(default=None, alias="X-Admin-Token")) -> dict:
+    check_admin_token(x_admin_token)
+    return loop_monitor.status()
+
+
+# Сэмплирующий профиль живого процесса за seconds секунд (collapsed stacks для flamegraph.pl / speedscope)
+@app.get("/admin/profile")
+async def admin_profile(seconds: float = 10, interval_ms: float = 5,
+                        x_admin_token: str | None = Header(default=None, alias="X-Admin-Token")):
+    check_admin_token(x_admin_token)
+    if loop_monitor.is_profiling():
+        raise HTTPException(status_code=409, detail="Профилирование уже идёт")
+    return PlainTextResponse(await loop_monitor.profile(seconds, interval_ms))
+
+
+# Живые балансы клиента (Server-Sent Events): подписка один раз, сервер сам шлёт обновления
+# после переводов и по таймеру. Комментарий-пинг каждые 15с держит соединение через прокси
+@app.get("/balances/{client_id_id}/stream")
+async def stream_balances(client_id_id):
+    async def events():
+        # aclosing — чтобы при отключении клиента подписка гарантированно снялась
+        async with aclosing(balance_hub.subscribe(client_id_id, heartbeat=15)) as subscription:
+            async for event in subscription:
+                if event is None:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: balance\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# global_users — постранично: ?limit=100&cursor=<next_cursor>&prefix=<начало user_id_id>
 @app.get("/get_global_users")
-async def get_global_users() -> dict:
-    global_users = await bank_helper.get_global_users()
+async def get_global_users(request: Request, limit: int = 100, cursor: str | None = None, prefix: str | None = None):
+    return await versioned_response(
+        request, lambda: bank_helper.read_global_users(limit=limit, cursor=cursor, prefix=prefix)
+    )
+
 
-    return global_users
+# Выгрузка всех global_users потоком NDJSON (память не зависит от размера коллекции)
+@app.get("/get_global_users/export")
+async def export_global_users(prefix: str | None = None):
+    async def lines():
+        async for user in bank_helper.iter_global_users(prefix=prefix):
+            yield json.dumps(user, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 
 # Перевод
-@app.post("/payments/make_transfer/")
-async def make_transfer(payload: TransferRequest):
+@app.post("/payments/make_transfer/", dependencies=[Depends(sender_from_body)])
+@limiter.limit(CLIENT_TRANSFER_RATE_LIMIT)
+async def make_transfer(request: Request, payload: TransferRequest,
+                        idempotency_key: str | None = Header(default=None, alias="Idempotency-Key")):
     client_id_id = payload.user_id_id
     to_client_id_id = payload.to_user_id_id
     from_bank = payload.from_bank
     to_bank = payload.to_bank
     amount = payload.amount
 
-    print(client_id_id, to_client_id_id, from_bank, to_bank, amount)
+    logger.debug(f"Перевод {client_id_id} -> {to_client_id_id}: {from_bank} -> {to_bank}, {amount}")
 
     # Создаем перевод
-    transfer = await bank_helper.make_transfer(client_id_id, to_client_id_id, from_bank, to_bank, amount)
+    # Повтор с тем же ключом вернёт сохранённый результат, а не заплатит второй раз
+    transfer = await bank_helper.make_transfer(client_id_id, to_client_id_id, from_bank, to_bank, amount,
+                                               idempotency_key=idempotency_key or payload.idempotency_key)
 
     return transfer
 
+
+# Пакет переводов (например, зарплатный): результаты по каждому переводу стримятся NDJSON-строками
+@app.post("/payments/batch", dependencies=[Depends(sender_from_body)])
+@limiter.limit(CLIENT_TRANSFER_RATE_LIMIT)
+async def make_transfers_batch(request: Request, payload: BatchTransferRequest,
+                               idempotency_key: str | None = Header(default=None, alias="Idempotency-Key")):
+    transfers = [transfer.model_dump() for transfer in payload.transfers]
+
+    async def stream():
+        async for result in bank_helper.make_transfers_batch(transfers, batch_key=idempotency_key):
+            yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# История операций клиента из локального bank_transactions (синхронизирует TransactionSync), новые сверху
+@app.get("/transactions/{client_id_id}")
+async def get_transactions(client_id_id, bank_name: str | None = None, limit: int = 50, cursor: str | None = None) -> dict:
+    return await bank_helper.transactions.history(client_id_id, bank_name=bank_name, limit=limit, cursor=cursor)
+
+
+# Состояние перевода по paymentId банка или по transfer_id (ключу идемпотентности)
+@app.get("/payments/{payment_id}")
+async def get_payment(payment_id) -> dict:
+    transfer = await bank_helper.get_transfer_status(payment_id)
+    if transfer is None:
+        raise HTTPException(status_code=404, detail="Перевод не найден")
+    return transfer
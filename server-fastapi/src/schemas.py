@@ -6,3 +6,8 @@ class TransferRequest(BaseModel):
     from_bank: str = Field(..., description="Банк отправителя (vbank, abank...)")
     to_bank: str = Field(..., description="Банк получателя")
     amount: float = Field(..., gt=0, description="Сумма перевода (должна быть > 0)")
+    idempotency_key: str | None = Field(None, description="Ключ идемпотентности (можно передать заголовком Idempotency-Key)")
+
+
+class BatchTransferRequest(BaseModel):
+    transfers: list[TransferRequest] = Field(..., min_length=1, max_length=500, description="Список переводов")
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+import json, os, sys
+import pytest
+
+# Тесты импортируют модули сервиса так же, как main.py (из server-fastapi/src)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bankAPI.bankAPI import BankHelper
+from bankAPI.storage import MemoryStorage
+from bankAPI.transport import BankResponse, BankTransport
+
+
+# BankHelper на хранилище в памяти: без Mongo, запросы в банк тесты подменяют сами
+@pytest.fixture
+def bank_helper():
+    return BankHelper(storage=MemoryStorage(), transport=BankTransport())
+
+
+# bank_helper с подменёнными запросами в банк; calls — счётчики и ответы, которые тест может менять
+@pytest.fixture
+def bank(bank_helper, monkeypatch):
+    calls = {
+        "consents": 0, "status": "pending", "status_checks": 0, "pending_status": "pending",
+        "payments": 0, "payment_status": 201, "submit_error": None
+    }
+
+    async def get_access_token(bank_name):
+        return "token"
+
+    async def request_account_consent(bank_name, access_token, client_id_id):
+        calls["consents"] += 1
+        return {
+            "consent": f"consent-{calls['consents']}",
+            "consent_status": calls["status"],
+            "consent_expires_at": datetime.now(timezone.utc) + timedelta(days=90)
+        }
+
+    async def request_account_consent_status(bank_name, access_token, consent_id):
+        calls["status_checks"] += 1
+        return {"consent_status": calls["pending_status"], "consent_expires_at": datetime.now(timezone.utc) + timedelta(days=90)}
+
+    async def get_transfer_consent(*args):
+        return "transfer-consent-1"
+
+    async def submit_payment(*args):
+        calls["payments"] += 1
+        if calls["submit_error"]:
+            raise calls["submit_error"]
+        status = calls["payment_status"]
+        body = {"data": {"paymentId": "p-1", "status": "AcceptedSettlementCompleted"}} if status == 201 else {}
+        return BankResponse(status, json.dumps(body))
+
+    monkeypatch.setattr(bank_helper, "get_access_token", get_access_token)
+    monkeypatch.setattr(bank_helper, "request_account_consent", request_account_consent)
+    monkeypatch.setattr(bank_helper, "request_account_consent_status", request_account_consent_status)
+    monkeypatch.setattr(bank_helper, "get_transfer_consent", get_transfer_consent)
+    monkeypatch.setattr(bank_helper, "submit_payment", submit_payment)
+    return bank_helper, calls
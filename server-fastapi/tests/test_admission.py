@@ -0,0 +1,61 @@
+from bankAPI.admission import LoadSheddingMiddleware, SHED_UPSTREAM_LATENCY
+from bankAPI.resilience import BankUnavailableError
+from bankAPI.transport import BankResponse
+import asyncio
+
+
+def shedding_app(bank_helper):
+    # /available_balance/<bank>/<client>: один запрос в банк из пути
+    async def app(scope, receive, send):
+        bank_name = scope["path"].split("/")[2]
+        try:
+            resp = await bank_helper._request(bank_name, "GET", "/balances", operation="balances")
+            status = resp.status
+        except BankUnavailableError:
+            status = 503
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    return LoadSheddingMiddleware(app, admission=bank_helper.admission, upstream_prefixes=("/available_balance",))
+
+
+def get(app, path) -> int:
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app({"type": "http", "path": path}, receive, send))
+    return messages[0]["status"]
+
+
+def test_slow_bank_does_not_shed_other_banks(bank_helper, monkeypatch):
+    calls = []
+
+    async def call(bank_name, attempt, retry=False):
+        calls.append(bank_name)
+        return BankResponse(200, "{}")
+
+    monkeypatch.setattr(bank_helper._resilience, "call", call)
+    bank_helper.admission.record_latency("abank", SHED_UPSTREAM_LATENCY + 1)
+    app = shedding_app(bank_helper)
+
+    assert get(app, "/available_balance/abank/1") == 503
+    assert get(app, "/available_balance/vbank/1") == 200
+    assert calls == ["vbank"]
+    assert bank_helper.admission.stats["shed"] == 1
+
+
+def test_background_requests_are_not_shed(bank_helper, monkeypatch):
+    async def call(bank_name, attempt, retry=False):
+        return BankResponse(200, "{}")
+
+    monkeypatch.setattr(bank_helper._resilience, "call", call)
+    bank_helper.admission.record_latency("abank", SHED_UPSTREAM_LATENCY + 1)
+
+    resp = asyncio.run(bank_helper._request("abank", "GET", "/balances", operation="balances"))
+
+    assert resp.status == 200
@@ -0,0 +1,127 @@
+from bankAPI import bankAPI as bank_api
+from bankAPI.bankAPI import BankHelper
+from bankAPI.storage import MemoryStorage
+from bankAPI.transport import BankTransport
+import asyncio
+
+
+# Общий кэш нескольких воркеров (как MongoCoordinator), только в памяти и без TTL
+class SharedCoordinator:
+    shared = True
+
+    def __init__(self):
+        self.cache = {}
+
+    async def cache_get(self, key):
+        return self.cache.get(key)
+
+    async def cache_set(self, key, value, ttl):
+        self.cache[key] = value
+
+    async def cache_delete(self, key):
+        self.cache.pop(key, None)
+
+    async def cache_incr(self, key, ttl) -> int:
+        self.cache[key] = self.cache.get(key, 0) + 1
+        return self.cache[key]
+
+
+def worker(bank, coordinator, storage):
+    bank_helper = BankHelper(storage=storage, transport=BankTransport(), coordinator=coordinator)
+
+    async def get_account_balances(bank_name, client_id_id):
+        bank["calls"] += 1
+        return {"data": {"balance": [{"amount": {"amount": bank["balance"]}}]}}
+
+    bank_helper.get_account_balances = get_account_balances
+    return bank_helper
+
+
+def test_transfer_in_one_worker_invalidates_balance_in_others():
+    bank = {"balance": "100", "calls": 0}
+    coordinator, storage = SharedCoordinator(), MemoryStorage()
+    first, second = worker(bank, coordinator, storage), worker(bank, coordinator, storage)
+
+    async def scenario():
+        before = [await first.get_account_available_balance("vbank", "1"),
+                  await second.get_account_available_balance("vbank", "1")]
+        # Перевод прошёл через первый воркер
+        bank["balance"] = "50"
+        await first.invalidate_balance("vbank", "1")
+        return before, await second.get_account_available_balance("vbank", "1")
+
+    before, after = asyncio.run(scenario())
+
+    assert before == ["100", "100"]
+    assert bank["calls"] == 2     # второй воркер взял баланс из общего кэша, потом — после перевода
+    assert after == "50"
+
+
+def test_drop_db_forgets_local_copies(bank_helper):
+    async def scenario():
+        await bank_helper.ensure_bank("vbank")
+        await bank_helper.tokens.save("vbank", "token", 0)
+        bank_helper._tokens["vbank"] = {"access_token": "token", "expires_at": 0}
+        bank_helper._account_cache.set(("vbank", "1"), {"consent": "c-1"})
+        bank_helper._balance_cache.set(("vbank", "1"), {"balance": 100})
+        await bank_helper.drop_db()
+
+    asyncio.run(scenario())
+
+    assert not bank_helper._known_banks
+    assert not bank_helper._tokens
+    assert len(bank_helper._account_cache) == len(bank_helper._balance_cache) == 0
+
+
+def balance_bank(bank_helper, monkeypatch):
+    bank = {"balance": "100", "calls": 0, "release": None}
+
+    async def get_account_balances(bank_name, client_id_id):
+        bank["calls"] += 1
+        balance = bank["balance"]
+        if bank["release"]:
+            await bank["release"].wait()
+        return {"data": {"balance": [{"amount": {"amount": balance}}]}}
+
+    monkeypatch.setattr(bank_helper, "get_account_balances", get_account_balances)
+    return bank
+
+
+def test_stale_balance_is_served_and_refreshed_in_background(bank_helper, monkeypatch):
+    bank = balance_bank(bank_helper, monkeypatch)
+    monkeypatch.setattr(bank_api, "BALANCE_FRESH_TTL", 0)    # любое значение из кэша уже протухло
+
+    async def scenario():
+        first = await bank_helper.get_account_available_balance("vbank", "1")
+        bank["balance"] = "80"
+        stale = await bank_helper.get_account_available_balance("vbank", "1")
+        await asyncio.sleep(0.01)          # фоновое обновление
+        return first, stale, await bank_helper.get_account_available_balance("vbank", "1", fresh=True)
+
+    first, stale, fresh = asyncio.run(scenario())
+
+    assert (first, stale, fresh) == ("100", "100", "80")
+    assert bank["calls"] == 3
+
+
+def test_invalidation_skips_stale_value_and_in_flight_fetch(bank_helper, monkeypatch):
+    bank = balance_bank(bank_helper, monkeypatch)
+
+    async def scenario():
+        await bank_helper.get_account_available_balance("vbank", "1")
+        # Запрос в банк начался до перевода и вернёт старый баланс
+        bank["release"] = asyncio.Event()
+        await bank_helper.invalidate_balance("vbank", "1")
+        before_transfer = asyncio.create_task(bank_helper.get_account_available_balance("vbank", "1"))
+        await asyncio.sleep(0.01)
+        bank["balance"] = "50"
+        await bank_helper.invalidate_balance("vbank", "1")
+        bank["release"].set()
+        old = await before_transfer
+        return old, await bank_helper.get_account_available_balance("vbank", "1")
+
+    old, after = asyncio.run(scenario())
+
+    assert old == "100"
+    assert after == "50"       # старый ответ не попал в кэш
+    assert bank["calls"] == 3
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+from bankAPI.consents import ConsentRenewer
+from bankAPI.transport import BankResponse
+import asyncio, pytest
+
+
+def save_account(bank_helper, **fields):
+    record = {"account_id": "acc-1", "bank_account_number": "40817", **fields}
+    return bank_helper.accounts.upsert("vbank", "1", record)
+
+
+def test_pending_consent_is_not_requested_on_every_call(bank):
+    bank_helper, calls = bank
+
+    async def scenario():
+        await save_account(bank_helper, consent="consent-0", consent_status="pending")
+        for _ in range(5):
+            await bank_helper.resolve_account_context("vbank", "1")
+        return await bank_helper.accounts.get("vbank", "1")
+
+    record = asyncio.run(scenario())
+
+    assert calls["consents"] == 0
+    assert record["consent"] == "consent-0"
+
+
+def test_new_pending_consent_backs_off(bank):
+    bank_helper, calls = bank
+
+    async def scenario():
+        await save_account(bank_helper, consent="consent-0", consent_status="rejected")
+        # Рабочего согласия нет, новое ещё не одобрено — ходить в банк нечем
+        with pytest.raises(ValueError):
+            await bank_helper.resolve_account_context("vbank", "1")
+        # 401/403 от банка не должны запрашивать следующее
+        with pytest.raises(ValueError):
+            await bank_helper.renew_account_consent("vbank", "1")
+        return await bank_helper.accounts.get("vbank", "1")
+
+    record = asyncio.run(scenario())
+
+    assert calls["consents"] == 1
+    assert record["consent"] == "consent-0"
+    assert record["pending_consent"] == "consent-1"
+    assert record["consent_retry_at"] > datetime.now(timezone.utc)
+
+
+def test_working_consent_is_kept_until_new_one_is_approved(bank):
+    bank_helper, calls = bank
+    renewer = ConsentRenewer(bank_helper)
+
+    async def scenario():
+        # Одобрено, но истекает через 2 часа — фоновое обновление запрашивает новое заранее
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=2)
+        await save_account(bank_helper, consent="consent-0", consent_status="approved", consent_expires_at=expires_at)
+        await renewer.renew_due()
+        during = await bank_helper.resolve_account_context("vbank", "1")
+
+        # Подошло время проверки, клиент одобрил — новое становится рабочим без нового запроса
+        bank_helper.accounts._records[("vbank", "1")]["consent_retry_at"] = datetime.now(timezone.utc)
+        calls["pending_status"] = "approved"
+        await renewer.renew_due()
+        after = await bank_helper.resolve_account_context("vbank", "1")
+        return during, after, await bank_helper.accounts.get("vbank", "1")
+
+    during, after, record = asyncio.run(scenario())
+
+    assert during["consent"] == "consent-0"
+    assert after["consent"] == "consent-1"
+    assert calls["consents"] == 1 and calls["status_checks"] == 1
+    assert "pending_consent" not in record and "consent_retry_at" not in record
+    assert record["consent_expires_at"] > datetime.now(timezone.utc) + timedelta(days=30)
+
+
+@pytest.mark.parametrize("fields", [
+    {"consent_status": "Revoked"},
+    {"consent_status": "approved", "consent_expires_at": datetime.now(timezone.utc) - timedelta(minutes=1)},
+])
+def test_dead_consent_is_renewed(bank, fields):
+    bank_helper, calls = bank
+    calls["status"] = "approved"
+
+    async def scenario():
+        await save_account(bank_helper, consent="consent-0", **fields)
+        context = await bank_helper.resolve_account_context("vbank", "1")
+        await bank_helper.resolve_account_context("vbank", "1")
+        return context, await bank_helper.accounts.get("vbank", "1")
+
+    context, record = asyncio.run(scenario())
+
+    assert calls["consents"] == 1
+    assert context["consent"] == "consent-1"
+    assert "consent_retry_at" not in record
+
+
+def test_rejected_consent_uses_one_stored_by_another_worker(bank):
+    bank_helper, calls = bank
+    sent = []
+
+    async def scenario():
+        await save_account(bank_helper, consent="consent-0", consent_status="approved")
+        context = await bank_helper.resolve_account_context("vbank", "1")
+        # Другой воркер уже обновил согласие, у этого в кэше — старое
+        await bank_helper.accounts.set_consent("vbank", "1", "consent-leader", status="approved")
+
+        async def send():
+            sent.append(context["consent"])
+            return BankResponse(403 if context["consent"] == "consent-0" else 200, "{}")
+
+        return await bank_helper._client_request("vbank", "1", context, send)
+
+    resp = asyncio.run(scenario())
+
+    assert resp.status == 200
+    assert sent == ["consent-0", "consent-leader"]
+    assert calls["consents"] == 0
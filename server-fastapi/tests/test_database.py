@@ -0,0 +1,74 @@
+import asyncio
+
+from bankAPI import metrics
+from database import TimedCollection
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = list(docs)
+        self.sorted = None
+
+
+    def sort(self, key, direction=1):
+        self.sorted = (key, direction)
+        return self
+
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(0)
+        return list(self.docs)
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        if not self.docs:
+            raise StopAsyncIteration
+        return self.docs.pop(0)
+
+
+class FakeCollection:
+    name = "things"
+
+    def __init__(self, docs):
+        self.docs = docs
+
+
+    def find(self, query=None):
+        return FakeCursor(self.docs)
+
+
+def _series_count(collection, operation):
+    series = metrics.MONGO_OPERATION_DURATION._series.get((collection, operation))
+    return series[-1] if series else 0
+
+
+def test_cursor_reads_are_timed_per_collection_and_operation():
+    collection = TimedCollection(FakeCollection([{"n": 1}, {"n": 2}, {"n": 3}]))
+    before = _series_count("things", "find")
+
+    async def scenario():
+        token = metrics._request_timings.set({})
+        try:
+            docs = await collection.find({}).sort("n", -1).limit(2).to_list(length=None)
+            iterated = [doc async for doc in collection.find({})]
+            return docs, iterated, metrics._request_timings.get()
+        finally:
+            metrics._request_timings.reset(token)
+
+    docs, iterated, timings = asyncio.run(scenario())
+
+    assert docs == [{"n": 1}, {"n": 2}]
+    assert len(iterated) == 3
+    # to_list и весь async for — по одной операции в Server-Timing и в гистограмме
+    assert timings["mongo"][1] == 2
+    assert _series_count("things", "find") == before + 2
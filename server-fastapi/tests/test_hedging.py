@@ -0,0 +1,39 @@
+from bankAPI.hedging import Hedger
+from bankAPI.transport import BankResponse
+import asyncio, pytest
+
+
+def hedge(outcomes):
+    # outcomes — по попытке: (задержка, статус или исключение)
+    hedger = Hedger(enabled=True, operations={"balances"})
+    hedger.delay = lambda bank_name, operation: 0.01
+    hedger._budget["vbank"] = 5
+    attempts = iter(outcomes)
+
+    async def send():
+        delay, outcome = next(attempts)
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return BankResponse(outcome, "{}")
+
+    return hedger, asyncio.run(hedger.run("vbank", "balances", send))
+
+
+def test_server_error_does_not_win_the_race():
+    # Первая попытка отвечает 503 раньше, чем вторая 200
+    hedger, resp = hedge([(0.02, 503), (0.05, 200)])
+
+    assert resp.status == 200
+    assert hedger.stats["hedge_won"] == 1
+
+
+def test_both_failed_returns_bank_error():
+    _, resp = hedge([(0.02, 502), (0.03, TimeoutError())])
+
+    assert resp.status == 502
+
+
+def test_both_raised_raises():
+    with pytest.raises(TimeoutError):
+        hedge([(0.02, TimeoutError()), (0.03, ConnectionError())])
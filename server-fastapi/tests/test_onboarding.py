@@ -0,0 +1,49 @@
+from bankAPI.onboarding import OnboardingQueue
+import asyncio
+
+
+class FakeBankHelper:
+    def __init__(self):
+        self.saved = []
+
+
+    async def discover_account(self, bank_name, client_id_id):
+        await asyncio.sleep(0.01)
+        if client_id_id == "3":
+            return None      # у клиента нет счёта в банке
+        return {"bank_name": bank_name, "client_id_id": client_id_id}
+
+
+    async def save_accounts(self, records):
+        self.saved.extend(records)
+
+
+async def run_onboarding(batch_size):
+    helper = FakeBankHelper()
+    onboarding = OnboardingQueue(helper, concurrency=2, batch_size=batch_size, flush_interval=0.05)
+    for client_id_id in range(1, 8):
+        onboarding.submit("vbank", client_id_id)
+    onboarding.start()
+
+    for _ in range(100):
+        if onboarding.stats["finished_at"]:
+            break
+        await asyncio.sleep(0.02)
+    await onboarding.close()
+    return helper, onboarding.status()
+
+
+def test_finished_at_is_set_when_all_accounts_are_written():
+    helper, status = asyncio.run(run_onboarding(batch_size=50))
+
+    assert status["done"]
+    assert status["finished_at"] is not None
+    assert status["added"] == 6 and status["skipped"] == 1
+    assert len(helper.saved) == 6
+
+
+def test_finished_at_is_set_with_full_batches():
+    helper, status = asyncio.run(run_onboarding(batch_size=2))
+
+    assert status["finished_at"] is not None
+    assert len(helper.saved) == 6
@@ -0,0 +1,150 @@
+from bankAPI import resilience as resilience_module
+from bankAPI.resilience import BankResilience, BankUnavailableError
+from bankAPI.transport import BankResponse
+import asyncio, pytest
+
+
+def half_open(resilience, bank_name="vbank"):
+    breaker = resilience.breaker(bank_name)
+    breaker.state, breaker.opened_at, breaker.reset_timeout = "open", 0.0, 0.0
+    return breaker
+
+
+def test_unexpected_error_in_probe_does_not_wedge_the_breaker():
+    resilience = BankResilience()
+    breaker = half_open(resilience)
+
+    async def broken():
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+
+    async def ok():
+        return BankResponse(200, "{}")
+
+    async def scenario():
+        with pytest.raises(UnicodeDecodeError):
+            await resilience.call("vbank", broken)
+        # Проба не удалась — breaker снова открыт, следующая проба проходит и закрывает его
+        return await resilience.call("vbank", ok)
+
+    resp = asyncio.run(scenario())
+
+    assert resp.status == 200
+    assert breaker.state == "closed"
+
+
+def respond(status):
+    async def attempt():
+        return BankResponse(status, "{}")
+    return attempt
+
+
+def test_breaker_opens_after_threshold_and_rejects_without_calling_bank():
+    resilience = BankResilience()
+    breaker = resilience.breaker("vbank")
+    sent = []
+
+    async def failing():
+        sent.append(1)
+        return BankResponse(503, "{}")
+
+    async def scenario():
+        for _ in range(breaker.failure_threshold):
+            await resilience.call("vbank", failing)
+        with pytest.raises(BankUnavailableError) as rejected:
+            await resilience.call("vbank", failing)
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+
+    assert breaker.state == "open"
+    assert rejected.reason == "circuit_open" and rejected.retry_after > 0
+    assert len(sent) == breaker.failure_threshold
+
+
+def test_half_open_lets_a_single_probe_through():
+    resilience = BankResilience()
+    breaker = half_open(resilience)
+    release = asyncio.Event()
+
+    async def slow_probe():
+        await release.wait()
+        return BankResponse(200, "{}")
+
+    async def scenario():
+        probe = asyncio.create_task(resilience.call("vbank", slow_probe))
+        await asyncio.sleep(0)
+        # Пока проба в полёте, остальные запросы в банк не идут
+        with pytest.raises(BankUnavailableError):
+            await resilience.call("vbank", respond(200))
+        release.set()
+        return await probe
+
+    resp = asyncio.run(scenario())
+
+    assert resp.status == 200
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_failed_probe_opens_the_breaker_again():
+    resilience = BankResilience()
+    breaker = half_open(resilience)
+    breaker.reset_timeout = 30
+
+    async def scenario():
+        await resilience.call("vbank", respond(502))
+        with pytest.raises(BankUnavailableError):
+            await resilience.call("vbank", respond(200))
+
+    asyncio.run(scenario())
+
+    assert breaker.state == "open"
+
+
+def test_retries_only_when_asked(monkeypatch):
+    monkeypatch.setattr(resilience_module, "_backoff", lambda number: 0)
+    resilience = BankResilience()
+    statuses = [503, 429, 200]
+    sent = []
+
+    async def attempt():
+        sent.append(1)
+        return BankResponse(statuses[len(sent) - 1], "{}")
+
+    async def scenario():
+        # POST (retry=False) — одна попытка, ответ как есть
+        first = await resilience.call("vbank", attempt)
+        # GET — повторяем, пока банк отвечает временной ошибкой
+        second = await resilience.call("vbank", attempt, retry=True)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first.status == 503
+    assert second.status == 200
+    assert len(sent) == 3
+
+
+def test_full_bulkhead_rejects_instead_of_waiting(monkeypatch):
+    monkeypatch.setattr(resilience_module, "BANK_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(resilience_module, "BANK_QUEUE_TIMEOUT", 0.01)
+    resilience = BankResilience()
+    release = asyncio.Event()
+
+    async def busy():
+        await release.wait()
+        return BankResponse(200, "{}")
+
+    async def scenario():
+        first = asyncio.create_task(resilience.call("vbank", busy))
+        await asyncio.sleep(0)
+        with pytest.raises(BankUnavailableError) as rejected:
+            await resilience.call("vbank", respond(200))
+        release.set()
+        await first
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+
+    assert rejected.reason == "bulkhead_full"
+    assert resilience.queue_depth("vbank") == 0
+    assert resilience.breaker("vbank").state == "closed"
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+from bankAPI.onboarding import OnboardingQueue
+from bankAPI.transactionSync import TransactionSync
+from bankAPI.transactions import TRANSACTION_SYNC_OVERLAP
+from bankAPI.transport import BankResponse
+import asyncio, json
+import bankAPI.bankAPI as bank_api
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+# Банк отдаёт операции новыми сверху, по 2 на страницу: 11 операций — 6 страниц
+OPERATIONS = [
+    {"transactionId": f"t-{i}", "bookingDateTime": (NOW - timedelta(hours=i)).isoformat(), "amount": {"amount": "1"}}
+    for i in range(11)
+]
+
+
+def test_sync_continues_past_the_page_cap(bank_helper, monkeypatch):
+    monkeypatch.setattr(bank_api, "TRANSACTIONS_FETCH_PAGE_SIZE", 2)
+    monkeypatch.setattr(bank_api, "TRANSACTIONS_FETCH_MAX_PAGES", 2)
+    pages = []
+
+    async def resolve_account_context(bank_name, client_id_id):
+        return {"access_token": "token", "consent": "consent-1", "account_id": "acc-1"}
+
+    async def request(bank_name, method, path, operation=None, params=None, **kwargs):
+        page, limit = params["page"], params["limit"]
+        pages.append(page)
+        chunk = OPERATIONS[(page - 1) * limit:page * limit]
+        return BankResponse(200, json.dumps({"data": {"transaction": chunk}}))
+
+    monkeypatch.setattr(bank_helper, "resolve_account_context", resolve_account_context)
+    monkeypatch.setattr(bank_helper, "_request", request)
+
+    async def scenario():
+        added = [await bank_helper.sync_transactions("vbank", "1") for _ in range(3)]
+        history = await bank_helper.transactions.history("1", limit=100)
+        since, first_page = await bank_helper.transactions.sync_window("vbank", "acc-1")
+        return added, history, since, first_page
+
+    added, history, since, first_page = asyncio.run(scenario())
+
+    assert pages == [1, 2, 3, 4, 5, 6]
+    assert added == [4, 4, 3]
+    assert len(history["transactions"]) == len(OPERATIONS)
+    # Окно пройдено до конца — следующий проход с начала, от самой поздней операции
+    assert first_page == 1
+    assert since == NOW - TRANSACTION_SYNC_OVERLAP
+
+
+def test_onboarded_accounts_are_synced_right_away():
+    synced = []
+
+    class FakeAccounts:
+        async def list_keys(self):
+            return []     # холодный старт: проход по расписанию ещё ничего не видит
+
+    class FakeBankHelper:
+        accounts = FakeAccounts()
+
+        async def discover_account(self, bank_name, client_id_id):
+            return {"bank_name": bank_name, "client_id_id": client_id_id}
+
+        async def save_accounts(self, records):
+            pass
+
+        async def sync_transactions(self, bank_name, client_id_id):
+            synced.append((bank_name, client_id_id))
+            return 0
+
+    async def scenario():
+        helper = FakeBankHelper()
+        # Следующий проход по расписанию не скоро — синхронизацию запускает онбординг
+        sync = TransactionSync(helper, interval=3600)
+        onboarding = OnboardingQueue(helper, batch_size=50, flush_interval=0.01, on_saved=sync.submit)
+        for client_id_id in ("1", "2"):
+            onboarding.submit("vbank", client_id_id)
+        sync.start()
+        onboarding.start()
+        await asyncio.sleep(0.1)
+        await onboarding.close()
+        await sync.close()
+
+    asyncio.run(scenario())
+
+    assert sorted(synced) == [("vbank", "1"), ("vbank", "2")]
@@ -0,0 +1,96 @@
+from fastapi import HTTPException
+import asyncio, pytest
+
+
+def save_accounts(bank_helper):
+    async def save():
+        for bank_name, client_id_id in (("vbank", "1"), ("abank", "2")):
+            await bank_helper.accounts.upsert(bank_name, client_id_id, {
+                "consent": f"consent-{bank_name}", "consent_status": "approved",
+                "account_id": f"acc-{client_id_id}", "bank_account_number": f"{bank_name}-{client_id_id}"
+            })
+    return save()
+
+
+def transfer(bank_helper, key="key-1"):
+    return bank_helper.make_transfer("1", "2", "vbank", "abank", 100, idempotency_key=key)
+
+
+def test_failure_before_submit_is_retried_under_the_same_key(bank):
+    bank_helper, calls = bank
+
+    async def scenario():
+        # Аккаунтов ещё нет в БД — перевод падает до отправки платежа
+        with pytest.raises(ValueError):
+            await transfer(bank_helper)
+        await save_accounts(bank_helper)
+        return await transfer(bank_helper)
+
+    result = asyncio.run(scenario())
+
+    assert result["status"] == "success"
+    assert "replayed" not in result
+    assert calls["payments"] == 1
+
+
+def test_rejected_payment_is_replayed_as_error(bank):
+    bank_helper, calls = bank
+    calls["payment_status"] = 400
+
+    async def scenario():
+        await save_accounts(bank_helper)
+        with pytest.raises(HTTPException) as first:
+            await transfer(bank_helper)
+        with pytest.raises(HTTPException) as replay:
+            await transfer(bank_helper)
+        return first.value, replay.value
+
+    first, replay = asyncio.run(scenario())
+
+    assert first.status_code == replay.status_code == 502
+    assert calls["payments"] == 1     # в банк повторно не ходили
+
+
+def test_settled_transfer_is_replayed(bank):
+    bank_helper, calls = bank
+
+    async def scenario():
+        await save_accounts(bank_helper)
+        await transfer(bank_helper)
+        return await transfer(bank_helper)
+
+    result = asyncio.run(scenario())
+
+    assert result["status"] == "success" and result["replayed"]
+    assert calls["payments"] == 1
+
+
+def test_submit_without_answer_is_replayed_as_unknown(bank):
+    bank_helper, calls = bank
+    calls["submit_error"] = asyncio.TimeoutError()
+
+    async def scenario():
+        await save_accounts(bank_helper)
+        with pytest.raises(asyncio.TimeoutError):
+            await transfer(bank_helper)
+        return await transfer(bank_helper), await bank_helper.transfers.get("key-1")
+
+    result, stored = asyncio.run(scenario())
+
+    assert result["status"] == "unknown"
+    assert result["interaction_ids"] == [stored["attempts"][0]["interaction_id"]]
+    assert calls["payments"] == 1     # второй раз не платили
+
+
+def test_lost_submission_is_marked_unknown(bank_helper):
+    async def scenario():
+        await bank_helper.transfers.create("key-1", {"amount": 100})
+        await bank_helper.transfers.mark_submitted("key-1", "interaction-1")
+        assert await bank_helper.transfers.mark_lost_submissions(older_than=60) == 0
+        lost = await bank_helper.transfers.mark_lost_submissions(older_than=0)
+        return lost, await bank_helper.transfers.get("key-1")
+
+    lost, stored = asyncio.run(scenario())
+
+    assert lost == 1
+    assert stored["state"] == "unknown"
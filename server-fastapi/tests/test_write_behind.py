@@ -0,0 +1,58 @@
+from bankAPI.writeBehind import WriteBehind
+import asyncio, pytest
+
+
+class FakeCollection:
+    name = "global_users"
+
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.batches = []
+
+
+    async def bulk_write(self, operations, ordered=True):
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("mongo down")
+        self.batches.append(operations)
+
+
+def test_writes_to_one_key_are_coalesced_into_one_batch():
+    collection = FakeCollection()
+    writer = WriteBehind(interval=60)
+    flushed = []
+
+    async def after_flush():
+        flushed.append(1)
+
+    writer.on_flush("global_users", after_flush)
+
+    async def scenario():
+        writer.add(collection, "1", "op-1")
+        writer.add(collection, "1", "op-1b")
+        writer.add(collection, "2", "op-2")
+        await writer.flush()
+
+    asyncio.run(scenario())
+
+    assert collection.batches == [["op-1b", "op-2"]]
+    assert writer.stats["coalesced"] == 1 and writer.stats["written"] == 2
+    assert flushed == [1]
+
+
+def test_failed_flush_is_retried_without_overwriting_newer_writes():
+    collection = FakeCollection(fail=1)
+    writer = WriteBehind(interval=60)
+
+    async def scenario():
+        writer.add(collection, "1", "old")
+        writer.add(collection, "2", "op-2")
+        with pytest.raises(ConnectionError):
+            await writer.flush()
+        # Пока Mongo лежала, по ключу пришла новая запись — она и уходит
+        writer.add(collection, "1", "new")
+        await writer.close()
+
+    asyncio.run(scenario())
+
+    assert collection.batches == [["new", "op-2"]]